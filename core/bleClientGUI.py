@@ -1,45 +1,105 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
+import argparse
 import asyncio
 import threading
 import os
 import time
-from bleak import BleakClient, BleakScanner
-from datetime import datetime
 
-# BLE UUIDs - Match these with your Arduino code
-SERVICE_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
-COMMAND_CHAR_UUID = "6E400002-B5A3-F393-E0A9-E50E24DCCA9E"  # For sending commands
-DATA_CHAR_UUID = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"  # For receiving data
-
-# Commands - Match these with your Arduino code
-CMD_START_LOGGING = 'S'
-CMD_STOP_LOGGING = 'E'
-CMD_LIST_FILES = 'L'
-CMD_GET_FILE = 'G'
-CMD_DELETE_FILE = 'D'
+import numpy as np
+
+from form24.fleet import FleetSync
+from form24.live import LiveProcessor
+from form24.logbuffer import LOG_CAPACITY, LogBuffer, open_log_file, sink
+from form24.manifest import Manifest
+from form24.metrics import EVENT_METRICS, Histogram, MetricsLog, format_metrics
+from form24.tail import TAIL_INTERVAL, TailFollower
+from form24.transport import create_transport
+from form24.transfer import (
+    TransferEngine,
+    EVENT_LOG, EVENT_LOGGING_STARTED, EVENT_LOGGING_STOPPED, EVENT_FILE_LIST,
+    EVENT_TRANSFER_STARTED, EVENT_PROGRESS, EVENT_TRANSFER_COMPLETE, EVENT_ERROR,
+    EVENT_STREAMING, EVENT_SAMPLES,
+)
 
 # Create directory for downloaded files
 DOWNLOAD_DIR = "downloaded_files"
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
+# Log panes are updated with one insert per interval
+LOG_REFRESH_MS = 100
+
+# Live tab: redraw interval and seconds of signal shown
+LIVE_REFRESH_MS = 50
+LIVE_WINDOW_SECONDS = 10
+
 # Global variables
 connected_device = None
 ble_loop = None
-file_transfer_in_progress = False
-current_file_data = bytearray()
-current_file_name = ""
-file_size = 0
-bytes_received = 0
 is_logging = False
 
+class LogPane:
+    """Read-only ScrolledText showing the last lines of a LogBuffer
+
+    write() may be called from any thread. flush() runs on the Tk thread once
+    per tick, inserts everything written since the last tick at once and
+    trims the oldest lines beyond the buffer's capacity.
+    """
+
+    def __init__(self, parent, name, capacity=LOG_CAPACITY, **kwargs):
+        self.buffer = LogBuffer(capacity, sink(name))
+        self.text = scrolledtext.ScrolledText(parent, **kwargs)
+        self.text.config(state=tk.DISABLED)
+
+    def write(self, message):
+        self.buffer.append(message)
+
+    def flush(self):
+        text = self.buffer.drain()
+        if not text:
+            return
+        # Only follow new lines if the user has not scrolled up
+        following = self.text.yview()[1] >= 1.0
+        self.text.config(state=tk.NORMAL)
+        self.text.insert(tk.END, text)
+        lines = int(self.text.index("end-1c").split(".")[0]) - 1
+        if lines > self.buffer.capacity:
+            self.text.delete("1.0", f"{lines - self.buffer.capacity + 1}.0")
+        self.text.config(state=tk.DISABLED)
+        if following:
+            self.text.see(tk.END)
+
+
 class ESP32LoggerGUI:
-    def __init__(self, root):
+    def __init__(self, root, transport=None, metrics_log=None):
         self.root = root
+        # Real BLE unless a simulated transport is passed in
+        self.transport = transport or create_transport()
         self.root.title("ESP32 IMU Logger")
         self.root.geometry("800x600")
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
+        # Index of the downloaded files, shared with the engine and fleet sync
+        self.manifest = Manifest(DOWNLOAD_DIR)
+        self._download_rows = {}
+
+        # The transfer engine runs on the BLE loop thread, the GUI only renders its events
+        self.engine = TransferEngine(DOWNLOAD_DIR, manifest=self.manifest)
+        self.engine.subscribe(self._on_engine_event)
+        
+        # Transfer metrics, with the time engine events wait in the Tk queue
+        # since the last download was requested. metrics_log keeps one line per download
+        self.metrics_log = metrics_log
+        self.gui_queue = Histogram()
+        
+        # Follows the file being logged, while "Fetch while logging" is on
+        self.tail_follower = None
+        
+        # Live samples are processed on the BLE loop thread, the Live tab polls the result
+        self.live = LiveProcessor()
+        self.engine.subscribe(self.live.on_event)
+        self.live_version = 0
+        
         # Create a notebook (tabbed interface)
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -56,10 +116,15 @@ class ESP32LoggerGUI:
         self.file_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.file_frame, text="File Management")
         
+        # Live tab
+        self.live_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.live_frame, text="Live")
+        
         # Setup each tab
         self.setup_connection_tab()
         self.setup_logging_tab()
         self.setup_file_management_tab()
+        self.setup_live_tab()
         
         # Status bar at the bottom
         self.status_var = tk.StringVar()
@@ -80,6 +145,8 @@ class ESP32LoggerGUI:
         
         # Start the background tasks
         self.start_async_loop()
+        self.root.after(LOG_REFRESH_MS, self.flush_logs)
+        self.root.after(LIVE_REFRESH_MS, self.refresh_live)
 
     def setup_connection_tab(self):
         # Device scanning and connection
@@ -102,9 +169,8 @@ class ESP32LoggerGUI:
         log_frame = ttk.LabelFrame(self.conn_frame, text="Connection Log")
         log_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        self.conn_log = scrolledtext.ScrolledText(log_frame, height=10)
-        self.conn_log.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        self.conn_log.config(state=tk.DISABLED)
+        self.conn_log = LogPane(log_frame, "connection", height=10)
+        self.conn_log.text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
     def setup_logging_tab(self):
         # Logging controls
@@ -119,6 +185,11 @@ class ESP32LoggerGUI:
                                           command=self.stop_logging, state=tk.DISABLED)
         self.stop_logging_btn.pack(side=tk.LEFT, padx=5, pady=5)
         
+        # Fetch the new part of the file being logged every TAIL_INTERVAL seconds
+        self.tail_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text=f"Fetch while logging (every {TAIL_INTERVAL:g} s)",
+                        variable=self.tail_var, command=self.toggle_tail).pack(side=tk.LEFT, padx=5, pady=5)
+        
         # Logging status
         status_frame = ttk.LabelFrame(self.logging_frame, text="Logging Status")
         status_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -132,9 +203,8 @@ class ESP32LoggerGUI:
         log_frame = ttk.LabelFrame(self.logging_frame, text="Log Messages")
         log_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        self.logging_log = scrolledtext.ScrolledText(log_frame)
-        self.logging_log.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        self.logging_log.config(state=tk.DISABLED)
+        self.logging_log = LogPane(log_frame, "logging")
+        self.logging_log.text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
     def setup_file_management_tab(self):
         # File list
@@ -165,6 +235,17 @@ class ESP32LoggerGUI:
                                     command=self.delete_selected_file, state=tk.DISABLED)
         self.delete_btn.pack(side=tk.LEFT, padx=5, pady=5)
         
+        # Ask the logger to deflate files on the way, CSV logs shrink to less than half
+        self.compress_var = tk.BooleanVar(value=True)
+        self.compress_check = ttk.Checkbutton(button_frame, text="Compressed transfer",
+                                              variable=self.compress_var)
+        self.compress_check.pack(side=tk.LEFT, padx=5, pady=5)
+        
+        # Fleet sync does not need a connection, it scans and connects on its own
+        self.sync_all_btn = ttk.Button(button_frame, text="Sync All Loggers", 
+                                      command=self.sync_all_loggers)
+        self.sync_all_btn.pack(side=tk.RIGHT, padx=5, pady=5)
+        
         # Transfer progress
         progress_frame = ttk.LabelFrame(self.file_frame, text="Transfer Progress")
         progress_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -176,6 +257,14 @@ class ESP32LoggerGUI:
         self.progress_label = ttk.Label(progress_frame, text="No transfer in progress")
         self.progress_label.pack(padx=5, pady=5)
         
+        # Metrics of the current or last download
+        stats_frame = ttk.LabelFrame(self.file_frame, text="Transfer Stats")
+        stats_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        self.stats_var = tk.StringVar()
+        self.stats_var.set("No transfer yet")
+        ttk.Label(stats_frame, textvariable=self.stats_var, justify=tk.LEFT).pack(anchor=tk.W, padx=5, pady=5)
+        
         # Downloaded files
         downloads_frame = ttk.LabelFrame(self.file_frame, text="Downloaded Files")
         downloads_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -191,6 +280,42 @@ class ESP32LoggerGUI:
         # Populate downloads list
         self.update_downloads_list()
         
+    def setup_live_tab(self):
+        # Streaming controls
+        control_frame = ttk.Frame(self.live_frame)
+        control_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.start_stream_btn = ttk.Button(control_frame, text="Start Streaming", 
+                                          command=self.start_streaming, state=tk.DISABLED)
+        self.start_stream_btn.pack(side=tk.LEFT, padx=5, pady=5)
+        
+        self.stop_stream_btn = ttk.Button(control_frame, text="Stop Streaming", 
+                                         command=self.stop_streaming, state=tk.DISABLED)
+        self.stop_stream_btn.pack(side=tk.LEFT, padx=5, pady=5)
+        
+        self.stream_status_var = tk.StringVar()
+        self.stream_status_var.set("Not streaming")
+        ttk.Label(control_frame, textvariable=self.stream_status_var).pack(side=tk.LEFT, padx=10)
+        
+        # Stroke rate readout
+        readout_frame = ttk.LabelFrame(self.live_frame, text="Stroke Rate")
+        readout_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.stroke_rate_var = tk.StringVar()
+        self.stroke_rate_var.set("-- SPM")
+        ttk.Label(readout_frame, textvariable=self.stroke_rate_var,
+                  font=("Arial", 24, "bold")).pack(side=tk.LEFT, padx=10, pady=5)
+        
+        self.live_info_var = tk.StringVar()
+        ttk.Label(readout_frame, textvariable=self.live_info_var).pack(side=tk.LEFT, padx=10, pady=5)
+        
+        # Plot of the last LIVE_WINDOW_SECONDS of AccelZ, raw and smoothed
+        plot_frame = ttk.LabelFrame(self.live_frame, text=f"AccelZ, last {LIVE_WINDOW_SECONDS} s")
+        plot_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        self.live_canvas = tk.Canvas(plot_frame, background="white", height=200)
+        self.live_canvas.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
     def update_device_state(self, state):
         """Update the device state display in the UI"""
         state_colors = {
@@ -208,35 +333,41 @@ class ESP32LoggerGUI:
             self.state_value.config(foreground="black")
 
     def update_downloads_list(self):
-        """Update the list of downloaded files"""
-        # Clear the list
+        """Fill the list of downloaded files from the manifest"""
         self.downloads_list.delete(0, tk.END)
-        
-        # Get all files in the downloads directory
+        self._download_rows = {}
         try:
-            files = os.listdir(DOWNLOAD_DIR)
-            for file in sorted(files):
-                if os.path.isfile(os.path.join(DOWNLOAD_DIR, file)):
-                    size = os.path.getsize(os.path.join(DOWNLOAD_DIR, file))
-                    self.downloads_list.insert(tk.END, f"{file} ({size} bytes)")
+            for entry in self.manifest.files():
+                self._show_download(entry)
         except Exception as e:
             self.log_to_connection(f"Error updating downloads list: {str(e)}")
 
+    def _show_download(self, entry):
+        """Add a manifest entry to the downloads list, or update its line"""
+        line = f"{entry.path} ({entry.size} bytes)"
+        index = self._download_rows.get(entry.path)
+        if index is None:
+            self._download_rows[entry.path] = self.downloads_list.size()
+            self.downloads_list.insert(tk.END, line)
+        else:
+            self.downloads_list.delete(index)
+            self.downloads_list.insert(index, line)
+
     def log_to_connection(self, message):
-        """Add a message to the connection log with timestamp"""
-        self.conn_log.config(state=tk.NORMAL)
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.conn_log.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.conn_log.see(tk.END)
-        self.conn_log.config(state=tk.DISABLED)
+        """Add a message to the connection log with timestamp, from any thread"""
+        self.conn_log.write(message)
 
     def log_to_logging(self, message):
-        """Add a message to the logging tab with timestamp"""
-        self.logging_log.config(state=tk.NORMAL)
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.logging_log.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.logging_log.see(tk.END)
-        self.logging_log.config(state=tk.DISABLED)
+        """Add a message to the logging tab with timestamp, from any thread"""
+        self.logging_log.write(message)
+
+    def flush_logs(self):
+        """Show new log messages, runs every LOG_REFRESH_MS"""
+        try:
+            self.conn_log.flush()
+            self.logging_log.flush()
+        finally:
+            self.root.after(LOG_REFRESH_MS, self.flush_logs)
 
     def scan_for_devices(self):
         self.device_list.set("Scanning...")
@@ -248,7 +379,7 @@ class ESP32LoggerGUI:
 
     async def _scan_devices(self):
         try:
-            devices = await BleakScanner.discover()
+            devices = await self.transport.discover()
             device_dict = {}
             
             for device in devices:
@@ -297,7 +428,8 @@ class ESP32LoggerGUI:
         global connected_device
         
         try:
-            client = BleakClient(address)
+            client = self.transport.client(address)
+            self.engine.device = address
             await client.connect()
             
             if client.is_connected:
@@ -306,8 +438,8 @@ class ESP32LoggerGUI:
                 # Update UI in the main thread
                 self.root.after(0, lambda: self._update_ui_on_connect())
                 
-                # Set up notification handler
-                await client.start_notify(DATA_CHAR_UUID, self._notification_handler)
+                # Hand notifications to the transfer engine
+                await self.engine.attach(client)
                 self.root.after(0, lambda: self.log_to_connection("Connected and listening for notifications"))
             else:
                 self.root.after(0, lambda: self.log_to_connection("Failed to connect"))
@@ -315,151 +447,102 @@ class ESP32LoggerGUI:
         except Exception as e:
             self.root.after(0, lambda: self.log_to_connection(f"Connection error: {str(e)}"))
 
-    def _notification_handler(self, sender, data):
-        # Process incoming notifications in the main thread
-        try:
-            message = data.decode('utf-8')
-            self.root.after(0, lambda: self._process_notification(message))
-        except UnicodeDecodeError:
-            # Handle binary data (file transfer)
-            self.root.after(0, lambda: self._process_binary_data(data))
+    def _on_engine_event(self, event, payload):
+        # Called on the BLE loop thread, hand the event over to the Tk thread.
+        # Samples are left to the LiveProcessor, the Live tab polls it
+        if event != EVENT_SAMPLES:
+            queued = time.monotonic()
+            self.root.after(0, lambda: self._render_engine_event(event, payload, queued))
 
-    def _process_notification(self, message):
-        global file_transfer_in_progress, current_file_name, current_file_data
-        global file_size, bytes_received, is_logging
+    def _render_engine_event(self, event, payload, queued):
+        global is_logging
         
-        self.log_to_connection(f"Received: {message[:50]}{'...' if len(message) > 50 else ''}")
+        self.gui_queue.add(time.monotonic() - queued)
         
-        # Handle different message types
-        if message.startswith("Logging started:"):
-            filename = message.split(":", 1)[1].strip()
+        if event == EVENT_LOG:
+            self.log_to_connection(payload["message"])
+            
+        elif event == EVENT_ERROR:
+            self.log_to_connection(payload["message"])
+            
+        elif event == EVENT_LOGGING_STARTED:
+            filename = payload["filename"]
             self.logging_status_var.set(f"Logging to {filename}")
             self.log_to_logging(f"Started logging to {filename}")
             is_logging = True
             self.update_device_state("Logging")
+            if self.tail_var.get() and ble_loop:
+                asyncio.run_coroutine_threadsafe(self._follow_log(filename, self.compress_var.get()), ble_loop)
             
-        elif message.startswith("Logging stopped:"):
-            filename = message.split(":", 1)[1].strip()
+        elif event == EVENT_LOGGING_STOPPED:
+            filename = payload["filename"]
             self.logging_status_var.set("Not logging")
             self.log_to_logging(f"Stopped logging to {filename}")
             is_logging = False
             self.update_device_state("Connected")
             
-        elif message.startswith("Files on SD card:"):
-            # Clear the file list
-            self.file_list.delete(0, tk.END)
-            
-            # Add files to the list
-            lines = message.split("\n")
-            for line in lines[1:]:  # Skip the header
-                if line.strip():
-                    file_info = line.strip()
-                    self.file_list.insert(tk.END, file_info)
-            
-        elif message.startswith("Transfer starting:"):
-            # Extract filename and size
-            parts = message.split("(")
-            current_file_name = parts[0].split(":", 1)[1].strip()
-            try:
-                file_size = int(parts[1].split(" ")[0])
-            except ValueError:
-                # Handle potential formatting issues
-                self.log_to_connection(f"Warning: Could not parse file size from '{parts[1]}'")
-                file_size = 0
-            
-            # Reset transfer state
-            current_file_data = bytearray()
-            bytes_received = 0
-            file_transfer_in_progress = True
+        elif event == EVENT_STREAMING:
+            self.stream_status_var.set("Streaming while logging" if payload["enabled"] else "Not streaming")
+            self.log_to_logging("Streaming started" if payload["enabled"] else "Streaming stopped")
             
-            # Update device state
+        elif event == EVENT_FILE_LIST:
+            self.file_list.delete(0, tk.END)
+            self.file_list.insert(tk.END, *(f"{entry.name} ({entry.size} bytes)" for entry in payload["files"]))
+                
+        elif event == EVENT_TRANSFER_STARTED:
             self.update_device_state("Transferring")
-            
-            # Update progress UI
             self.progress_var.set(0)
-            self.progress_label.config(text=f"Receiving {current_file_name} (0%)")
-            self.log_to_connection(f"Starting file transfer for {current_file_name} ({file_size} bytes)")
-            
-        elif message == "Transfer complete":
-            # Save the received file
-            if current_file_name and len(current_file_data) > 0:
-                self._save_received_file()
-                self.log_to_connection(f"Transfer complete, received {bytes_received} bytes")
+            self.progress_label.config(text=f"Receiving {payload['filename']} (0%)")
+            if payload["offset"] > 0:
+                self.log_to_connection(f"Resuming file transfer for {payload['filename']} "
+                                       f"from byte {payload['offset']} of {payload['size']}")
             else:
-                self.log_to_connection(f"Transfer complete, but no data received")
-                
-            # Reset transfer state
-            file_transfer_in_progress = False
-            current_file_name = ""
-            self.progress_label.config(text="Transfer complete")
-            
-            # Update device state
-            self.update_device_state("Connected")
-            
-        elif file_transfer_in_progress:
-            # This is file data
-            current_file_data.extend(message.encode('utf-8'))
-            bytes_received += len(message)
-            
-            # Update progress
-            if file_size > 0:
-                progress = (bytes_received * 100) / file_size
-                self.progress_var.set(progress)
-                self.progress_label.config(text=f"Receiving {current_file_name} ({int(progress)}%)")
-                
-                # Log progress every 20%
-                if int(progress) % 20 == 0:
-                    self.log_to_connection(f"Download progress: {int(progress)}%")
-
-    def _process_binary_data(self, data):
-        global current_file_data, bytes_received, file_size, file_transfer_in_progress
-        
-        if file_transfer_in_progress:
-            # Add the binary data to our buffer
-            current_file_data.extend(data)
-            bytes_received += len(data)
-            
-            # Update progress
-            if file_size > 0:
-                progress = (bytes_received * 100) / file_size
-                self.progress_var.set(progress)
-                self.progress_label.config(text=f"Receiving {current_file_name} ({int(progress)}%)")
-                
-                # Log progress every 20%
-                if int(progress) % 20 == 0 and int(progress) > 0:
-                    self.log_to_connection(f"Download binary progress: {int(progress)}%")
-    
-    def _save_received_file(self):
-        global current_file_name, current_file_data
-        
-        if not current_file_name:
-            self.log_to_connection("Error: No filename for received data")
-            return
-        
-        if len(current_file_data) == 0:
-            self.log_to_connection("Error: No data received to save")
-            return
-        
-        # Make sure the filename doesn't have any leading slashes
-        clean_filename = current_file_name.lstrip('/')
-        file_path = os.path.join(DOWNLOAD_DIR, clean_filename)
-        
-        try:
-            self.log_to_connection(f"Saving file: {file_path} ({len(current_file_data)} bytes)")
+                self.log_to_connection(f"Starting file transfer for {payload['filename']} ({payload['size']} bytes)")
+            if payload["encoding"]:
+                self.log_to_connection(f"Device is sending {payload['encoding']} compressed data")
             
-            # Create the directory if it doesn't exist
-            os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        elif event == EVENT_PROGRESS:
+            self.progress_var.set(payload["percent"])
+            self.progress_label.config(text=f"Receiving {payload['filename']} ({int(payload['percent'])}%)")
             
-            with open(file_path, "wb") as f:
-                f.write(current_file_data)
+        elif event == EVENT_TRANSFER_COMPLETE:
+            self.log_to_connection(f"File saved successfully: {payload['path']}")
+            self.progress_var.set(100)
+            self.progress_label.config(text="Transfer complete")
+            if payload["wire_bytes"] != payload["received"]:
+                self.log_to_connection(f"Received {payload['wire_bytes']} bytes over the link "
+                                       f"for {payload['received']} bytes of file data")
+            self.update_device_state("Connected")
+            entry = self.manifest.get(payload["path"])
+            if entry is not None:
+                self._show_download(entry)
                 
-            self.log_to_connection(f"File saved successfully: {file_path}")
-            self.update_downloads_list()
-            
-        except Exception as e:
-            self.log_to_connection(f"Error saving file: {str(e)}")
-            import traceback
-            self.log_to_connection(traceback.format_exc())
+        elif event == EVENT_METRICS:
+            record = dict(payload["metrics"], gui_queue=self.gui_queue.as_dict())
+            self._show_metrics(record)
+            if payload["final"]:
+                self.log_to_connection(f"Transfer metrics: {format_metrics(record)}")
+                if self.metrics_log is not None:
+                    try:
+                        self.metrics_log.write(record)
+                    except OSError as e:
+                        self.log_to_connection(f"Error writing metrics: {str(e)}")
+
+    def _show_metrics(self, record):
+        """Fill the Transfer Stats panel from a metrics dict"""
+        arrival = record["inter_arrival"]
+        queue = record["gui_queue"]
+        link = "device default"
+        if record["frame_size"]:
+            link = f"{record['frame_size']} B frames every {record['chunk_interval_ms']:.0f} ms"
+        self.stats_var.set(
+            f"{record['filename']} ({record['outcome']}): {record['bytes_per_s'] / 1024:.1f} KB/s, "
+            f"{record['notifications']} notifications, link {link}\n"
+            f"Between notifications: {arrival['mean_ms']:.1f} ms mean, p95 {arrival['p95_ms']:.0f} ms, "
+            f"max {arrival['max_ms']:.0f} ms, {record['gaps']} gaps\n"
+            f"Lost frames {record['lost_frames']}, corrupt {record['corrupt_frames']}, "
+            f"stalls {record['stalls']}, retries {record['retries']}\n"
+            f"GUI queue: {queue['mean_ms']:.1f} ms mean, p95 {queue['p95_ms']:.0f} ms, max {queue['max_ms']:.0f} ms")
 
     def _update_ui_on_connect(self):
         self.status_var.set("Connected")
@@ -472,6 +555,8 @@ class ESP32LoggerGUI:
         self.refresh_btn.config(state=tk.NORMAL)
         self.download_btn.config(state=tk.NORMAL)
         self.delete_btn.config(state=tk.NORMAL)
+        self.start_stream_btn.config(state=tk.NORMAL)
+        self.stop_stream_btn.config(state=tk.NORMAL)
         
         # Refresh the file list
         self.refresh_file_list()
@@ -490,6 +575,7 @@ class ESP32LoggerGUI:
             if is_logging:
                 await self._stop_logging()
             
+            await self.engine.detach()
             try:
                 await connected_device.disconnect()
             except Exception as e:
@@ -511,11 +597,38 @@ class ESP32LoggerGUI:
         self.refresh_btn.config(state=tk.DISABLED)
         self.download_btn.config(state=tk.DISABLED)
         self.delete_btn.config(state=tk.DISABLED)
+        self.start_stream_btn.config(state=tk.DISABLED)
+        self.stop_stream_btn.config(state=tk.DISABLED)
+        self.stream_status_var.set("Not streaming")
         
         # Update logging status
         self.logging_status_var.set("Not logging")
         is_logging = False
 
+    def toggle_tail(self):
+        """Stop following the current file when "Fetch while logging" is turned off"""
+        follower = self.tail_follower
+        if not self.tail_var.get() and follower is not None and ble_loop:
+            ble_loop.call_soon_threadsafe(follower.stop)
+
+    async def _follow_log(self, filename, compress=False):
+        # Runs on the BLE loop until logging stops, every fetch is rendered from engine events
+        follower = TailFollower(self.engine, filename, compress=compress,
+                                on_fetch=lambda path, received: self.log_to_logging(
+                                    f"Fetched {received} new bytes of {os.path.basename(path)}"))
+        self.tail_follower = follower
+        self.engine.subscribe(follower.on_event)
+        try:
+            path = await follower.run()
+            self.log_to_logging(f"{os.path.basename(path)} saved, {follower.bytes_fetched} bytes "
+                                f"in {follower.fetches} fetches")
+        except Exception as e:
+            self.log_to_logging(f"Stopped fetching {filename}: {str(e)}")
+        finally:
+            self.engine.unsubscribe(follower.on_event)
+            if self.tail_follower is follower:
+                self.tail_follower = None
+
     def start_logging(self):
         if connected_device and ble_loop:
             asyncio.run_coroutine_threadsafe(self._start_logging(), ble_loop)
@@ -524,7 +637,7 @@ class ESP32LoggerGUI:
         if connected_device:
             try:
                 # Send the start logging command
-                await connected_device.write_gatt_char(COMMAND_CHAR_UUID, CMD_START_LOGGING.encode())
+                await self.engine.start_logging()
                 self.root.after(0, lambda: self.log_to_logging("Sent start logging command"))
             except Exception as e:
                 self.root.after(0, lambda: self.log_to_logging(f"Error starting logging: {str(e)}"))
@@ -537,11 +650,79 @@ class ESP32LoggerGUI:
         if connected_device:
             try:
                 # Send the stop logging command
-                await connected_device.write_gatt_char(COMMAND_CHAR_UUID, CMD_STOP_LOGGING.encode())
+                await self.engine.stop_logging()
                 self.root.after(0, lambda: self.log_to_logging("Sent stop logging command"))
             except Exception as e:
                 self.root.after(0, lambda: self.log_to_logging(f"Error stopping logging: {str(e)}"))
 
+    def start_streaming(self):
+        if connected_device and ble_loop:
+            asyncio.run_coroutine_threadsafe(self._set_streaming(True), ble_loop)
+
+    def stop_streaming(self):
+        if connected_device and ble_loop:
+            asyncio.run_coroutine_threadsafe(self._set_streaming(False), ble_loop)
+
+    async def _set_streaming(self, enabled):
+        if connected_device:
+            try:
+                if enabled:
+                    await self.engine.start_streaming()
+                else:
+                    await self.engine.stop_streaming()
+            except Exception as e:
+                self.root.after(0, lambda: self.log_to_logging(f"Error changing streaming: {str(e)}"))
+
+    def refresh_live(self):
+        """Redraw the Live tab if new samples arrived, runs every LIVE_REFRESH_MS"""
+        try:
+            snapshot = self.live.snapshot()
+            if snapshot.version != self.live_version:
+                self.live_version = snapshot.version
+                if snapshot.stroke_rate is None:
+                    self.stroke_rate_var.set("-- SPM")
+                else:
+                    self.stroke_rate_var.set(f"{snapshot.stroke_rate:.1f} SPM")
+                self.live_info_var.set(f"{snapshot.strokes} strokes   {snapshot.sample_rate:.0f} Hz   "
+                                       f"delay {snapshot.delay * 1000:.0f} ms")
+                if self.notebook.select() == str(self.live_frame):
+                    self._draw_live_plot(snapshot)
+        finally:
+            self.root.after(LIVE_REFRESH_MS, self.refresh_live)
+
+    def _draw_live_plot(self, snapshot):
+        canvas = self.live_canvas
+        canvas.delete("all")
+        width = canvas.winfo_width()
+        height = canvas.winfo_height()
+        if len(snapshot.times) < 2 or width < 10 or height < 10:
+            return
+        
+        start = snapshot.times[-1] - LIVE_WINDOW_SECONDS
+        shown = snapshot.times >= start
+        low = snapshot.values[shown].min()
+        high = snapshot.values[shown].max()
+        span = (high - low) or 1.0
+        
+        def points(times, values):
+            # At most one point per pixel column
+            keep = times >= start
+            times, values = times[keep], values[keep]
+            step = max(1, len(times) // width)
+            x = (times[::step] - start) * (width / LIVE_WINDOW_SECONDS)
+            y = height - 5 - (values[::step] - low) * ((height - 10) / span)
+            return np.column_stack((x, y)).ravel().tolist()
+        
+        raw = points(snapshot.times, snapshot.values)
+        if len(raw) >= 4:
+            canvas.create_line(*raw, fill="lightgray")
+        smoothed = points(snapshot.smoothed_times, snapshot.smoothed)
+        if len(smoothed) >= 4:
+            canvas.create_line(*smoothed, fill="orange", width=2)
+        peaks = points(snapshot.peak_times, snapshot.peak_values)
+        for x, y in zip(peaks[::2], peaks[1::2]):
+            canvas.create_text(x, y, text="x", fill="red", font=("Arial", 12, "bold"))
+
     def refresh_file_list(self):
         if connected_device and ble_loop:
             asyncio.run_coroutine_threadsafe(self._refresh_file_list(), ble_loop)
@@ -552,9 +733,9 @@ class ESP32LoggerGUI:
                 # Clear the file list
                 self.root.after(0, lambda: self.file_list.delete(0, tk.END))
                 
-                # Send the list files command
-                await connected_device.write_gatt_char(COMMAND_CHAR_UUID, CMD_LIST_FILES.encode())
+                # Send the list files command, the listing arrives as an engine event
                 self.root.after(0, lambda: self.log_to_connection("Requested file list"))
+                await self.engine.list_files()
             except Exception as e:
                 self.root.after(0, lambda: self.log_to_connection(f"Error refreshing file list: {str(e)}"))
 
@@ -577,25 +758,20 @@ class ESP32LoggerGUI:
             filename = file_info
             
         if ble_loop:
-            asyncio.run_coroutine_threadsafe(self._download_file(filename), ble_loop)
+            compress = self.compress_var.get()
+            self.gui_queue = Histogram()
+            asyncio.run_coroutine_threadsafe(self._download_file(filename, compress), ble_loop)
 
-    async def _download_file(self, filename):
-        global file_transfer_in_progress, current_file_data, bytes_received
-        
+    async def _download_file(self, filename, compress=False):
         if connected_device:
             try:
-                # Reset any existing transfer state
-                file_transfer_in_progress = False
-                current_file_data = bytearray()
-                bytes_received = 0
-                
-                # Send the get file command
-                command = f"{CMD_GET_FILE}{filename}"
-                self.log_to_connection(f"Sending download command: {command}")
-                await connected_device.write_gatt_char(COMMAND_CHAR_UUID, command.encode())
                 self.root.after(0, lambda: self.log_to_connection(f"Requested download of {filename}"))
+                # Progress and completion are rendered from engine events. If a
+                # part file is left from an interrupted download, only the rest is fetched
+                await self.engine.download(filename, compress=compress)
             except Exception as e:
                 self.root.after(0, lambda: self.log_to_connection(f"Error downloading file: {str(e)}"))
+                self.root.after(0, lambda: self.update_device_state("Connected"))
 
     def delete_selected_file(self):
         if not connected_device:
@@ -624,17 +800,33 @@ class ESP32LoggerGUI:
         if connected_device:
             try:
                 # Send the delete file command
-                command = f"{CMD_DELETE_FILE}{filename}"
-                await connected_device.write_gatt_char(COMMAND_CHAR_UUID, command.encode())
                 self.root.after(0, lambda: self.log_to_connection(f"Requested deletion of {filename}"))
+                await self.engine.delete_file(filename)
                 
-                # Refresh the file list after a short delay
-                await asyncio.sleep(1)
+                # Refresh the file list
                 await self._refresh_file_list()
                 
             except Exception as e:
                 self.root.after(0, lambda: self.log_to_connection(f"Error deleting file: {str(e)}"))
 
+    def sync_all_loggers(self):
+        if ble_loop:
+            self.sync_all_btn.config(state=tk.DISABLED)
+            compress = self.compress_var.get()
+            asyncio.run_coroutine_threadsafe(self._sync_all_loggers(compress), ble_loop)
+
+    async def _sync_all_loggers(self, compress=False):
+        fleet = FleetSync(DOWNLOAD_DIR, transport=self.transport, compress=compress, manifest=self.manifest,
+                          log=lambda message: self.root.after(0, lambda: self.log_to_connection(message)))
+        try:
+            report = await fleet.run()
+            summary = report.summary()
+            self.root.after(0, lambda: self.log_to_connection(f"Fleet sync finished: {summary}"))
+        except Exception as e:
+            self.root.after(0, lambda: self.log_to_connection(f"Fleet sync error: {str(e)}"))
+        self.root.after(0, lambda: self.sync_all_btn.config(state=tk.NORMAL))
+        self.root.after(0, self.update_downloads_list)
+
     def start_async_loop(self):
         global ble_loop
         
@@ -668,10 +860,26 @@ class ESP32LoggerGUI:
         if ble_loop:
             ble_loop.call_soon_threadsafe(ble_loop.stop)
         
+        # Close the manifest database
+        self.manifest.close()
+        
         # Destroy the window
         self.root.destroy()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ESP32 IMU Logger control interface")
+    parser.add_argument("--simulate", metavar="DIR",
+                        help="connect to a simulated logger whose SD card holds the files in DIR")
+    parser.add_argument("--log-file", metavar="PATH",
+                        help="keep the full log history in a rotating file at PATH")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="append the metrics of every download to a JSON-lines file at PATH")
+    args = parser.parse_args()
+    
+    if args.log_file:
+        open_log_file(args.log_file)
+    
     root = tk.Tk()
-    app = ESP32LoggerGUI(root)
+    app = ESP32LoggerGUI(root, create_transport(args.simulate),
+                         MetricsLog(args.metrics_file) if args.metrics_file else None)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1 @@
+"""pytest setup: the tests import form24 from this directory"""
@@ -0,0 +1,5 @@
+"""Host-side tools for the FORM24 IMU logger
+
+The modules in this package do not import tkinter, so they can be used by
+the GUI (bleClientGUI.py) as well as by headless scripts.
+"""
@@ -0,0 +1,373 @@
+"""Command line entry point, run from the core directory:
+
+    python -m form24 fleet --max-concurrent 4
+    python -m form24 sync --device AA:BB:CC:DD:EE:FF --delete
+    python -m form24 sync --watch --metrics transfers.jsonl
+    python -m form24 metrics transfers.jsonl
+    python -m form24 tail --device AA:BB:CC:DD:EE:FF --interval 10
+    python -m form24 bench transfer --out report.json
+    python -m form24 bench compression
+    python -m form24 bench listing --files 10000
+    python -m form24 bench mtu --mtus 23,185,512
+    python -m form24 convert downloaded_files/*.csv
+    python -m form24 analyze --out summary.csv
+    python -m form24 analyze downloaded_files/IMU_0_00-17-14.csv --start 4 --end 80
+    python -m form24 tune --labels stroke_labels.csv --random 200
+    python -m form24 spectral downloaded_files/swim1_25m_slowstrokerate.csv
+"""
+
+import argparse
+import asyncio
+import sys
+
+from .benchmark import DEFAULT_FILE_COUNTS, DEFAULT_MTUS, DEFAULT_SIZES, RENDER_COST
+from .simulator import CHUNK_INTERVAL
+
+DOWNLOAD_DIR = "downloaded_files"
+
+
+def make_transport(args):
+    from .simulator import LinkConditions
+    from .transport import create_transport
+
+    if not args.simulate:
+        return create_transport()
+    link = LinkConditions(latency=args.sim_latency, jitter=args.sim_jitter, mtu=args.sim_mtu,
+                          loss=args.sim_loss)
+    return create_transport(args.simulate, count=args.sim_devices, link=link,
+                            chunk_interval=args.sim_chunk_interval)
+
+
+def add_transport_arguments(parser):
+    group = parser.add_argument_group("simulation", "use simulated loggers instead of BLE")
+    group.add_argument("--simulate", metavar="DIR", help="simulate loggers whose SD card holds the files in DIR")
+    group.add_argument("--sim-devices", type=int, default=1, help="number of simulated loggers")
+    group.add_argument("--sim-latency", type=float, default=0.0, help="link latency in seconds")
+    group.add_argument("--sim-jitter", type=float, default=0.0, help="extra random latency in seconds")
+    group.add_argument("--sim-mtu", type=int, default=517, help="ATT MTU of the link")
+    group.add_argument("--sim-loss", type=float, default=0.0, help="probability of dropping a notification")
+    group.add_argument("--sim-chunk-interval", type=float, default=CHUNK_INTERVAL,
+                       help="seconds between file chunks on the simulated logger")
+
+
+def make_metrics_log(args):
+    from .metrics import MetricsLog
+
+    return MetricsLog(args.metrics) if args.metrics else None
+
+
+def cmd_fleet(args):
+    from .fleet import FleetSync
+
+    with FleetSync(args.dest, max_concurrent=args.max_concurrent, log=print,
+                   transport=make_transport(args), compress=args.compress,
+                   metrics_log=make_metrics_log(args)) as fleet:
+        report = asyncio.run(fleet.run(scan_timeout=args.scan_timeout))
+    print(report.summary())
+    return 1 if any(device.error or device.failed for device in report.devices) else 0
+
+
+def cmd_sync(args):
+    from .fleet import FleetSync
+    from .sync import DockWatcher, sync_once
+
+    with FleetSync(args.dest, max_concurrent=args.max_concurrent, log=print,
+                   transport=make_transport(args), compress=args.compress, delete=args.delete,
+                   metrics_log=make_metrics_log(args)) as fleet:
+        if args.watch:
+            watcher = DockWatcher(fleet, target=args.device, interval=args.interval,
+                                  scan_timeout=args.scan_timeout,
+                                  on_report=lambda report: print(report.summary()))
+            try:
+                asyncio.run(watcher.run())
+            except KeyboardInterrupt:
+                pass
+            return 0
+        report = asyncio.run(sync_once(fleet, target=args.device, scan_timeout=args.scan_timeout))
+    print(report.summary())
+    if not report.devices:
+        return 1
+    return 1 if any(device.error or device.failed for device in report.devices) else 0
+
+
+def cmd_tail(args):
+    from .tail import follow
+
+    try:
+        path = asyncio.run(follow(make_transport(args), args.file, target=args.device, dest=args.dest,
+                                  interval=args.interval, compress=args.compress, start=args.start,
+                                  scan_timeout=args.scan_timeout))
+    except KeyboardInterrupt:
+        return 0
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return 1
+    print(f"Logging stopped, saved {path}")
+    return 0
+
+
+def cmd_metrics(args):
+    from .metrics import format_metrics, read_metrics
+
+    for path in args.files:
+        for record in read_metrics(path):
+            status = f" ({record['outcome']}: {record['error']})" if record["error"] else ""
+            print(f"{record['device'] or '-'} {format_metrics(record)}{status}")
+    return 0
+
+
+def cmd_convert(args):
+    import os
+    from .logformat import CSV_SUFFIX, csv_to_log, log_to_csv
+
+    for path in args.files:
+        if path.lower().endswith(CSV_SUFFIX):
+            out, records, bad_lines = csv_to_log(path)
+            print(f"{path} -> {out}: {len(records)} samples, "
+                  f"{os.path.getsize(path)} -> {os.path.getsize(out)} bytes")
+            for number, line in bad_lines:
+                print(f"  skipped line {number}: {line}")
+        else:
+            out, records = log_to_csv(path)
+            print(f"{path} -> {out}: {len(records)} samples")
+    return 0
+
+
+def cmd_analyze(args):
+    from .analysis.batch import analyze_downloads, analyze_files, format_summary, write_summary
+
+    if args.files:
+        results = analyze_files(args.files, args.start, args.end, workers=args.workers,
+                                cache=not args.no_cache, chunked=args.chunked)
+    else:
+        results = analyze_downloads(args.dir, args.start, args.end, workers=args.workers,
+                                    pending=args.pending, cache=not args.no_cache, chunked=args.chunked)
+    for line in format_summary(results):
+        print(line)
+    if args.out:
+        write_summary(results, args.out)
+        print(f"Summary written to {args.out}")
+    return 1 if any(result.error for result in results) else 0
+
+
+def cmd_tune(args):
+    from .analysis.tune import format_scores, parameter_grid, read_labels, sweep, write_scores
+
+    labels = read_labels(args.labels)
+    if not labels:
+        print(f"No labelled sessions in {args.labels}")
+        return 1
+    parameter_sets = parameter_grid(samples=args.random, seed=args.seed)
+    print(f"Scoring {len(parameter_sets)} parameter sets on {len(labels)} labelled sessions")
+    scores, slots = sweep(labels, parameter_sets, workers=args.workers)
+    for line in format_scores(scores, slots, args.top):
+        print(line)
+    if args.out:
+        write_scores(scores, slots, args.out)
+        print(f"Scores written to {args.out}")
+    return 0
+
+
+def cmd_spectral(args):
+    import numpy as np
+    from .analysis import load
+    from .analysis.spectral import MIN_CONFIDENCE, cross_check
+
+    for path in args.files:
+        result = cross_check(load(path), start=args.start, end=args.end,
+                             window_seconds=args.window, hop_seconds=args.hop)
+        confident = result.confidence >= MIN_CONFIDENCE
+        spectral = np.median(result.spm[confident]) if confident.any() else float("nan")
+        peaks = np.nanmedian(result.peak_spm) if np.isfinite(result.peak_spm).any() else float("nan")
+        print(f"{path}: spectral {spectral:.1f} SPM, peaks {peaks:.1f} SPM (medians), "
+              f"{int(result.disagree.sum())} of {int(confident.sum())} confident windows disagree")
+        if args.windows:
+            print(f"{'time':>7} {'spectral':>8} {'conf':>5} {'peaks':>6}")
+            for time, spm, confidence, peak_spm, disagree in zip(result.times, result.spm, result.confidence,
+                                                                 result.peak_spm, result.disagree):
+                print(f"{time:>7.1f} {spm:>8.1f} {confidence:>5.2f} {peak_spm:>6.1f}{'  <- disagree' if disagree else ''}")
+    return 0
+
+
+def cmd_bench_transfer(args):
+    from .benchmark import parse_sizes, run_transfer_suite, write_report
+
+    report = run_transfer_suite(parse_sizes(args.sizes), mtu=args.mtu, latency=args.latency,
+                                jitter=args.jitter, loss=args.loss, chunk_interval=args.chunk_interval,
+                                render_cost=args.render_cost)
+    if args.out:
+        write_report(report, args.out)
+        print(f"Report written to {args.out}")
+    return 0 if all(case["correct"] for case in report["cases"]) else 1
+
+
+def cmd_bench_compression(args):
+    from .benchmark import run_compression_suite, write_report
+
+    report = run_compression_suite(args.dir, mtu=args.mtu, link_chunk_interval=args.link_chunk_interval)
+    if args.out:
+        write_report(report, args.out)
+        print(f"Report written to {args.out}")
+    return 0 if all(case["correct"] for case in report["cases"]) else 1
+
+
+def cmd_bench_listing(args):
+    from .benchmark import run_listing_suite, write_report
+
+    counts = [int(count) for count in args.files.split(",") if count.strip()]
+    report = run_listing_suite(counts, mtu=args.mtu, loss=args.loss)
+    if args.out:
+        write_report(report, args.out)
+        print(f"Report written to {args.out}")
+    return 0 if all(case["correct"] for case in report["cases"] if case["paged"]) else 1
+
+
+def cmd_bench_mtu(args):
+    from .benchmark import parse_size, run_mtu_suite, write_report
+
+    mtus = [int(mtu) for mtu in args.mtus.split(",") if mtu.strip()]
+    report = run_mtu_suite(mtus, parse_size(args.size), time_limit=args.time_limit)
+    if args.out:
+        write_report(report, args.out)
+        print(f"Report written to {args.out}")
+    return 0 if all(case["correct"] for case in report["cases"] if case["mode"] == "adaptive") else 1
+
+
+def cmd_bench_compare(args):
+    from .benchmark import compare_reports, load_report
+
+    for line in compare_reports(load_report(args.old), load_report(args.new)):
+        print(line)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="form24", description="FORM24 IMU logger tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fleet = subparsers.add_parser("fleet", help="download new files from every logger in range")
+    fleet.add_argument("--dest", default=DOWNLOAD_DIR, help="download directory")
+    fleet.add_argument("--max-concurrent", type=int, default=3, help="devices connected at once")
+    fleet.add_argument("--scan-timeout", type=float, default=5.0, help="scan time in seconds")
+    fleet.add_argument("--compress", action="store_true", help="ask the loggers for compressed transfers")
+    fleet.add_argument("--metrics", metavar="PATH", help="append the metrics of every download to a JSON-lines file")
+    add_transport_arguments(fleet)
+    fleet.set_defaults(func=cmd_fleet)
+
+    sync = subparsers.add_parser("sync", help="download new files without the GUI, once or whenever loggers dock")
+    sync.add_argument("--device", help="name or MAC address of the logger (default: every logger in range)")
+    sync.add_argument("--dest", default=DOWNLOAD_DIR, help="download directory")
+    sync.add_argument("--delete", action="store_true",
+                      help="delete files from the SD card once they are downloaded and verified")
+    sync.add_argument("--compress", action="store_true", help="ask the loggers for compressed transfers")
+    sync.add_argument("--watch", action="store_true",
+                      help="keep scanning and sync each logger when it comes into range")
+    sync.add_argument("--interval", type=float, default=10.0, help="seconds between scans with --watch")
+    sync.add_argument("--max-concurrent", type=int, default=3, help="devices connected at once")
+    sync.add_argument("--scan-timeout", type=float, default=5.0, help="scan time in seconds")
+    sync.add_argument("--metrics", metavar="PATH", help="append the metrics of every download to a JSON-lines file")
+    add_transport_arguments(sync)
+    sync.set_defaults(func=cmd_sync)
+
+    tail = subparsers.add_parser("tail", help="fetch a file while it is being logged, only the new bytes each time")
+    tail.add_argument("file", nargs="?", help="file on the SD card (default: the one written last)")
+    tail.add_argument("--device", help="name or MAC address of the logger (default: the first one found)")
+    tail.add_argument("--dest", default=DOWNLOAD_DIR, help="download directory")
+    tail.add_argument("--interval", type=float, default=10.0, help="seconds between fetches")
+    tail.add_argument("--start", action="store_true", help="start logging and follow the new file")
+    tail.add_argument("--compress", action="store_true", help="ask the logger for compressed transfers")
+    tail.add_argument("--scan-timeout", type=float, default=5.0, help="scan time in seconds")
+    add_transport_arguments(tail)
+    tail.set_defaults(func=cmd_tail)
+
+    metrics = subparsers.add_parser("metrics", help="summarize download metrics written with --metrics")
+    metrics.add_argument("files", nargs="+", help="JSON-lines metrics files")
+    metrics.set_defaults(func=cmd_metrics)
+
+    convert = subparsers.add_parser("convert", help="convert CSV logs to binary logs and back")
+    convert.add_argument("files", nargs="+", help=".csv files become .bin files, anything else becomes .csv")
+    convert.set_defaults(func=cmd_convert)
+
+    analyze = subparsers.add_parser("analyze", help="stroke rate of logged sessions, in parallel")
+    analyze.add_argument("files", nargs="*", help="CSV or binary logs (default: every log in --dir)")
+    analyze.add_argument("--dir", default=DOWNLOAD_DIR, help="download directory")
+    analyze.add_argument("--pending", action="store_true", help="only logs of --dir not analyzed yet")
+    analyze.add_argument("--start", type=float, help="start of the analyzed window in seconds")
+    analyze.add_argument("--end", type=float, help="end of the analyzed window in seconds")
+    analyze.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    analyze.add_argument("--out", metavar="PATH", help="write the summary table as CSV")
+    analyze.add_argument("--no-cache", action="store_true", help="parse CSV logs again instead of using their cache")
+    analyze.add_argument("--chunked", action="store_true",
+                         help="read each log in blocks, in constant memory; analyzes the whole session "
+                              "instead of swimming segments unless --start or --end is given")
+    analyze.set_defaults(func=cmd_analyze)
+
+    tune = subparsers.add_parser("tune", help="score stroke detection settings against counted sessions")
+    tune.add_argument("--labels", default="stroke_labels.csv", help="CSV of path,strokes,start,end")
+    tune.add_argument("--random", type=int, metavar="N", help="score N random parameter sets of the grid")
+    tune.add_argument("--seed", type=int, default=0, help="seed of --random")
+    tune.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    tune.add_argument("--top", type=int, default=20, help="rows of the table")
+    tune.add_argument("--out", metavar="PATH", help="write every score as CSV")
+    tune.set_defaults(func=cmd_tune)
+
+    spectral = subparsers.add_parser("spectral", help="stroke rate from the spectrum, checked against the peaks")
+    spectral.add_argument("files", nargs="+", help="CSV or binary logs")
+    spectral.add_argument("--start", type=float, help="count peaks from this second instead of per swimming segment")
+    spectral.add_argument("--end", type=float, help="count peaks up to this second")
+    spectral.add_argument("--window", type=float, default=10.0, help="window length in seconds")
+    spectral.add_argument("--hop", type=float, default=2.0, help="seconds between windows")
+    spectral.add_argument("--windows", action="store_true", help="print every window")
+    spectral.set_defaults(func=cmd_spectral)
+
+    bench = subparsers.add_parser("bench", help="benchmarks of the download path")
+    bench_commands = bench.add_subparsers(dest="benchmark", required=True)
+
+    transfer = bench_commands.add_parser("transfer", help="download synthetic files from a simulated logger")
+    transfer.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated sizes, e.g. 10K,1M,50M")
+    transfer.add_argument("--mtu", type=int, default=517, help="ATT MTU of the simulated link")
+    transfer.add_argument("--latency", type=float, default=0.0, help="link latency in seconds")
+    transfer.add_argument("--jitter", type=float, default=0.0, help="extra random latency in seconds")
+    transfer.add_argument("--loss", type=float, default=0.0, help="probability of dropping a notification")
+    transfer.add_argument("--chunk-interval", type=float, default=0.0,
+                          help="seconds between chunks on the logger (0 measures the host side)")
+    transfer.add_argument("--render-cost", type=float, default=RENDER_COST,
+                          help="seconds the stand-in GUI thread spends per event")
+    transfer.add_argument("--out", help="write the JSON report to this file")
+    transfer.set_defaults(func=cmd_bench_transfer)
+
+    compression = bench_commands.add_parser("compression",
+                                            help="plain and compressed transfers of the downloaded files")
+    compression.add_argument("--dir", default=DOWNLOAD_DIR, help="directory of log files to transfer")
+    compression.add_argument("--mtu", type=int, default=517, help="ATT MTU of the simulated link")
+    compression.add_argument("--link-chunk-interval", type=float, default=CHUNK_INTERVAL,
+                             help="seconds per notification on the device, used for the link time")
+    compression.add_argument("--out", help="write the JSON report to this file")
+    compression.set_defaults(func=cmd_bench_compression)
+
+    listing = bench_commands.add_parser("listing", help="list simulated SD cards with many files")
+    listing.add_argument("--files", default=DEFAULT_FILE_COUNTS, help="comma separated file counts")
+    listing.add_argument("--mtu", type=int, default=517, help="ATT MTU of the simulated link")
+    listing.add_argument("--loss", type=float, default=0.0, help="probability of dropping a notification")
+    listing.add_argument("--out", help="write the JSON report to this file")
+    listing.set_defaults(func=cmd_bench_listing)
+
+    mtu = bench_commands.add_parser("mtu", help="throughput at several MTUs over a simulated radio")
+    mtu.add_argument("--mtus", default=DEFAULT_MTUS, help="comma separated ATT MTUs")
+    mtu.add_argument("--size", default="32K", help="size of the file to download")
+    mtu.add_argument("--time-limit", type=float, default=30.0,
+                     help="seconds per case, slower cases report the throughput so far")
+    mtu.add_argument("--out", help="write the JSON report to this file")
+    mtu.set_defaults(func=cmd_bench_mtu)
+
+    compare = bench_commands.add_parser("compare", help="compare two JSON reports")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.set_defaults(func=cmd_bench_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""Stroke rate analysis of IMU logs
+
+The processing of imuProcess.ipynb as functions over NumPy arrays, so that
+sessions can be analyzed from scripts and in batches instead of by hand:
+
+    session = load("downloaded_files/IMU_0_00-17-14.csv")
+    result = analyze(session, start=4, end=80)
+    result.strokes, result.spm
+
+or, step by step: load -> resample -> smooth -> window -> detect_peaks ->
+stroke_rate.
+batch.py runs analyze() over many files in a process pool and writes a
+summary table (python -m form24 analyze). chunked.py gives analyze()'s
+result for a window while reading the log in blocks, for sessions too long
+to load.
+"""
+
+from .chunked import analyze_chunked
+from .loader import Session, load
+from .resample import Resampled, resample, estimate_rate, find_dropouts, window_samples
+from .segment import SWIM, TURN, REST, find_segments
+from .smoothing import SMOOTHING_WINDOWS, POLYORDER, smoothing_kernel, end_matrices, smooth
+from .spectral import SpectralRate, spectral_rate, cross_check
+from .stroke import (
+    Params, Segment, StrokeRate, SessionResult, DEFAULT_PARAMS, NOTEBOOK_RATE, PEAK_DISTANCE,
+    prepare, find_bouts, window, sample_counts, peak_thresholds, detect_peaks, stroke_rate, segments,
+    analyze,
+)
@@ -0,0 +1,89 @@
+"""Analysis of many sessions at once
+
+analyze_files() loads and analyzes every file in a process pool, one file
+per task, so a folder of sessions takes about as long as its largest file
+per core. A file that cannot be loaded or analyzed gets a SessionResult
+with its error instead of stopping the batch. The results come back in
+the order of the paths and are written as a CSV summary, one row per
+session.
+
+analyze_downloads() takes the files from the manifest of a download
+directory and marks the ones it analyzed as STATUS_ANALYZED.
+
+With chunked, each file is read in blocks by analyze_chunked()
+(chunked.py), so that long sessions do not need to fit in memory; a
+window is then always analyzed, the whole session by default.
+"""
+
+import csv
+from concurrent.futures import ProcessPoolExecutor
+
+from ..logformat import CSV_SUFFIX, LOG_SUFFIX
+from ..manifest import Manifest, STATUS_ANALYZED
+from .chunked import analyze_chunked
+from .loader import load, session_name
+from .stroke import DEFAULT_PARAMS, SessionResult, analyze
+
+
+def analyze_file(path, start=None, end=None, params=DEFAULT_PARAMS, cache=True, chunked=False):
+    """Load and analyze one file, errors are returned in the SessionResult"""
+    try:
+        if chunked:
+            return analyze_chunked(path, start, end, params, cache)
+        return analyze(load(path, cache), start, end, params)
+    except Exception as e:
+        nan = float("nan")
+        return SessionResult(session_name(path), path, 0, 0.0, 0.0, 0, 0, 0, start, end, None, 0, nan, nan,
+                             f"{type(e).__name__}: {e}")
+
+
+def analyze_files(paths, start=None, end=None, params=DEFAULT_PARAMS, workers=None, cache=True,
+                  chunked=False):
+    """Analyze paths in a pool of workers processes (default: one per core), return the SessionResults"""
+    paths = list(paths)
+    if workers == 1 or len(paths) <= 1:
+        return [analyze_file(path, start, end, params, cache, chunked) for path in paths]
+    count = len(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(analyze_file, paths, [start] * count, [end] * count, [params] * count,
+                             [cache] * count, [chunked] * count))
+
+
+def analysis_files(manifest, pending=False):
+    """Paths of the logs in a manifest, only those not analyzed yet with pending"""
+    return [manifest.absolute(entry) for entry in manifest.files()
+            if entry.path.lower().endswith((CSV_SUFFIX, LOG_SUFFIX))
+            and not (pending and entry.status == STATUS_ANALYZED)]
+
+
+def analyze_downloads(download_dir, start=None, end=None, params=DEFAULT_PARAMS, workers=None,
+                      pending=False, cache=True, chunked=False):
+    """Analyze the logs of a download directory and mark them analyzed, return the SessionResults"""
+    with Manifest(download_dir) as manifest:
+        results = analyze_files(analysis_files(manifest, pending), start, end, params, workers, cache, chunked)
+        for result in results:
+            if result.error is None:
+                manifest.set_status(result.path, STATUS_ANALYZED)
+    return results
+
+
+def write_summary(results, path):
+    """Write SessionResults as a CSV table"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(SessionResult._fields)
+        for result in results:
+            writer.writerow("" if value is None else value for value in result)
+
+
+def format_summary(results):
+    """Lines of a table of SessionResults for the console"""
+    lines = [f"{'session':<32} {'samples':>8} {'seconds':>8} {'Hz':>6} {'swims':>6} {'strokes':>8} {'SPM':>6}  notes"]
+    for result in results:
+        swims = "-" if result.swims is None else result.swims
+        notes = result.error or ", ".join(f"{count} {what}" for count, what in (
+            (result.bad_lines, "bad lines"), (result.duplicates, "duplicates"), (result.dropouts, "dropouts"))
+            if count)
+        lines.append(f"{result.name:<32} {result.samples:>8} {result.duration:>8.1f} "
+                     f"{result.sample_rate:>6.1f} {swims:>6} {result.strokes:>8} {result.spm:>6.1f}  {notes}")
+    return lines
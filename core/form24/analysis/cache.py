@@ -0,0 +1,115 @@
+"""Cache of parsed CSV logs
+
+Parsing a CSV log is the slowest step of loading it, so the parsed
+records are kept next to it, in a .cache directory, as a binary log (see
+logformat.py) that later loads map into memory without reading or
+parsing anything. A small JSON file beside it holds the key, the size,
+modification time and SHA-256 of the CSV, and the bad lines the parser
+reported.
+
+A cached copy is used while the CSV has the same size and modification
+time. When only the modification time changed, as after copying the
+file, the CSV is hashed and the copy is still used if the content is the
+same. Otherwise the CSV is parsed again and the copy replaced.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from ..logformat import (
+    FORMAT_VERSION, HEADER_SIZE, LOG_SUFFIX, RECORD_DTYPE, RECORD_SIZE, LogHeader,
+    decode_header, estimate_sample_rate, parse_csv, write_log,
+)
+from ..manifest import file_hash
+
+CACHE_DIR = ".cache"
+KEY_SUFFIX = ".json"
+
+
+def cache_path(path):
+    """Path of the cached binary log of a CSV log"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, CACHE_DIR, os.path.splitext(name)[0] + LOG_SUFFIX)
+
+
+def load_csv(path, cache=True):
+    """Return (records, bad_lines) of a CSV log, from the cache when it is current
+
+    Cached records are a read-only memory map of the cached file.
+    """
+    if cache:
+        records = cached(path)
+        if records is not None:
+            return records
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    records, bad_lines = parse_csv(data)
+    if cache:
+        try:
+            _store(path, stat, records, bad_lines, hashlib.sha256(data).hexdigest())
+        except OSError:
+            # A read-only directory, the records are still good
+            pass
+    return records, bad_lines
+
+
+def cached(path):
+    """Return (records, bad_lines) of a CSV log from its cache, None unless the cache is current"""
+    log_path = cache_path(path)
+    key_path = os.path.splitext(log_path)[0] + KEY_SUFFIX
+    try:
+        with open(key_path, encoding="utf-8") as f:
+            key = json.load(f)
+        stat = os.stat(path)
+        if key["size"] != stat.st_size:
+            return None
+        if key["mtime_ns"] != stat.st_mtime_ns:
+            if key["sha256"] != file_hash(path):
+                return None
+            key["mtime_ns"] = stat.st_mtime_ns
+            _write_json(key_path, key)
+        records = _map(log_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    return records, [tuple(line) for line in key["bad_lines"]]
+
+
+def _map(log_path):
+    with open(log_path, "rb") as f:
+        decode_header(f.read(HEADER_SIZE))
+        count = (os.fstat(f.fileno()).st_size - HEADER_SIZE) // RECORD_SIZE
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(log_path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+def _store(path, stat, records, bad_lines, sha256):
+    log_path = cache_path(path)
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    start_time = int(records["Time"][0]) if len(records) else 0
+    header = LogHeader(FORMAT_VERSION, estimate_sample_rate(records["Time"]), start_time)
+    # The old key goes first and the new one is written last, so a cached
+    # log is only used once it is complete
+    key_path = os.path.splitext(log_path)[0] + KEY_SUFFIX
+    if os.path.exists(key_path):
+        os.remove(key_path)
+    temporary = log_path + ".tmp"
+    write_log(temporary, header, records)
+    os.replace(temporary, log_path)
+    _write_json(key_path, {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+        "bad_lines": bad_lines,
+    })
+
+
+def _write_json(path, value):
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(temporary, path)
@@ -0,0 +1,376 @@
+"""Analysis of sessions too long to hold in memory
+
+analyze_chunked() returns the SessionResult analyze() gives for a window
+of a session, the whole session by default, while reading the log in
+blocks of BLOCK_SAMPLES records, so that the memory it needs is the same
+for a session of a minute or of a day. Only the stroke times grow with the
+session. Each step keeps what its in-memory counterpart would compute:
+
+    timebase   a first pass over the times. Samples written twice are
+               dropped as they arrive, held back HOLD_SECONDS so that a
+               block written again is recognised. The intervals are
+               counted by value, which gives the median interval, the
+               dropouts and the rate of resample() without keeping them.
+    resample   a second pass interpolates the stroke column onto the same
+               grid, carrying the last samples of each block to the next.
+    smooth     overlap-save: each block is convolved with the kernel of
+               smoothing.py together with the last len(kernel) - 1 values,
+               and the two ends get the end matrices. The smoothed column
+               goes to a temporary file rather than memory.
+    peaks      the thresholds come from the mean and standard deviation of
+               the window, read back from the file. find_peaks' height
+               test is local, and its distance test only ever compares
+               peaks closer than the distance, so blocks of candidates are
+               split where two are at least the distance apart. The
+               prominence test looks from each peak to the nearest higher
+               sample on either side; it reads the file from the peak
+               outwards until the answer is certain, usually within one
+               stroke.
+
+So the strokes are those analyze() finds, the same samples, and the
+thresholds and smoothed values differ from it by rounding only, as the
+sums and convolutions are done in a different order. The swimming
+segments of analyze() without a window need the whole session and are not
+found here.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+from scipy.signal import find_peaks
+
+from ..logformat import (
+    CSV_HEADER, CSV_SUFFIX, HEADER_SIZE, RECORD_DTYPE, RECORD_SIZE, decode_header, parse_csv,
+)
+from .cache import cached
+from .loader import load, session_name
+from .resample import DROPOUT_INTERVALS
+from .smoothing import end_matrices, smoothing_kernel
+from .stroke import DEFAULT_PARAMS, SessionResult, analyze, sample_counts, stroke_rate
+
+# Records per block, about 1 MB of records and 4 MB of text for CSV logs
+BLOCK_SAMPLES = 65536
+# Bytes of CSV text read per record of a block, about one line
+_CSV_LINE = 40
+
+# Samples are passed on once they are this much older than the newest, so
+# that a block written twice, a fraction of a second back, is recognised
+HOLD_SECONDS = 2.0
+
+# Samples either side of a block of peaks, for plateaus at its edges, and
+# samples read at a time when looking for a peak's prominence
+_MARGIN = 64
+_SCAN = 512
+
+_ITEM = np.dtype(np.float64).itemsize
+
+
+def read_blocks(path, cache=True, block=BLOCK_SAMPLES):
+    """Yield (records, bad_lines) of a CSV or binary log, about block records at a time
+
+    CSV logs come from their cache when it is current (cache.py), and are
+    parsed a block of lines at a time otherwise; the cache is not written.
+    """
+    if not path.lower().endswith(CSV_SUFFIX):
+        yield from _log_blocks(path, block)
+        return
+    records = cached(path) if cache else None
+    if records is None:
+        yield from _csv_blocks(path, block * _CSV_LINE)
+        return
+    records, bad_lines = records
+    yield records[:0], bad_lines
+    for first in range(0, len(records), block):
+        yield records[first:first + block], []
+
+
+def _log_blocks(path, block):
+    with open(path, "rb") as f:
+        decode_header(f.read(HEADER_SIZE))
+        count = (os.fstat(f.fileno()).st_size - HEADER_SIZE) // RECORD_SIZE
+        while count > 0:
+            records = np.frombuffer(f.read(min(block, count) * RECORD_SIZE), dtype=RECORD_DTYPE)
+            count -= len(records)
+            yield records, []
+
+
+def _csv_blocks(path, size):
+    header = (CSV_HEADER + "\n").encode()
+    lines = 0          # lines of the file before the block
+    rest = b""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(size)
+            text = rest + data
+            if not text:
+                return
+            # Whole lines only, the rest goes with the next block
+            cut = text.rfind(b"\n") + 1 if data else len(text)
+            if cut == 0:
+                rest = text
+                continue
+            text, rest = text[:cut], text[cut:]
+            if lines == 0:
+                records, bad_lines = parse_csv(text)
+            else:
+                # parse_csv() skips the first line as the header
+                records, bad_lines = parse_csv(header + text)
+                bad_lines = [(number - 1 + lines, line) for number, line in bad_lines]
+            lines += text.count(b"\n")
+            yield records, bad_lines
+
+
+def clean_blocks(blocks, column, counts):
+    """Yield (times, values) of column in time order, each time once, as resample() keeps them
+
+    times are seconds since the first record, as in a Session. counts
+    (a dict) receives the number of samples, bad lines and duplicates.
+    Raises ValueError for a sample more than HOLD_SECONDS older than
+    samples before it, which only the in-memory analysis can place.
+    """
+    counts.update(samples=0, bad_lines=0, duplicates=0)
+    empty = np.zeros(0)
+    first = None
+    held_times = held_values = recent = empty
+    newest = -np.inf
+    for records, bad_lines in blocks:
+        counts["samples"] += len(records)
+        counts["bad_lines"] += len(bad_lines)
+        if len(records) == 0:
+            continue
+        milliseconds = records["Time"].astype(np.int64)
+        if first is None:
+            first = milliseconds[0]
+        times = (milliseconds - first) / 1000.0
+        values = records[column].astype(np.float64)
+        newest = max(newest, times.max())
+
+        # Samples at or before the last one passed on must have been seen
+        if len(recent):
+            old = times <= recent[-1]
+            if old.any():
+                if not np.isin(times[old], recent).all():
+                    raise ValueError(f"Samples more than {HOLD_SECONDS:g} s out of order")
+                times, values = times[~old], values[~old]
+
+        # Held samples come first, so np.unique keeps the first one written
+        times, index = np.unique(np.concatenate((held_times, times)), return_index=True)
+        values = np.concatenate((held_values, values))[index]
+        ready = np.searchsorted(times, newest - HOLD_SECONDS, side="right")
+        held_times, held_values = times[ready:], values[ready:]
+        if ready:
+            recent = np.concatenate((recent, times[:ready]))
+            recent = recent[recent >= recent[-1] - HOLD_SECONDS]
+            counts["duplicates"] -= ready
+            yield times[:ready], values[:ready]
+    if len(held_times):
+        counts["duplicates"] -= len(held_times)
+        yield held_times, held_values
+    counts["duplicates"] += counts["samples"]
+
+
+def timebase(samples):
+    """Return (first, last, rate, dropouts) of the times from clean_blocks(), as resample() finds them"""
+    intervals = {}
+    first = last = None
+    total = 0.0
+    for times, _ in samples:
+        differences = np.diff(times) if last is None else np.diff(np.concatenate(([last], times)))
+        first = times[0] if first is None else first
+        last = times[-1]
+        total += differences.sum()
+        for value, count in zip(*np.unique(differences, return_counts=True)):
+            intervals[value] = intervals.get(value, 0) + int(count)
+    if not intervals:
+        return first, last, 0.0, 0
+
+    # The median interval, as np.median finds it
+    values = np.array(sorted(intervals))
+    ends = np.cumsum([intervals[value] for value in values])
+    size = ends[-1]
+    middle = values[np.searchsorted(ends, [(size - 1) // 2, size // 2], side="right")]
+    median = middle[0] if size % 2 else (middle[0] + middle[1]) / 2
+    dropouts = values > DROPOUT_INTERVALS * median
+    count = size - sum(intervals[value] for value in values[dropouts])
+    span = total - sum(value * intervals[value] for value in values[dropouts])
+    rate = count / span if count > 0 and span > 0 else 0.0
+    return first, last, rate, int(size - count)
+
+
+def uniform_blocks(samples, first, rate, size):
+    """Yield the values of clean_blocks() interpolated onto the grid of resample(), in blocks"""
+    done = 0
+    previous_times = previous_values = np.zeros(0)
+    for times, values in samples:
+        times = np.concatenate((previous_times, times))
+        values = np.concatenate((previous_values, values))
+        # Grid points before the last sample, the rest need the next block
+        stop = min(size, int((times[-1] - first) * rate) + 2)
+        grid = first + np.arange(done, max(done, stop)) / rate
+        grid = grid[grid < times[-1]]
+        left = np.searchsorted(times, grid, side="right") - 1
+        fraction = (grid - times[left]) / (times[left + 1] - times[left])
+        done += len(grid)
+        previous_times, previous_values = times[-2:], values[-2:]
+        if len(grid):
+            yield values[left] + fraction * (values[left + 1] - values[left])
+    # The last grid points, on the last sample, between the last two
+    grid = first + np.arange(done, size) / rate
+    if len(grid):
+        times, values = previous_times, previous_values
+        fraction = (grid - times[0]) / (times[1] - times[0])
+        yield values[0] + fraction * (values[1] - values[0])
+
+
+def smooth_blocks(blocks, output, windows, polyorder):
+    """Smooth the concatenation of blocks as smooth() does and write it to the file output
+
+    Needs at least 2 * len(kernel) values in all.
+    """
+    kernel = smoothing_kernel(windows, polyorder)
+    half = len(kernel) // 2
+    start, end = end_matrices(windows, polyorder)
+    head = tail = np.zeros(0)
+    for values in blocks:
+        if len(head) < 2 * half:
+            head = np.concatenate((head, values[:2 * half - len(head)]))
+            if len(head) == 2 * half:
+                output.write((start @ head).tobytes())
+        tail = np.concatenate((tail, values))
+        if len(tail) >= len(kernel):
+            output.write(np.convolve(tail, kernel, mode="valid").tobytes())
+        tail = tail[-2 * half:]
+    output.write((end @ tail).tobytes())
+
+
+def _read(f, first, stop):
+    f.seek(first * _ITEM)
+    return np.frombuffer(f.read((stop - first) * _ITEM), dtype=np.float64)
+
+
+def _grid_count(first, rate, size, value, side):
+    # Grid points before value (side "left"), or up to it ("right")
+    guess = int(min(max((value - first) * rate, 0), size))
+    candidates = np.arange(max(guess - 2, 0), min(guess + 3, size))
+    return int(candidates[0] + np.searchsorted(first + candidates / rate, value, side=side))
+
+
+def _select_by_distance(peaks, heights, distance):
+    # find_peaks' distance test, highest peak first
+    keep = np.ones(len(peaks), dtype=bool)
+    for j in np.argsort(heights)[::-1]:
+        if keep[j]:
+            keep[np.abs(peaks - peaks[j]) < distance] = False
+            keep[j] = True
+    return peaks[keep]
+
+
+def _prominent(f, peak, low, high, minimum):
+    # Whether find_peaks would give the peak a prominence of at least
+    # minimum within samples low to high. Each side needs a sample at least
+    # minimum below the peak before any sample above it
+    value = _read(f, peak, peak + 1)[0]
+    for direction in (-1, 1):
+        position = peak
+        size = _SCAN
+        while True:
+            if direction < 0:
+                first = max(low, position - size + 1)
+                chunk = _read(f, first, position + 1)[::-1]
+            else:
+                first = min(high, position + size)
+                chunk = _read(f, position, first)
+            higher = np.flatnonzero(chunk > value)
+            if np.any(value - chunk[:higher[0] if len(higher) else len(chunk)] >= minimum):
+                break
+            if len(higher) or len(chunk) < size:
+                return False
+            position += direction * size
+            size *= 2
+    return True
+
+
+def find_strokes(f, low, high, rate, height, prominence, distance, block=BLOCK_SAMPLES):
+    """Return the indices of the strokes find_peaks finds in samples low to high of the smoothed file f"""
+    strokes = []
+    group = []
+
+    def close(group):
+        if group:
+            peaks, heights = np.array(group).T
+            for peak in _select_by_distance(peaks.astype(np.intp), heights, distance):
+                if _prominent(f, peak, low, high, prominence):
+                    strokes.append(peak)
+
+    for first in range(low, high, block):
+        stop = min(first + block, high)
+        # With the edges off any plateau, a peak's plateau is inside
+        before, after = max(low, first - _MARGIN), min(high, stop + _MARGIN)
+        signal = _read(f, before, after)
+        while before > low and signal[0] == signal[1]:
+            before = max(low, before - _MARGIN)
+            signal = _read(f, before, after)
+        while after < high and signal[-1] == signal[-2]:
+            after = min(high, after + _MARGIN)
+            signal = _read(f, before, after)
+        peaks, properties = find_peaks(signal, height=height)
+        peaks += before
+        inside = (peaks >= first) & (peaks < stop)
+        for peak, value in zip(peaks[inside], properties["peak_heights"][inside]):
+            # Peaks at least distance apart never affect each other
+            if group and peak - group[-1][0] >= distance:
+                close(group)
+                group = []
+            group.append((peak, value))
+    close(group)
+    return np.array(strokes, dtype=np.intp)
+
+
+def analyze_chunked(path, start=None, end=None, params=DEFAULT_PARAMS, cache=True, block=BLOCK_SAMPLES):
+    """Analyze the log at path in blocks, return the SessionResult of analyze() for the window
+
+    The window is start to end seconds, by default the whole session.
+    Sessions too short for the smoothing to reach past both ends, or
+    without a rate, are loaded and analyzed in memory.
+    """
+    counts = {}
+    name = session_name(path)
+    first, last, rate, dropouts = timebase(
+        clean_blocks(read_blocks(path, cache, block), params.column, counts))
+    rate = params.rate or rate
+    windows, distance = sample_counts(params, rate)
+    half = len(smoothing_kernel(windows, params.polyorder)) // 2
+    size = int((last - first) * rate) + 1 if first is not None and rate > 0 else 0
+    if size < 4 * half:
+        return analyze(load(path, cache), 0.0 if start is None else start, end, params)
+    last = float(first + (size - 1) / rate)
+
+    start = 0.0 if start is None else start
+    end = last if end is None else end
+    with tempfile.TemporaryFile() as f:
+        samples = clean_blocks(read_blocks(path, cache, block), params.column, {})
+        smooth_blocks(uniform_blocks(samples, first, rate, size), f, windows, params.polyorder)
+        f.flush()
+
+        # The window's thresholds, as peak_thresholds() computes them
+        low = _grid_count(first, rate, size, start, "left")
+        high = max(low, _grid_count(first, rate, size, end, "right"))
+        count = high - low
+        total = sum(_read(f, i, min(i + block, high)).sum() for i in range(low, high, block))
+        mean = total / count if count else np.nan
+        squares = sum(np.square(_read(f, i, min(i + block, high)) - mean).sum() for i in range(low, high, block))
+        std = np.sqrt(squares / count) if count else np.nan
+        peaks = np.zeros(0, dtype=np.intp)
+        if count:
+            peaks = find_strokes(f, low, high, rate, params.height_mean * mean + params.height_std * std,
+                                 params.prominence_std * std, distance, block)
+
+    strokes = (first + peaks / rate - start) + start
+    spm = stroke_rate(strokes).spm
+    span = float(strokes[-1] - strokes[0]) if len(strokes) > 1 else 0.0
+    nan = float("nan")
+    return SessionResult(name, path, counts["samples"], last - first, rate,
+                         counts["bad_lines"], counts["duplicates"], dropouts, start, end, None, len(strokes),
+                         float(spm.mean()) if len(spm) else nan, 60.0 * len(spm) / span if span > 0 else nan,
+                         None)
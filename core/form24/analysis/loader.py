@@ -0,0 +1,49 @@
+"""Loading IMU logs for analysis
+
+Both log formats, CSV and binary (see logformat.py), load into a Session:
+time in seconds since the first sample, and the six sensor columns as one
+(N, 6) array in SENSOR_COLUMNS order. CSV logs are parsed once and then
+loaded from their cached binary copy (cache.py).
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from ..logformat import CSV_SUFFIX, SENSOR_COLUMNS, read_log, sensor_matrix
+from .cache import load_csv
+
+Session = namedtuple("Session", [
+    "path",
+    "times",        # seconds since the first sample, float64
+    "data",         # (N, 6) float64, columns in SENSOR_COLUMNS order
+    "bad_lines",    # [(line number, text)] of CSV rows that were skipped
+])
+
+
+def load(path, cache=True):
+    """Load a CSV or binary log into a Session, without the cache of CSV logs if cache is False"""
+    if path.lower().endswith(CSV_SUFFIX):
+        records, bad_lines = load_csv(path, cache)
+    else:
+        _, records = read_log(path)
+        bad_lines = []
+    return from_records(records, path, bad_lines)
+
+
+def from_records(records, path="", bad_lines=()):
+    """Make a Session of log records (logformat.RECORD_DTYPE)"""
+    times = records["Time"].astype(np.int64)
+    if len(times):
+        times = times - times[0]
+    return Session(path, times / 1000.0, sensor_matrix(records).astype(np.float64), list(bad_lines))
+
+
+def column(session, name):
+    """Return one sensor column of a session by name, e.g. AccelZ"""
+    return session.data[:, SENSOR_COLUMNS.index(name)]
+
+
+def session_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
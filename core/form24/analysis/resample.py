@@ -0,0 +1,99 @@
+"""Resampling onto a uniform timebase
+
+The logger stamps each sample with millis() after a delay(10) in its loop,
+so the intervals are 12 ms most of the time and 14-22 ms whenever the loop
+did more work, about 80 Hz on average rather than the 83 Hz of the median
+interval. A write to the SD card that is cut short also leaves a dropout,
+a gap of a few hundred ms, and sometimes a block of samples written twice.
+Filters and peak distances counted in samples therefore mean a different
+time span in every session.
+
+resample() puts a session on a uniform grid first: samples written twice
+are dropped, the rate is estimated from the intervals outside dropouts,
+and all six axes are interpolated linearly onto the grid with a handful
+of array operations, so hours of samples take one pass without a Python
+loop. Grid points inside a dropout are interpolated across it and marked
+in Resampled.valid.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# An interval this many times the median interval is a dropout
+DROPOUT_INTERVALS = 4
+
+Resampled = namedtuple("Resampled", [
+    "times",            # uniform grid, seconds
+    "data",             # (M, 6) float64, interpolated onto times
+    "rate",             # Hz of the grid
+    "valid",            # False for grid points inside a dropout
+    "dropouts",         # (K, 2) start and end of each dropout, seconds
+    "duplicates",       # samples dropped because their time was already seen
+])
+
+
+def clean_times(times):
+    """Return the indices of the samples to keep, in time order, each time once
+
+    Of samples with the same time the first one written is kept.
+    """
+    times = np.asarray(times)
+    if len(times) < 2 or np.all(times[1:] > times[:-1]):
+        return np.arange(len(times))
+    _, keep = np.unique(times, return_index=True)
+    return keep
+
+
+def find_dropouts(times, factor=DROPOUT_INTERVALS):
+    """Return the indices i of the intervals times[i]..times[i + 1] that are dropouts"""
+    intervals = np.diff(times)
+    if len(intervals) == 0:
+        return np.zeros(0, dtype=np.intp)
+    return np.flatnonzero(intervals > factor * np.median(intervals))
+
+
+def estimate_rate(times, dropouts=None):
+    """Sample rate in Hz from the mean interval outside dropouts, 0 if unknown"""
+    intervals = np.diff(times)
+    if dropouts is None:
+        dropouts = find_dropouts(times)
+    count = len(intervals) - len(dropouts)
+    span = intervals.sum() - intervals[dropouts].sum()
+    return count / span if count > 0 and span > 0 else 0.0
+
+
+def resample(times, data, rate=None):
+    """Interpolate data (N, ...) sampled at times (seconds) onto a uniform grid, return Resampled
+
+    rate defaults to the rate estimated from times. The grid starts at the
+    first sample.
+    """
+    keep = clean_times(times)
+    duplicates = len(times) - len(keep)
+    times = np.asarray(times, dtype=np.float64)[keep]
+    data = np.asarray(data, dtype=np.float64)[keep]
+    dropouts = find_dropouts(times)
+    if rate is None:
+        rate = estimate_rate(times, dropouts)
+    if len(times) < 2 or rate <= 0:
+        return Resampled(times, data, rate, np.ones(len(times), dtype=bool), np.zeros((0, 2)), duplicates)
+
+    grid = times[0] + np.arange(int((times[-1] - times[0]) * rate) + 1) / rate
+    # Each grid point between samples left and left + 1
+    left = np.clip(np.searchsorted(times, grid, side="right") - 1, 0, len(times) - 2)
+    fraction = (grid - times[left]) / (times[left + 1] - times[left])
+    fraction = fraction.reshape((-1,) + (1,) * (data.ndim - 1))
+    resampled = data[left] + fraction * (data[left + 1] - data[left])
+
+    valid = ~np.isin(left, dropouts) | (grid == times[left])
+    spans = np.column_stack((times[dropouts], times[dropouts + 1]))
+    return Resampled(grid, resampled, rate, valid, spans, duplicates)
+
+
+def window_samples(seconds, rate, polyorder):
+    """The odd number of samples closest to seconds at rate, at least polyorder + 2"""
+    samples = int(round(seconds * rate))
+    if samples % 2 == 0:
+        samples += 1 if seconds * rate >= samples else -1
+    return max(samples, polyorder + 2 if polyorder % 2 else polyorder + 1)
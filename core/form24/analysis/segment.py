@@ -0,0 +1,102 @@
+"""Finding swimming, turns and rest in a session
+
+Swimming moves the logger hard and in every direction; between lengths
+and at rest it barely moves. The rolling standard deviation of the
+acceleration and the rotation rate magnitudes over ACTIVITY_SECONDS
+therefore separates them well: on the downloaded sessions it is 5000-12000
+(accelerometer) while swimming, under 3500 during turns and under 2000 at
+rest. Both are computed from cumulative sums, a fixed number of array
+operations whatever the length of the session.
+
+The samples where both exceed their threshold are active. Lulls shorter
+than MIN_LULL_SECONDS inside a bout are bridged, active runs shorter than
+MIN_SWIM_SECONDS are not swimming, and what remains between two bouts is a
+turn if it is shorter than TURN_SECONDS and rest otherwise. Only this last
+step loops, over the few runs of the session rather than its samples.
+"""
+
+import numpy as np
+
+SWIM = "swim"
+TURN = "turn"
+REST = "rest"
+
+# Rolling window of the activity measure
+ACTIVITY_SECONDS = 2.0
+
+# Standard deviations of the magnitudes while swimming, at least, in raw
+# sensor units (about 0.27 g and 38 deg/s at the logger's ranges)
+ACCEL_STD = 4500.0
+GYRO_STD = 5000.0
+
+MIN_LULL_SECONDS = 1.5
+MIN_SWIM_SECONDS = 5.0
+TURN_SECONDS = 10.0
+
+
+def rolling_std(values, size):
+    """Standard deviation of values over a centred window of size samples, same length as values"""
+    values = np.asarray(values, dtype=np.float64)
+    size = max(1, min(size, len(values)))
+    # Centred values keep the cumulative sums of squares small
+    values = values - values.mean() if len(values) else values
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    squares = np.concatenate(([0.0], np.cumsum(values * values)))
+    # Window of each sample, clipped at the ends
+    first = np.clip(np.arange(len(values)) - size // 2, 0, len(values) - size)
+    count = size
+    mean = (sums[first + count] - sums[first]) / count
+    variance = (squares[first + count] - squares[first]) / count - mean * mean
+    return np.sqrt(np.maximum(variance, 0.0))
+
+
+def activity(data, rate, seconds=ACTIVITY_SECONDS):
+    """Return (accelerometer, gyroscope) rolling standard deviations of the magnitudes of (N, 6) data"""
+    size = max(1, int(round(seconds * rate)))
+    accel = np.sqrt(np.einsum("ij,ij->i", data[:, :3], data[:, :3]))
+    gyro = np.sqrt(np.einsum("ij,ij->i", data[:, 3:], data[:, 3:]))
+    return rolling_std(accel, size), rolling_std(gyro, size)
+
+
+def runs(mask):
+    """Return (starts, stops, values) of the runs of equal values in a boolean array"""
+    mask = np.asarray(mask, dtype=bool)
+    if len(mask) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros(0, dtype=bool)
+    starts = np.concatenate(([0], np.flatnonzero(mask[1:] != mask[:-1]) + 1))
+    stops = np.append(starts[1:], len(mask))
+    return starts, stops, mask[starts]
+
+
+def find_segments(data, rate):
+    """Return the segments of (N, 6) data sampled uniformly at rate as [(kind, first, stop)] index ranges
+
+    Consecutive segments cover the whole session.
+    """
+    if len(data) == 0 or rate <= 0:
+        return []
+    accel, gyro = activity(data, rate)
+    active = (accel >= ACCEL_STD) & (gyro >= GYRO_STD)
+
+    # Bridge short lulls, then drop short bouts
+    starts, stops, values = runs(active)
+    for start, stop, value in zip(starts, stops, values):
+        if not value and 0 < start and stop < len(active) and stop - start < MIN_LULL_SECONDS * rate:
+            active[start:stop] = True
+    starts, stops, values = runs(active)
+    for start, stop, value in zip(starts, stops, values):
+        if value and stop - start < MIN_SWIM_SECONDS * rate:
+            active[start:stop] = False
+
+    segments = []
+    starts, stops, values = runs(active)
+    for start, stop, value in zip(starts, stops, values):
+        if value:
+            kind = SWIM
+        elif 0 < start and stop < len(active) and stop - start < TURN_SECONDS * rate:
+            kind = TURN
+        else:
+            kind = REST
+        segments.append((kind, int(start), int(stop)))
+    return segments
@@ -0,0 +1,124 @@
+"""Stroke rate from the spectrum, as a cross-check of the peak counting
+
+Swimming is periodic in every axis, so the stroke rate is also the
+frequency that dominates the spectrum of a few seconds of samples.
+spectral_rate() slides a window of WINDOW_SECONDS over the resampled
+session in steps of HOP_SECONDS and, for all windows and all six axes at
+once, takes the rfft of a strided view of the samples. Each axis's power
+in the stroke band is normalised, the axes are averaged, and the peak of
+the average is the stroke frequency of the window. Averaging over the
+axes keeps it on the fundamental where a single axis peaks at a harmonic,
+as AccelZ often does.
+
+The confidence of a window is the share of the band's power within one
+frequency resolution of that peak: near 1 for a clean stroke rhythm, low
+at rest or during turns. cross_check() sets the stroke rate from the peaks
+found by stroke.py beside it, window by window, and flags the confident
+windows where the two disagree by more than TOLERANCE.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import next_fast_len, rfft, rfftfreq
+
+from .stroke import DEFAULT_PARAMS, find_bouts, prepare
+
+WINDOW_SECONDS = 10.0
+HOP_SECONDS = 2.0
+
+# Stroke band, strokes per minute
+MIN_SPM = 15.0
+MAX_SPM = 85.0
+
+# Zero padding of each window, for a finer frequency grid
+PADDING = 4
+
+# Windows per batch, so that a long session does not need its whole
+# windowed copy in memory at once (about 25 MB per batch at 80 Hz)
+BATCH_WINDOWS = 512
+
+# Windows below this confidence are not compared
+MIN_CONFIDENCE = 0.3
+# Relative difference of the two rates that counts as disagreement
+TOLERANCE = 0.15
+# Intervals between strokes a window needs for a peak-based rate
+MIN_INTERVALS = 3
+
+SpectralRate = namedtuple("SpectralRate", [
+    "times",            # centre of each window, seconds
+    "spm",              # dominant stroke rate over all axes
+    "confidence",       # 0-1
+    "axis_spm",         # (W, 6) dominant stroke rate of each axis
+    "peak_spm",         # stroke rate from the peaks inside the window, NaN if too few
+    "disagree",         # confident windows where spm and peak_spm differ by more than TOLERANCE
+])
+
+
+def spectral_rate(data, rate, window_seconds=WINDOW_SECONDS, hop_seconds=HOP_SECONDS):
+    """Return (times, spm, confidence, axis_spm) of (N, 6) data sampled uniformly at rate"""
+    size = int(round(window_seconds * rate))
+    hop = max(1, int(round(hop_seconds * rate)))
+    if len(data) < size or size < 2:
+        empty = np.zeros(0)
+        return empty, empty, empty, np.zeros((0, data.shape[1]))
+    windows = sliding_window_view(data, size, axis=0)[::hop]        # (W, axes, size), a view
+    length = next_fast_len(PADDING * size, real=True)
+    frequencies = rfftfreq(length, 1.0 / rate) * 60.0
+    band = (frequencies >= MIN_SPM) & (frequencies <= MAX_SPM)
+    band_spm = frequencies[band]
+    taper = np.hanning(size)
+
+    spectra = []
+    for first in range(0, len(windows), BATCH_WINDOWS):
+        batch = windows[first:first + BATCH_WINDOWS]
+        batch = (batch - batch.mean(axis=-1, keepdims=True)) * taper
+        power = np.abs(rfft(batch, length, axis=-1)[..., band]) ** 2
+        total = power.sum(axis=-1, keepdims=True)
+        spectra.append(np.divide(power, total, out=np.zeros_like(power), where=total > 0))
+    spectra = np.concatenate(spectra)                               # (W, axes, band)
+
+    combined = spectra.mean(axis=1)
+    peak = combined.argmax(axis=-1)
+    spm = band_spm[peak]
+    # One frequency resolution of the window either side of the peak
+    near = np.abs(band_spm[None, :] - spm[:, None]) <= 60.0 / window_seconds
+    confidence = (combined * near).sum(axis=-1)
+    # A peak at the edge of the band is the slope of something outside it
+    confidence[(peak == 0) | (peak == len(band_spm) - 1)] = 0.0
+    axis_spm = band_spm[spectra.argmax(axis=-1)]
+    times = (np.arange(len(windows)) * hop + size / 2) / rate
+    return times, spm, confidence, axis_spm
+
+
+def peak_window_rate(bouts, starts, ends):
+    """Stroke rate in each window from the strokes of bouts, NaN with fewer than MIN_INTERVALS intervals
+
+    Only intervals inside one bout and wholly inside a window count.
+    """
+    first = np.concatenate([bout[:-1] for bout in bouts if len(bout) > 1] or [np.zeros(0)])
+    last = np.concatenate([bout[1:] for bout in bouts if len(bout) > 1] or [np.zeros(0)])
+    lengths = np.concatenate(([0.0], np.cumsum(last - first)))
+    # Intervals do not overlap, so those inside a window are consecutive
+    begin = np.searchsorted(first, starts, side="left")
+    stop = np.searchsorted(last, ends, side="right")
+    count = np.maximum(stop - begin, 0)
+    span = lengths[np.maximum(stop, begin)] - lengths[begin]
+    spm = np.full(len(starts), np.nan)
+    enough = (count >= MIN_INTERVALS) & (span > 0)
+    spm[enough] = 60.0 * count[enough] / span[enough]
+    return spm
+
+
+def cross_check(session, params=DEFAULT_PARAMS, start=None, end=None,
+                window_seconds=WINDOW_SECONDS, hop_seconds=HOP_SECONDS):
+    """Return the SpectralRate of a Session, compared with the strokes analyze() would find"""
+    uniform, smoothed = prepare(session, params)
+    _, bouts, _, _ = find_bouts(uniform, smoothed, start, end, params)
+    times, spm, confidence, axis_spm = spectral_rate(uniform.data, uniform.rate, window_seconds, hop_seconds)
+    times = times + uniform.times[0]
+    peak_spm = peak_window_rate(bouts, times - window_seconds / 2, times + window_seconds / 2)
+    with np.errstate(invalid="ignore"):
+        disagree = (confidence >= MIN_CONFIDENCE) & (np.abs(spm - peak_spm) > TOLERANCE * peak_spm)
+    return SpectralRate(times, spm, confidence, axis_spm, peak_spm, disagree)
@@ -0,0 +1,205 @@
+"""Stroke detection and stroke rate, as in imuProcess.ipynb
+
+Each step is a function over arrays:
+
+    resample      the samples on a uniform timebase, resample.py
+    smooth        two Savitzky-Golay passes (windows 75 and 65, order 2) as one filter, smoothing.py
+    window        the samples between start and end seconds, with times from start
+    detect_peaks  find_peaks with thresholds from the mean and standard deviation
+    stroke_rate   instantaneous rate from the intervals between strokes
+
+analyze() runs them on one column of a Session. As in the notebook, the
+whole recording is smoothed before the window is cut out, and the peak
+thresholds come from the smoothed window. Without a window, the strokes
+are found in each swimming segment (segment.py) instead, so that no one
+has to pick the start and end of every session by eye.
+
+Unlike the notebook, smoothing windows and the distance between strokes
+are set in seconds and turned into samples at the rate of each session,
+so that they mean the same in every session. The defaults are the
+notebook's sample counts at the 80 Hz the loggers record at.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from scipy.signal import find_peaks
+
+from ..logformat import SENSOR_COLUMNS
+from .loader import session_name
+from .resample import resample, window_samples
+from .segment import SWIM, find_segments
+from .smoothing import POLYORDER, SMOOTHING_WINDOWS, smooth
+
+# Rate at which the notebook's sample counts are turned into seconds, Hz
+NOTEBOOK_RATE = 80.0
+PEAK_DISTANCE = 80          # samples between strokes in the notebook
+
+Params = namedtuple("Params", [
+    "windows",          # Savitzky-Golay window of each pass, seconds
+    "polyorder",
+    "distance",         # seconds between strokes, at least
+    "height_mean",      # peak height threshold: height_mean * mean + height_std * std
+    "height_std",
+    "prominence_std",   # peak prominence threshold: prominence_std * std
+    "column",           # sensor column the strokes are found in
+    "rate",             # Hz of the uniform timebase, None for the rate of each session
+])
+
+# The notebook's settings
+DEFAULT_PARAMS = Params(tuple(window / NOTEBOOK_RATE for window in SMOOTHING_WINDOWS), POLYORDER,
+                        PEAK_DISTANCE / NOTEBOOK_RATE, 0.9, 0.2, 0.5, "AccelZ", None)
+
+Segment = namedtuple("Segment", [
+    "kind",             # segment.SWIM, TURN or REST
+    "start",            # seconds
+    "end",
+    "strokes",          # strokes found, 0 outside swimming
+    "spm",              # mean instantaneous stroke rate, NaN outside swimming
+])
+
+StrokeRate = namedtuple("StrokeRate", [
+    "times",            # midpoints between consecutive strokes, seconds
+    "spm",              # instantaneous strokes per minute
+    "mean_spm",         # mean of spm, the notebook's final cumulative average, NaN without strokes
+])
+
+SessionResult = namedtuple("SessionResult", [
+    "name",
+    "path",
+    "samples",
+    "duration",         # seconds from the first to the last sample
+    "sample_rate",      # Hz, estimated outside dropouts
+    "bad_lines",        # CSV rows skipped while loading
+    "duplicates",       # samples written twice, dropped
+    "dropouts",         # gaps in the samples
+    "start",            # analyzed window, seconds
+    "end",
+    "swims",            # swimming segments found, None when the window was given
+    "strokes",
+    "spm",              # mean instantaneous stroke rate, as the notebook reports it
+    "span_spm",         # strokes - 1 over the time from the first to the last stroke
+    "error",            # None, or why the session could not be analyzed
+])
+
+
+def window(times, values, start=None, end=None):
+    """Return (times, values) between start and end seconds, with times counted from start"""
+    mask = np.ones(len(times), dtype=bool)
+    if start is not None:
+        mask &= times >= start
+    if end is not None:
+        mask &= times <= end
+    return times[mask] - (start or 0.0), values[mask]
+
+
+def sample_counts(params, rate):
+    """Return (smoothing windows, distance between strokes) of params in samples at rate"""
+    windows = tuple(window_samples(window, rate, params.polyorder) for window in params.windows)
+    return windows, max(1, int(round(params.distance * rate)))
+
+
+def peak_thresholds(signal, params=DEFAULT_PARAMS):
+    """Return (height, prominence) thresholds for find_peaks on signal"""
+    mean = np.mean(signal)
+    std = np.std(signal)
+    return params.height_mean * mean + params.height_std * std, params.prominence_std * std
+
+
+def detect_peaks(signal, rate, params=DEFAULT_PARAMS):
+    """Return the indices of the strokes in a smoothed signal sampled at rate"""
+    if len(signal) == 0:
+        return np.zeros(0, dtype=np.intp)
+    height, prominence = peak_thresholds(signal, params)
+    _, distance = sample_counts(params, rate)
+    peaks, _ = find_peaks(signal, height=height, distance=distance, prominence=prominence)
+    return peaks
+
+
+def stroke_rate(peak_times):
+    """Return the StrokeRate of strokes at peak_times (seconds)"""
+    peak_times = np.asarray(peak_times, dtype=np.float64)
+    intervals = np.diff(peak_times)
+    spm = 60.0 / intervals if len(intervals) else np.zeros(0)
+    mean_spm = float(spm.mean()) if len(spm) else float("nan")
+    return StrokeRate((peak_times[:-1] + peak_times[1:]) / 2, spm, mean_spm)
+
+
+def prepare(session, params=DEFAULT_PARAMS):
+    """Return (Resampled session, its smoothed stroke column)"""
+    uniform = resample(session.times, session.data, params.rate)
+    windows, _ = sample_counts(params, uniform.rate)
+    column = uniform.data[:, SENSOR_COLUMNS.index(params.column)]
+    return uniform, smooth(column, windows, params.polyorder)
+
+
+def _strokes(times, smoothed, first, stop, rate, params):
+    # Stroke times within one segment, with thresholds of its own
+    return times[first:stop][detect_peaks(smoothed[first:stop], rate, params)]
+
+
+def segments(session, params=DEFAULT_PARAMS):
+    """Return the Segments of a Session, with the strokes of each swimming segment"""
+    uniform, smoothed = prepare(session, params)
+    times = uniform.times
+    result = []
+    for kind, first, stop in find_segments(uniform.data, uniform.rate):
+        strokes, spm = 0, float("nan")
+        if kind == SWIM:
+            peak_times = _strokes(times, smoothed, first, stop, uniform.rate, params)
+            strokes, spm = len(peak_times), stroke_rate(peak_times).mean_spm
+        end = times[stop] if stop < len(times) else times[-1]
+        result.append(Segment(kind, float(times[first]), float(end), strokes, spm))
+    return result
+
+
+def find_bouts(uniform, smoothed, start=None, end=None, params=DEFAULT_PARAMS):
+    """Return (swims, bouts, start, end) for the output of prepare()
+
+    bouts holds the stroke times of each swimming segment, or of the window
+    from start to end seconds when either is given; swims is the number of
+    swimming segments, None for a window. Stroke times are seconds since
+    the first sample.
+    """
+    times = uniform.times
+    if start is None and end is None:
+        swims = [(first, stop) for kind, first, stop in find_segments(uniform.data, uniform.rate)
+                 if kind == SWIM]
+        bouts = [_strokes(times, smoothed, first, stop, uniform.rate, params) for first, stop in swims]
+        if swims:
+            start, end = float(times[swims[0][0]]), float(times[swims[-1][1] - 1])
+        else:
+            start = end = 0.0
+        return len(swims), bouts, start, end
+    start = 0.0 if start is None else start
+    end = float(times[-1]) if end is None else end
+    window_times, window_signal = window(times, smoothed, start, end)
+    return None, [window_times[detect_peaks(window_signal, uniform.rate, params)] + start], start, end
+
+
+def analyze(session, start=None, end=None, params=DEFAULT_PARAMS):
+    """Find the strokes of a Session and return a SessionResult
+
+    Without start and end the strokes are those of the swimming segments
+    (segment.py), otherwise those between start and end seconds, as in the
+    notebook.
+    """
+    name = session_name(session.path)
+    nan = float("nan")
+    try:
+        uniform, smoothed = prepare(session, params)
+    except ValueError as e:
+        # Shorter than a smoothing window
+        return SessionResult(name, session.path, len(session.times), 0.0, 0.0, len(session.bad_lines),
+                             0, 0, start, end, None, 0, nan, nan, str(e))
+    duration = float(uniform.times[-1] - uniform.times[0])
+    swims, bouts, start, end = find_bouts(uniform, smoothed, start, end, params)
+
+    # Intervals between strokes of different bouts span a turn and are not counted
+    strokes = sum(len(bout) for bout in bouts)
+    spm = np.concatenate([stroke_rate(bout).spm for bout in bouts]) if bouts else np.zeros(0)
+    span = sum(float(bout[-1] - bout[0]) for bout in bouts if len(bout) > 1)
+    span_spm = 60.0 * len(spm) / span if span > 0 else nan
+    return SessionResult(name, session.path, len(session.times), duration, uniform.rate,
+                         len(session.bad_lines), uniform.duplicates, len(uniform.dropouts), start, end,
+                         swims, strokes, float(spm.mean()) if len(spm) else nan, span_spm, None)
@@ -0,0 +1,204 @@
+"""Tuning the stroke detection against counted sessions
+
+A labels file lists sessions whose strokes were counted by hand, as CSV
+with a header:
+
+    path,strokes,start,end
+    downloaded_files/IMU_0_00-17-14.csv,36,4,80
+
+path is relative to the labels file, start and end are the counted window
+in seconds. The true stroke rate of a session is strokes over the window,
+as in the notebook, and a parameter set is scored by how far the stroke
+rate analyze() would report is from it.
+
+sweep() evaluates a grid of parameter sets, or a random sample of it, in a
+process pool. The labelled sessions are loaded, resampled and packed into
+one shared memory block once; the workers map it instead of receiving
+copies. Parameter sets are grouped by their smoothing, and each task
+smooths every session once and then tries all peak settings of its group
+on the smoothed signals.
+
+Only IMU_0_00-17-14 is counted so far. The swim1-4 sessions are named by
+their stroke rate but their strokes were never counted; add them to the
+labels file once they are, since tuning on one session mostly fits that
+session.
+"""
+
+import csv
+import itertools
+import os
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ..logformat import SENSOR_COLUMNS
+from .loader import load, session_name
+from .resample import resample
+from .smoothing import smooth
+from .stroke import DEFAULT_PARAMS, detect_peaks, sample_counts, stroke_rate, window
+
+LABELS_NAME = "stroke_labels.csv"
+
+Label = namedtuple("Label", ["path", "strokes", "start", "end"])
+
+# Layout of one session in the shared block
+_Slot = namedtuple("_Slot", ["name", "offset", "count", "rate", "start", "end", "true_spm", "strokes"])
+
+Score = namedtuple("Score", [
+    "params",
+    "spm_error",        # mean absolute error of the stroke rate over the sessions, SPM
+    "max_spm_error",
+    "stroke_error",     # mean absolute error of the stroke count
+    "spm",              # stroke rate of each session, in label order
+])
+
+# Values tried by default, around the notebook's settings. Windows are
+# (first pass, second pass) in seconds, the notebook's 75 and 65 samples
+# at 80 Hz being (0.9375, 0.8125)
+DEFAULT_GRID = {
+    "windows": [(0.5, 0.4375), (0.75, 0.65), (0.9375, 0.8125), (1.25, 1.0875)],
+    "polyorder": [2, 3],
+    "distance": [0.6, 0.8, 1.0, 1.25],
+    "height_mean": [0.8, 0.9, 1.0],
+    "height_std": [0.0, 0.2, 0.4],
+    "prominence_std": [0.25, 0.5, 0.75],
+}
+
+# Set by _attach() in each worker process
+_shared = None
+
+
+def read_labels(path):
+    """Return the Labels of a labels file, with paths made absolute"""
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        return [Label(os.path.join(directory, row["path"]), int(row["strokes"]),
+                      float(row["start"]), float(row["end"]))
+                for row in csv.DictReader(f)]
+
+
+def parameter_grid(grid=DEFAULT_GRID, base=DEFAULT_PARAMS, samples=None, seed=0):
+    """Return the Params of every combination of grid values, or a random sample of them"""
+    names = list(grid)
+    combinations = list(itertools.product(*(grid[name] for name in names)))
+    if samples is not None and samples < len(combinations):
+        combinations = random.Random(seed).sample(combinations, samples)
+    return [base._replace(**dict(zip(names, values))) for values in combinations]
+
+
+def pack(labels, column=DEFAULT_PARAMS.column, rate=None):
+    """Load and resample the labelled sessions, return (values, slots) with all signals in one array"""
+    signals = []
+    slots = []
+    offset = 0
+    index = SENSOR_COLUMNS.index(column)
+    for label in labels:
+        session = load(label.path)
+        uniform = resample(session.times, session.data[:, index], rate)
+        signals.append(uniform.data)
+        true_spm = 60.0 * label.strokes / (label.end - label.start)
+        slots.append(_Slot(session_name(label.path), offset, len(uniform.data), uniform.rate,
+                           label.start, label.end, true_spm, label.strokes))
+        offset += len(uniform.data)
+    return np.concatenate(signals) if signals else np.zeros(0), slots
+
+
+def evaluate(values, slots, smoothing, variants):
+    """Score the Params in variants, which share smoothing (windows, polyorder), on packed sessions"""
+    windows, polyorder = smoothing
+    smoothed = []
+    for slot in slots:
+        signal = values[slot.offset:slot.offset + slot.count]
+        counts, _ = sample_counts(variants[0], slot.rate)
+        times = np.arange(slot.count) / slot.rate
+        smoothed.append(window(times, smooth(signal, counts, polyorder), slot.start, slot.end))
+
+    scores = []
+    for params in variants:
+        spm = []
+        strokes = []
+        for slot, (times, signal) in zip(slots, smoothed):
+            peaks = detect_peaks(signal, slot.rate, params)
+            spm.append(stroke_rate(times[peaks]).mean_spm)
+            strokes.append(len(peaks))
+        errors = np.abs(np.array(spm) - [slot.true_spm for slot in slots])
+        # A parameter set that finds fewer than two strokes somewhere is the worst
+        errors[np.isnan(errors)] = np.inf
+        stroke_errors = np.abs(np.array(strokes) - [slot.strokes for slot in slots])
+        scores.append(Score(params, float(errors.mean()), float(errors.max()), float(stroke_errors.mean()),
+                            tuple(spm)))
+    return scores
+
+
+def _attach(name, size, slots):
+    global _shared
+    memory = shared_memory.SharedMemory(name=name)
+    _shared = (memory, np.ndarray((size,), dtype=np.float64, buffer=memory.buf), slots)
+
+
+def _evaluate_shared(smoothing, variants):
+    _, values, slots = _shared
+    return evaluate(values, slots, smoothing, variants)
+
+
+def sweep(labels, parameter_sets, workers=None):
+    """Score parameter_sets on the labelled sessions, return the Scores, best first, and the slots"""
+    base = parameter_sets[0] if parameter_sets else DEFAULT_PARAMS
+    values, slots = pack(labels, base.column, base.rate)
+    groups = {}
+    for params in parameter_sets:
+        groups.setdefault((tuple(params.windows), params.polyorder), []).append(params)
+
+    if workers == 1 or len(groups) <= 1:
+        scores = [score for smoothing, variants in groups.items()
+                  for score in evaluate(values, slots, smoothing, variants)]
+    else:
+        memory = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        try:
+            np.ndarray(values.shape, dtype=np.float64, buffer=memory.buf)[:] = values
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                     initargs=(memory.name, len(values), slots)) as pool:
+                results = pool.map(_evaluate_shared, list(groups), list(groups.values()))
+                scores = [score for group in results for score in group]
+        finally:
+            memory.close()
+            memory.unlink()
+    scores.sort(key=lambda score: (score.spm_error, score.stroke_error, score.max_spm_error))
+    return scores, slots
+
+
+def describe(params):
+    """Short text of the tuned fields of Params"""
+    windows = "+".join(f"{window:g}" for window in params.windows)
+    return (f"windows {windows} s, order {params.polyorder}, distance {params.distance:g} s, "
+            f"height {params.height_mean:g}*mean+{params.height_std:g}*std, "
+            f"prominence {params.prominence_std:g}*std")
+
+
+def format_scores(scores, slots, top=20):
+    """Lines of a ranked table of the best scores"""
+    lines = [f"{'rank':>4} {'SPM error':>9} {'max':>6} {'strokes':>7}  "
+             + " ".join(f"{slot.name[:14]:>14}" for slot in slots) + "  parameters",
+             f"{'':>4} {'':>9} {'':>6} {'':>7}  "
+             + " ".join(f"{slot.true_spm:>14.1f}" for slot in slots) + "  (counted)"]
+    for rank, score in enumerate(scores[:top], 1):
+        lines.append(f"{rank:>4} {score.spm_error:>9.2f} {score.max_spm_error:>6.2f} {score.stroke_error:>7.1f}  "
+                     + " ".join(f"{spm:>14.1f}" for spm in score.spm) + f"  {describe(score.params)}")
+    return lines
+
+
+def write_scores(scores, slots, path):
+    """Write all scores as CSV, best first"""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank", "spm_error", "max_spm_error", "stroke_error", "windows", "polyorder", "distance",
+                         "height_mean", "height_std", "prominence_std"] + [f"spm_{slot.name}" for slot in slots])
+        for rank, score in enumerate(scores, 1):
+            params = score.params
+            writer.writerow([rank, score.spm_error, score.max_spm_error, score.stroke_error,
+                             " ".join(f"{window:g}" for window in params.windows), params.polyorder,
+                             params.distance, params.height_mean, params.height_std, params.prominence_std]
+                            + list(score.spm))
@@ -0,0 +1,547 @@
+"""Benchmarks for the download path
+
+Each case downloads a synthetic IMU log from a SimulatedLogger through the
+TransferEngine, with a stand-in GUI thread subscribed to the engine's
+events. A case runs in its own process so that its peak RSS is its own.
+Results are written as JSON, and two reports can be compared:
+
+    python -m form24 bench transfer --sizes 10K,1M,50M --out before.json
+    python -m form24 bench compare before.json after.json
+
+The compression benchmark transfers real logs (core/downloaded_files) both
+plain and compressed. The link time is estimated from the number of
+notifications at the firmware's pacing, which is what limits a real
+transfer; the host's own time is measured with no pacing at all.
+
+    python -m form24 bench compression --dir downloaded_files
+
+The listing benchmark lists a simulated SD card of up to 10,000 files,
+with the paged listing and with the single-message listing of older
+firmware, and checks every entry that arrives.
+
+    python -m form24 bench listing --files 100,1000,10000
+
+The MTU benchmark downloads a file over a simulated radio with limited
+airtime and transmit buffers at several MTUs. It compares the fixed
+512-byte frames and 60 ms pacing of older firmware, frames fitted to the
+MTU with that pacing, and frames fitted to the MTU with adaptive pacing.
+
+    python -m form24 bench mtu --mtus 23,185,512
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import queue
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .linkcontrol import frame_size_for_mtu
+from .protocol import link_command
+from .simulator import (
+    SimulatedClient, SimulatedLogger, LinkConditions, CHUNK_INTERVAL, LIST_PAGE_INTERVAL,
+    TRANSFER_START_DELAY,
+)
+from .transfer import (
+    TransferEngine, EVENT_ERROR, EVENT_LOG, EVENT_PROGRESS, EVENT_TRANSFER_COMPLETE,
+)
+
+DEFAULT_SIZES = "10K,100K,1M,10M,50M"
+DEFAULT_FILE_COUNTS = "100,1000,10000"
+DEFAULT_MTUS = "23,185,512"
+
+# Simulated radio for the MTU benchmark: about 1 ms per notification plus
+# 8 us per byte (1M PHY), and room for 8 notifications in the device's
+# transmit buffers
+RADIO = {"packet_time": 0.001, "byte_time": 8e-6, "tx_buffers": 8}
+
+# Link modes of the MTU benchmark
+LINK_MODES = ("fixed", "fitted", "adaptive")
+
+# Time the stand-in GUI thread spends rendering one event
+RENDER_COST = 0.001
+
+_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text):
+    """Parse sizes such as 512, 10K or 50M into bytes"""
+    text = text.strip().upper()
+    if text and text[-1] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(text)
+
+
+def parse_sizes(text):
+    return [parse_size(size) for size in text.split(",") if size.strip()]
+
+
+def synthetic_log(size, seed=0):
+    """Return size bytes of CSV in the logger's format"""
+    data = bytearray(b"Time,AccelX,AccelY,AccelZ,GyroX,GyroY,GyroZ\n")
+    t = 1000 + seed
+    n = 0
+    while len(data) < size:
+        # Cheap deterministic values with the same digit counts as real data
+        v = (n * 7919 + seed) % 20000
+        data += f"{t},{v - 10000},{(v * 3) % 16000 - 8000},{-12000 + v % 4000},{v % 2000 - 1000},{5000 - v},{v - 4000}\n".encode()
+        t += 11 + n % 12
+        n += 1
+    del data[size:]
+    return bytes(data)
+
+
+def file_digest(path):
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def current_rss_kb():
+    """Resident set size right now, or 0 where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss_kb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def git_revision():
+    """Return the current commit, so reports can be matched to the code"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class GuiStandIn:
+    """A thread that consumes engine events like the Tk main loop would"""
+
+    def __init__(self, render_cost=RENDER_COST):
+        self.render_cost = render_cost
+        self.queue = queue.Queue()
+        self.max_depth = 0
+        self.waits = []
+        self.events = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def post(self, event, payload):
+        # Called on the BLE loop thread, like root.after(0, ...)
+        self.queue.put((time.perf_counter(), event))
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _run(self):
+        while True:
+            posted, event = self.queue.get()
+            if event is None:
+                return
+            self.waits.append(time.perf_counter() - posted)
+            self.events += 1
+            if self.render_cost:
+                time.sleep(self.render_cost)
+
+    def stop(self):
+        self.queue.put((time.perf_counter(), None))
+        self._thread.join()
+
+
+async def _download(engine, client, filename, retries, compress=False):
+    await client.connect()
+    await engine.attach(client)
+    try:
+        # The temporary directory starts empty, so resuming only recovers lost chunks
+        return await engine.download(filename, retries=retries, compress=compress)
+    finally:
+        await engine.detach()
+        await client.disconnect()
+
+
+def run_transfer_case(size, mtu=517, latency=0.0, jitter=0.0, loss=0.0, chunk_size=512,
+                      chunk_interval=0.0, render_cost=RENDER_COST, retries=100, seed=0):
+    """Download one synthetic file and return the measurements"""
+    data = synthetic_log(size, seed)
+    expected = hashlib.sha256(data).hexdigest()
+    filename = "bench.csv"
+    logger = SimulatedLogger({filename: data}, chunk_size=chunk_size,
+                             chunk_interval=chunk_interval, start_delay=0)
+    client = SimulatedClient(logger, LinkConditions(latency, jitter, mtu, loss, seed))
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Fixed chunks, so that the host's cost is measured at the given chunk size
+        engine = TransferEngine(directory, adaptive=False)
+        gui = GuiStandIn(render_cost)
+        engine.subscribe(gui.post)
+        errors = []
+        engine.subscribe(lambda event, payload: event == EVENT_ERROR and errors.append(payload["message"]))
+
+        # Time spent by the host in the notification handler, per chunk
+        handle = engine.handle_notification
+        latencies = []
+
+        def timed_handler(sender, payload):
+            start = time.perf_counter()
+            handle(sender, payload)
+            latencies.append(time.perf_counter() - start)
+
+        engine.handle_notification = timed_handler
+
+        # The simulated SD card holds the file in memory, that is not the host's cost
+        baseline_rss = current_rss_kb()
+        started = time.perf_counter()
+        path = asyncio.run(_download(engine, client, filename, retries))
+        elapsed = time.perf_counter() - started
+        gui.stop()
+
+        correct = file_digest(path) == expected
+
+    return {
+        "size": size,
+        "mtu": mtu,
+        "latency": latency,
+        "jitter": jitter,
+        "loss": loss,
+        "chunk_size": chunk_size,
+        "chunk_interval": chunk_interval,
+        "correct": correct,
+        "elapsed_s": elapsed,
+        "bytes_per_s": size / elapsed if elapsed > 0 else 0.0,
+        "notifications": len(latencies),
+        "notifications_dropped": client.notifications_dropped,
+        "transfer_errors": len(errors),
+        "chunk_latency_us": {
+            "p50": percentile(latencies, 0.50) * 1e6,
+            "p95": percentile(latencies, 0.95) * 1e6,
+            "max": max(latencies, default=0.0) * 1e6,
+        },
+        "gui_events": gui.events,
+        "gui_queue_max_depth": gui.max_depth,
+        "gui_queue_wait_ms_p95": percentile(gui.waits, 0.95) * 1e3,
+        "baseline_rss_kb": baseline_rss,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def run_compression_case(path, compress, mtu=517, link_chunk_interval=CHUNK_INTERVAL):
+    """Download a local file from a simulated logger, plain or compressed"""
+    with open(path, "rb") as f:
+        data = f.read()
+    expected = hashlib.sha256(data).hexdigest()
+    filename = os.path.basename(path)
+    logger = SimulatedLogger({filename: data}, chunk_interval=0, start_delay=0)
+    client = SimulatedClient(logger, LinkConditions(mtu=mtu))
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = TransferEngine(directory, adaptive=False)
+        completed = {}
+        engine.subscribe(lambda event, payload: event == EVENT_TRANSFER_COMPLETE and completed.update(payload))
+        started = time.perf_counter()
+        path = asyncio.run(_download(engine, client, filename, retries=0, compress=compress))
+        elapsed = time.perf_counter() - started
+        correct = file_digest(path) == expected
+
+    # Every notification but "Transfer starting" and "Transfer complete" is a chunk
+    chunks = client.notifications_sent - 2
+    link_time = TRANSFER_START_DELAY + chunks * link_chunk_interval
+    return {
+        "file": filename,
+        "size": len(data),
+        "compress": compress,
+        "mtu": mtu,
+        "correct": correct,
+        "wire_bytes": completed.get("wire_bytes", 0),
+        "chunks": chunks,
+        "link_time_s": link_time,
+        "host_time_s": elapsed,
+    }
+
+
+def run_compression_suite(directory, log=print, **settings):
+    """Transfer every file in directory plain and compressed, and return the report"""
+    names = sorted(name for name in os.listdir(directory)
+                   if os.path.isfile(os.path.join(directory, name)) and not name.startswith("."))
+    cases = []
+    totals = {False: 0.0, True: 0.0}
+    for name in names:
+        plain, compressed = (run_compression_case(os.path.join(directory, name), compress, **settings)
+                             for compress in (False, True))
+        log(format_compression_case(plain, compressed))
+        cases += [plain, compressed]
+        totals[False] += plain["link_time_s"]
+        totals[True] += compressed["link_time_s"]
+    if totals[True]:
+        log(f"Total link time {totals[False]:.1f} s plain, {totals[True]:.1f} s compressed "
+            f"({totals[False] / totals[True]:.2f}x faster)")
+    return make_report("compression", cases, directory=directory, **settings)
+
+
+def format_compression_case(plain, compressed):
+    ratio = plain["wire_bytes"] / compressed["wire_bytes"] if compressed["wire_bytes"] else 0.0
+    ok = plain["correct"] and compressed["correct"]
+    return (f"{plain['file']:<36} {plain['size']:>8} B -> {compressed['wire_bytes']:>8} B ({ratio:4.2f}x)  "
+            f"link {plain['link_time_s']:6.1f} s -> {compressed['link_time_s']:6.1f} s  "
+            f"host {plain['host_time_s'] * 1e3:6.1f} ms -> {compressed['host_time_s'] * 1e3:6.1f} ms  "
+            f"{'ok' if ok else 'CORRUPT'}")
+
+
+async def _download_for(engine, client, filename, time_limit, link=None):
+    # Download for at most time_limit seconds, return the path or None
+    await client.connect()
+    await engine.attach(client)
+    try:
+        if link is not None:
+            await engine.send_command(link_command(*link))
+            # Let the reply leave the radio before the transfer starts
+            await asyncio.sleep(0.1)
+        return await asyncio.wait_for(engine.download(filename, retries=10), time_limit)
+    except Exception:
+        return None
+    finally:
+        await engine.detach()
+        await client.disconnect()
+
+
+def run_mtu_case(size, mtu, mode, time_limit=30.0, seed=0):
+    """Download a synthetic file over the simulated radio at one MTU and return the measurements
+
+    mode is "fixed" (older firmware), "fitted" (frames fitted to the MTU,
+    60 ms pacing) or "adaptive".
+    """
+    data = synthetic_log(size, seed)
+    expected = hashlib.sha256(data).hexdigest()
+    filename = "bench.csv"
+    logger = SimulatedLogger({filename: data}, chunk_interval=CHUNK_INTERVAL, framed=True)
+    client = SimulatedClient(logger, LinkConditions(mtu=mtu, seed=seed, **RADIO))
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = TransferEngine(directory, adaptive=mode == "adaptive")
+        received = [0]
+        engine.subscribe(lambda event, payload: event in (EVENT_PROGRESS, EVENT_TRANSFER_COMPLETE)
+                         and received.__setitem__(0, payload["received"]))
+        link = (frame_size_for_mtu(mtu), CHUNK_INTERVAL) if mode == "fitted" else None
+        started = time.perf_counter()
+        path = asyncio.run(_download_for(engine, client, filename, time_limit, link))
+        elapsed = time.perf_counter() - started
+        correct = path is not None and file_digest(path) == expected
+        frame_size, interval = engine.tuner.settings if engine.tuner else (logger.chunk_size, logger.chunk_interval)
+
+    return {
+        "size": size,
+        "mtu": mtu,
+        "mode": mode,
+        "correct": correct,
+        "received": received[0],
+        "elapsed_s": elapsed,
+        "bytes_per_s": received[0] / elapsed if elapsed > 0 else 0.0,
+        "notifications": client.notifications_sent,
+        "notifications_dropped": client.notifications_dropped,
+        "frame_size": frame_size,
+        "chunk_interval_ms": interval * 1000,
+        "losses": engine.tuner.losses if engine.tuner else 0,
+    }
+
+
+def run_mtu_suite(mtus, size, log=print, **settings):
+    """Run the MTU benchmark for every MTU and link mode and return the report"""
+    cases = []
+    for mtu in mtus:
+        for mode in LINK_MODES:
+            case = run_mtu_case(size, mtu, mode, **settings)
+            log(format_mtu_case(case))
+            cases.append(case)
+    return make_report("mtu", cases, size=size, radio=RADIO, **settings)
+
+
+def format_mtu_case(case):
+    status = "ok" if case["correct"] else ("FAILED" if case["received"] == 0 else "partial")
+    return (f"MTU {case['mtu']:>3}  {case['mode']:<8}  {case['bytes_per_s'] / 1024:7.2f} KB/s  "
+            f"{case['received']:>8} of {case['size']} B in {case['elapsed_s']:5.1f} s  "
+            f"frames {case['frame_size']:>3} B every {case['chunk_interval_ms']:5.1f} ms  "
+            f"{case['notifications_dropped']:>4} dropped  {status}")
+
+
+def synthetic_card(count, seed=0):
+    """Return (files, mtimes) for an SD card of count logs named like the firmware's"""
+    rng = random.Random(seed)
+    data = bytes(20000)
+    files = {}
+    mtimes = {}
+    uptime = 0
+    for _ in range(count):
+        uptime += rng.randint(20, 4000)
+        minutes, seconds = divmod(uptime, 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        name = f"IMU_{days}_{hours:02d}-{minutes:02d}-{seconds:02d}.bin"
+        # Views of one buffer, only the sizes matter for a listing
+        files[name] = memoryview(data)[:rng.randint(32, len(data))]
+        mtimes[name] = uptime
+    return files, mtimes
+
+
+async def _list(engine, client):
+    await client.connect()
+    await engine.attach(client)
+    try:
+        return await engine.list_files()
+    finally:
+        await engine.detach()
+        await client.disconnect()
+
+
+def run_listing_case(count, paged=True, mtu=517, loss=0.0, seed=0):
+    """List a simulated card of count files and return the measurements"""
+    files, mtimes = synthetic_card(count, seed)
+    expected = [(name, len(data), mtimes[name] if paged else None) for name, data in files.items()]
+    # Without paged listings, as older firmware, which also sends messages unframed
+    logger = SimulatedLogger(files, mtimes=mtimes, chunk_interval=0, start_delay=0, page_interval=0,
+                             framed=paged)
+    client = SimulatedClient(logger, LinkConditions(mtu=mtu, loss=loss, seed=seed))
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = TransferEngine(directory, adaptive=False)
+        engine.paged_listing = True if paged else False
+        resumes = []
+        engine.subscribe(lambda event, payload: event == EVENT_LOG
+                         and "listing again" in payload["message"] and resumes.append(payload["message"]))
+        started = time.perf_counter()
+        try:
+            listing = asyncio.run(_list(engine, client))
+        except Exception:
+            listing = []
+        elapsed = time.perf_counter() - started
+
+    listed = [tuple(entry) for entry in listing]
+    return {
+        "files": count,
+        "paged": paged,
+        "mtu": mtu,
+        "loss": loss,
+        "listed": len(listed),
+        "correct": listed == expected,
+        "notifications": client.notifications_sent,
+        "notifications_dropped": client.notifications_dropped,
+        "resumes": len(resumes),
+        "host_time_s": elapsed,
+        # The firmware sends one page per loop() pass
+        "link_time_s": client.notifications_sent * LIST_PAGE_INTERVAL,
+    }
+
+
+def run_listing_suite(counts, log=print, **settings):
+    """List simulated cards of every size, paged and in one message, and return the report"""
+    cases = []
+    for count in counts:
+        for paged in (True, False):
+            case = run_listing_case(count, paged=paged, **settings)
+            log(format_listing_case(case))
+            cases.append(case)
+    return make_report("listing", cases, **settings)
+
+
+def format_listing_case(case):
+    kind = "paged" if case["paged"] else "single message"
+    return (f"{case['files']:>6} files, {kind:<14}  {case['listed']:>6} listed  "
+            f"{case['notifications']:>5} notifications ({case['notifications_dropped']} dropped, "
+            f"{case['resumes']} resumes)  link {case['link_time_s']:5.2f} s  "
+            f"host {case['host_time_s'] * 1e3:7.1f} ms  {'ok' if case['correct'] else 'INCOMPLETE'}")
+
+
+def run_isolated(function, **kwargs):
+    """Run a benchmark case in a fresh process and return its result"""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(function, **kwargs).result()
+
+
+def make_report(benchmark, cases, **settings):
+    return {
+        "benchmark": benchmark,
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings,
+        "cases": cases,
+    }
+
+
+def write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def run_transfer_suite(sizes, log=print, **settings):
+    """Run the transfer benchmark for every size and return the report"""
+    cases = []
+    for size in sizes:
+        result = run_isolated(run_transfer_case, size=size, **settings)
+        log(format_case(result))
+        cases.append(result)
+    return make_report("transfer", cases, **settings)
+
+
+def format_case(case):
+    return (f"{case['size']:>10} B  {case['bytes_per_s'] / 1024:9.1f} KB/s  "
+            f"chunk p95 {case['chunk_latency_us']['p95']:7.1f} us  "
+            f"GUI queue max {case['gui_queue_max_depth']:4d}  "
+            f"peak RSS {case['peak_rss_kb'] / 1024:6.1f} MB "
+            f"(baseline {case['baseline_rss_kb'] / 1024:.1f} MB)  {'ok' if case['correct'] else 'CORRUPT'}")
+
+
+def compare_reports(old, new):
+    """Return lines comparing the cases two reports have in common"""
+    keys = ("bytes_per_s", "gui_queue_max_depth", "peak_rss_kb")
+    old_cases = {_case_key(case): case for case in old["cases"]}
+    lines = [f"{old['revision']} -> {new['revision']}"]
+    for case in new["cases"]:
+        before = old_cases.get(_case_key(case))
+        if before is None:
+            continue
+        changes = []
+        for key in keys:
+            if before[key]:
+                changes.append(f"{key} {100.0 * (case[key] - before[key]) / before[key]:+.1f}%")
+        p95_before = before["chunk_latency_us"]["p95"]
+        if p95_before:
+            change = 100.0 * (case["chunk_latency_us"]["p95"] - p95_before) / p95_before
+            changes.append(f"chunk_p95 {change:+.1f}%")
+        lines.append(f"{case['size']:>10} B  " + "  ".join(changes))
+    return lines
+
+
+def _case_key(case):
+    return tuple((key, case[key]) for key in sorted(case)
+                 if isinstance(case[key], (int, float, str)) and key in
+                 ("size", "mtu", "latency", "jitter", "loss", "chunk_size", "chunk_interval"))
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
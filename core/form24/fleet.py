@@ -0,0 +1,226 @@
+"""Download new files from a fleet of loggers in parallel
+
+FleetSync scans once, then connects to every logger it found with a bounded
+number of concurrent connections. Each device gets its own TransferEngine,
+so transfer state is kept per device, and its files are saved in a
+subdirectory named after its address (the firmware names files by uptime,
+so two loggers can produce the same file name).
+
+With delete, a file is deleted from the SD card once it has been
+downloaded and verified: every chunk passed its CRC check, the saved file
+has the size the card reports, and a second listing still reports that
+size, so a file that is still being logged is left alone.
+
+A download that gives up does not stop the device's other files; its part
+file is kept, so the next sync resumes it.
+
+Which files are new is decided from the manifest of the download
+directory (see manifest.py), without touching the files themselves.
+
+Loggers are reached through a transport (see transport.py), real BLE by
+default or the simulator for offline runs.
+"""
+
+import asyncio
+import os
+import time
+
+from .manifest import Manifest
+from .protocol import clean_filename
+from .transfer import (
+    TransferEngine, TransferError, EVENT_LOG, EVENT_TRANSFER_STARTED, EVENT_TRANSFER_COMPLETE,
+)
+from .transport import BleTransport, discover_loggers
+
+# Default number of devices connected at the same time
+MAX_CONCURRENT = 3
+
+
+def device_dir(download_dir, address):
+    """Return the download directory for one device"""
+    return os.path.join(download_dir, address.replace(":", "-"))
+
+
+class DeviceSync:
+    """Transfer state and results for one device of the fleet"""
+
+    def __init__(self, address, name=""):
+        self.address = address
+        self.name = name or address
+        self.files = []
+        self.downloaded = []
+        self.deleted = []
+        self.failed = {}        # name -> error, for downloads that gave up
+        self.bytes_received = 0
+        self.wire_bytes = 0     # less than bytes_received when transfers were compressed
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        """Bytes per second while this device was being synced"""
+        return self.bytes_received / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class FleetReport:
+    """Aggregate result of a fleet sync"""
+
+    def __init__(self, devices, elapsed):
+        self.devices = devices
+        self.elapsed = elapsed
+
+    @property
+    def bytes_received(self):
+        return sum(device.bytes_received for device in self.devices)
+
+    @property
+    def files_downloaded(self):
+        return sum(len(device.downloaded) for device in self.devices)
+
+    @property
+    def throughput(self):
+        """Aggregate bytes per second over the wall-clock time of the sync"""
+        return self.bytes_received / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        lines = [f"{self.files_downloaded} files, {self.bytes_received} bytes from "
+                 f"{len(self.devices)} devices in {self.elapsed:.1f} s "
+                 f"({self.throughput / 1024:.1f} KB/s aggregate)"]
+        for device in self.devices:
+            status = f"error: {device.error}" if device.error else "ok"
+            if device.failed and not device.error:
+                status = f"{len(device.failed)} failed"
+            link = f" ({device.wire_bytes} on the link)" if device.wire_bytes != device.bytes_received else ""
+            deleted = f", {len(device.deleted)} deleted" if device.deleted else ""
+            lines.append(f"  {device.name} ({device.address}): {len(device.downloaded)} files{deleted}, "
+                         f"{device.bytes_received} bytes{link}, {device.throughput / 1024:.1f} KB/s, {status}")
+        return "\n".join(lines)
+
+
+class FleetSync:
+    """Connects to N loggers at a time and downloads their new files
+
+    Without a manifest, the manifest of download_dir is opened, and
+    closed by close() or at the end of a with block.
+    """
+
+    def __init__(self, download_dir, max_concurrent=MAX_CONCURRENT, log=None,
+                 connect_timeout=20.0, transport=None, compress=False, delete=False, manifest=None,
+                 metrics_log=None):
+        self.download_dir = download_dir
+        self._own_manifest = manifest is None   # opened here, so closed by close()
+        self.manifest = manifest or Manifest(download_dir)
+        self.compress = compress
+        self.delete = delete
+        self.transport = transport or BleTransport()
+        self.max_concurrent = max_concurrent
+        self.connect_timeout = connect_timeout
+        self.log = log or (lambda message: None)
+        self.metrics_log = metrics_log  # a MetricsLog, gets one line per download
+
+    def close(self):
+        """Close the manifest, unless it was passed in"""
+        if self._own_manifest:
+            self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def run(self, devices=None, scan_timeout=5.0):
+        """Sync the given devices, or every logger found by one scan"""
+        started = time.monotonic()
+        if devices is None:
+            self.log("Scanning for loggers...")
+            devices = await discover_loggers(self.transport, scan_timeout)
+            self.log(f"Found {len(devices)} loggers")
+
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        states = [DeviceSync(device.address, device.name) for device in devices]
+        await asyncio.gather(*(self._sync_bounded(semaphore, device, state)
+                               for device, state in zip(devices, states)))
+        return FleetReport(states, time.monotonic() - started)
+
+    async def _sync_bounded(self, semaphore, device, state):
+        async with semaphore:
+            state.started = time.monotonic()
+            try:
+                await self._sync_device(device, state)
+            except Exception as e:
+                # Bleak raises its own error types, one bad device must not stop the others
+                state.error = str(e) or type(e).__name__
+            finally:
+                state.finished = time.monotonic()
+            if state.error:
+                self.log(f"{state.name}: {state.error}")
+
+    async def _sync_device(self, device, state):
+        directory = device_dir(self.download_dir, state.address)
+        engine = TransferEngine(directory, manifest=self.manifest, device=state.address)
+        resumed_from = {}
+        verified = {}
+
+        def on_event(event, payload):
+            if event == EVENT_TRANSFER_STARTED:
+                resumed_from[payload["filename"]] = payload["offset"]
+            elif event == EVENT_TRANSFER_COMPLETE:
+                # Only count file data that came over the link, not a resumed prefix
+                offset = resumed_from.pop(payload["filename"], 0)
+                state.bytes_received += payload["received"] - offset
+                state.wire_bytes += payload["wire_bytes"]
+                state.downloaded.append(payload["path"])
+                if payload["verified"]:
+                    verified[clean_filename(payload["filename"])] = payload["received"]
+            elif event == EVENT_LOG and not payload["message"].startswith("Received:"):
+                self.log(f"{state.name}: {payload['message']}")
+
+        engine.subscribe(on_event)
+        if self.metrics_log is not None:
+            engine.subscribe(self.metrics_log.on_event)
+        client = self.transport.client(device, timeout=self.connect_timeout)
+        self.log(f"Connecting to {state.name} ({state.address})...")
+        await client.connect()
+        try:
+            await engine.attach(client)
+            state.files = await engine.list_files()
+            new_files = [entry for entry in state.files
+                         if not self.manifest.have(state.address, entry.name, entry.size, entry.mtime)]
+            self.log(f"{state.name}: {len(new_files)} of {len(state.files)} files to download")
+
+            for entry in new_files:
+                try:
+                    await engine.download(entry.name, compress=self.compress)
+                except TransferError as e:
+                    # Its part file is kept for the next sync, go on with the other files
+                    state.failed[clean_filename(entry.name)] = str(e)
+                    self.log(f"{state.name}: giving up on {entry.name} for now: {e}")
+            if self.delete and verified:
+                await self._delete_verified(engine, directory, verified, state)
+        finally:
+            await engine.detach()
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+
+    async def _delete_verified(self, engine, directory, verified, state):
+        listing = {clean_filename(entry.name): entry.size for entry in await engine.list_files()}
+        for name, size in verified.items():
+            try:
+                saved = os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                saved = None
+            if listing.get(name) != size or saved != size:
+                self.log(f"{state.name}: keeping {name}, it changed since it was downloaded")
+                continue
+            await engine.delete_file(name)
+            state.deleted.append(name)
@@ -0,0 +1,97 @@
+"""Framed notifications on the data characteristic
+
+Every notification from the firmware is one frame:
+
+    offset  size  field
+    0       1     version (FRAME_VERSION)
+    1       1     frame type (FRAME_CONTROL, FRAME_DATA, ...)
+    2       4     sequence number, counts every frame since the connection started
+    6       2     payload length
+    8       4     CRC32, see below
+    12      n     payload
+
+All fields are little-endian. For data frames the CRC is the running CRC32
+of all file data sent since "Transfer starting:", including this frame, so a
+lost, repeated or reordered chunk is caught at the next frame. For every
+other frame type it is the CRC32 of the frame's own payload.
+
+A text message longer than one frame is split: every part but the last is
+sent in a FRAME_CONTROL_PART frame, the last in a FRAME_CONTROL frame.
+
+Frames start with the version byte, which no text message from older
+firmware can start with, so the receiver dispatches on the first byte.
+"""
+
+import struct
+import zlib
+from collections import namedtuple
+
+FRAME_VERSION = 1
+
+# Frame types
+FRAME_CONTROL = 0x01   # UTF-8 text message, e.g. "Transfer starting: ..."
+FRAME_DATA = 0x02      # file data
+FRAME_SAMPLES = 0x03   # live IMU samples, binary log records (see logformat.py)
+FRAME_CONTROL_PART = 0x04  # leading part of a text message, continued by the next control frame
+
+HEADER = struct.Struct("<BBIHI")
+HEADER_SIZE = HEADER.size
+
+Frame = namedtuple("Frame", "type seq payload crc")
+
+
+class FrameError(ValueError):
+    """Raised for a notification that is not a valid frame"""
+
+
+def is_frame(data):
+    """Return True if a notification is a frame rather than legacy text"""
+    return len(data) >= HEADER_SIZE and data[0] == FRAME_VERSION
+
+
+def parse_frame(data):
+    """Split a notification into a Frame, checking its length"""
+    version, frame_type, seq, length, crc = HEADER.unpack_from(data)
+    if version != FRAME_VERSION:
+        raise FrameError(f"Unsupported frame version {version}")
+    if len(data) != HEADER_SIZE + length:
+        # Typically a notification cut short by a small MTU
+        raise FrameError(f"Frame {seq} has {len(data) - HEADER_SIZE} payload bytes, expected {length}")
+    return Frame(frame_type, seq, bytes(data[HEADER_SIZE:]), crc)
+
+
+def build_frame(frame_type, seq, payload, crc=None):
+    """Build a frame, used by the simulator. crc defaults to the payload's CRC32"""
+    if crc is None:
+        crc = zlib.crc32(payload)
+    return HEADER.pack(FRAME_VERSION, frame_type, seq & 0xFFFFFFFF, len(payload), crc) + payload
+
+
+def check_payload(frame):
+    """Return the payload of a frame carrying its own CRC, or raise FrameError if it is wrong"""
+    if zlib.crc32(frame.payload) != frame.crc:
+        raise FrameError(f"Frame {frame.seq} failed its CRC check")
+    return frame.payload
+
+
+def check_control(frame):
+    """Return the text of a control frame, or raise FrameError if its CRC is wrong"""
+    return check_payload(frame).decode("utf-8", errors="replace")
+
+
+class SequenceTracker:
+    """Follows frame sequence numbers and reports gaps"""
+
+    def __init__(self):
+        self.expected = None
+
+    def reset(self):
+        self.expected = None
+
+    def check(self, seq):
+        """Return how many frames were lost before seq (negative if it went backwards)"""
+        gap = 0 if self.expected is None else (seq - self.expected) & 0xFFFFFFFF
+        if gap >= 0x80000000:
+            gap -= 0x100000000
+        self.expected = (seq + 1) & 0xFFFFFFFF
+        return gap
@@ -0,0 +1,112 @@
+"""Frame size and pacing of transfers, adapted to the link
+
+After connecting, the host finds out the ATT MTU of the link, asking for a
+larger one where the BLE backend needs to be asked, and tells the device to
+send frames that fit in one notification: MTU - 3 bytes, at most 512. A
+larger frame would be cut off by the BLE stack.
+
+During transfers LinkTuner adjusts the interval between chunks, and the
+frame size when that is not enough. It backs off whenever a frame is lost
+or corrupted and speeds up again after a run of clean frames, but only
+while frames arrive about as fast as they are sent. When they arrive
+slower, the radio is already the limit, and sending faster would only fill
+the device's transmit buffers until notifications are dropped.
+"""
+
+import collections
+import time
+
+ATT_HEADER_SIZE = 3
+DEFAULT_MTU = 23           # before any MTU exchange
+MAX_FRAME_SIZE = 512       # largest attribute value BLE allows
+MIN_FRAME_SIZE = DEFAULT_MTU - ATT_HEADER_SIZE
+
+# Interval between chunks on the device, in seconds
+START_INTERVAL = 0.02
+MIN_INTERVAL = 0.001
+MAX_INTERVAL = 0.2
+
+CLEAN_FRAMES = 64          # frames in a row without loss before speeding up
+SPEEDUP = 0.75             # interval factor after a clean run
+BACKOFF = 2.0              # interval factor after a loss
+ARRIVAL_SLACK = 1.5        # frames this much slower than sent: the radio is the limit
+
+
+def frame_size_for_mtu(mtu):
+    """Largest frame that fits in one notification at this MTU"""
+    return max(MIN_FRAME_SIZE, min(MAX_FRAME_SIZE, mtu - ATT_HEADER_SIZE))
+
+
+async def negotiate_mtu(client):
+    """Return the ATT MTU of a connected client, asking for a larger one where needed
+
+    bleak exchanges the MTU while connecting, except on BlueZ, where it has
+    to be acquired first.
+    """
+    acquire = getattr(getattr(client, "_backend", None), "_acquire_mtu", None)
+    if acquire is not None:
+        try:
+            await acquire()
+        except Exception:
+            # Keep whatever MTU the link has
+            pass
+    return getattr(client, "mtu_size", None) or DEFAULT_MTU
+
+
+class LinkTuner:
+    """Chooses the frame size and chunk interval for one connection"""
+
+    def __init__(self, mtu, interval=START_INTERVAL):
+        self.mtu = mtu
+        self.max_frame_size = frame_size_for_mtu(mtu)
+        self.frame_size = self.max_frame_size
+        self.interval = interval
+        self.losses = 0
+        self._clean = 0
+        self._last_arrival = None
+        self._gaps = collections.deque(maxlen=CLEAN_FRAMES)
+
+    @property
+    def settings(self):
+        """(frame size in bytes, chunk interval in seconds)"""
+        return self.frame_size, self.interval
+
+    @property
+    def arrival_interval(self):
+        """Median time between data frames over the last clean run, 0 if unknown"""
+        if not self._gaps:
+            return 0.0
+        return sorted(self._gaps)[len(self._gaps) // 2]
+
+    def on_frame(self, now=None):
+        """A data frame arrived intact, return True if the settings changed"""
+        now = time.monotonic() if now is None else now
+        if self._last_arrival is not None:
+            self._gaps.append(now - self._last_arrival)
+        self._last_arrival = now
+        self._clean += 1
+        if self._clean < CLEAN_FRAMES:
+            return False
+        self._clean = 0
+        if self.frame_size < self.max_frame_size:
+            self.frame_size = min(self.max_frame_size, self.frame_size * 2)
+            return True
+        if self.interval <= MIN_INTERVAL or self.arrival_interval > self.interval * ARRIVAL_SLACK:
+            return False
+        self.interval = max(MIN_INTERVAL, self.interval * SPEEDUP)
+        return True
+
+    def on_loss(self):
+        """Frames were lost or corrupted: send slower, or in smaller frames if already slow"""
+        self.losses += 1
+        self.pause()
+        if self.interval < MAX_INTERVAL:
+            self.interval = min(MAX_INTERVAL, self.interval * BACKOFF)
+        else:
+            self.frame_size = max(MIN_FRAME_SIZE, self.frame_size // 2)
+
+    def pause(self):
+        """The data stopped, e.g. between transfers, so the next gap says nothing about the link"""
+        self._clean = 0
+        self._last_arrival = None
+        self._gaps.clear()
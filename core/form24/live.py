@@ -0,0 +1,184 @@
+"""Live stroke rate from streamed IMU samples
+
+LiveProcessor applies the processing of imuProcess.ipynb incrementally:
+AccelZ is smoothed with two Savitzky-Golay passes (windows 75 and 65,
+polynomial order 2) and strokes are the peaks that find_peaks reports with
+the notebook's dynamic thresholds.
+
+Both passes together are one FIR filter, the convolution of their
+coefficients, so each batch of samples is smoothed by convolving it with
+the last len(kernel) - 1 raw samples. This gives exactly the notebook's
+values away from the ends of a recording, but only half a kernel (69
+samples, about 0.85 s) behind the newest sample. The newest half kernel is
+filled in with the values the notebook would give if the recording ended
+now. Those are a linear function of the last kernel of raw samples (see
+analysis/smoothing.py), so they cost one small matrix product per batch. They are
+provisional and settle as more samples arrive. The smoothed curve is
+therefore current up to the newest sample, and only settled peaks are
+counted as strokes. Peaks are searched in a trailing window only, so the
+work per batch does not grow with the session.
+
+The processor subscribes to a TransferEngine and is fed on the BLE loop
+thread. The GUI reads it through snapshot(), which is safe from any thread.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from scipy.signal import find_peaks
+
+from .analysis import (
+    DEFAULT_PARAMS, PEAK_DISTANCE, SMOOTHING_WINDOWS, end_matrices, peak_thresholds, smooth, smoothing_kernel,
+)
+from .transfer import EVENT_SAMPLES, EVENT_LOGGING_STARTED
+
+# Smoothing and peak detection of the notebook, in samples of the stream as
+# they arrive rather than on the uniform timebase of the offline analysis
+STROKE_COLUMN = DEFAULT_PARAMS.column
+
+# Samples kept for peak detection and display, about 15 s
+HISTORY = 1250
+
+# Strokes used for the stroke rate readout
+RATE_STROKES = 6
+
+LiveSnapshot = namedtuple("LiveSnapshot", [
+    "version",          # increases with every batch of samples
+    "times",            # seconds since the first sample, raw samples
+    "values",           # raw STROKE_COLUMN
+    "smoothed_times",
+    "smoothed",
+    "peak_times",
+    "peak_values",
+    "stroke_rate",      # strokes per minute over the last RATE_STROKES strokes, or None
+    "strokes",          # strokes counted since the session started
+    "sample_rate",      # Hz, measured
+    "delay",            # seconds since the newest sample arrived
+])
+
+
+class LiveProcessor:
+    """Incremental smoother and stroke detector for one stream of samples"""
+
+    def __init__(self, column=STROKE_COLUMN, history=HISTORY, peak_distance=PEAK_DISTANCE):
+        self.column = column
+        self.history = history
+        self.peak_distance = peak_distance
+        self.kernel = smoothing_kernel()
+        # Row i gives the smoothed value of the i-th of the newest half kernel
+        # from the newest samples, as if the recording ended there
+        self._end_matrix = end_matrices()[1]
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything, for a new logging session"""
+        with self._lock:
+            self._version = 0
+            self._arrival = 0.0
+            self._restart(None)
+
+    def on_event(self, event, payload):
+        """TransferEngine subscriber"""
+        if event == EVENT_SAMPLES:
+            self.feed(payload["records"])
+        elif event == EVENT_LOGGING_STARTED:
+            self.reset()
+
+    def feed(self, records, arrival=None):
+        """Add a batch of records from a sample frame"""
+        if len(records) == 0:
+            return
+        arrival = time.monotonic() if arrival is None else arrival
+        times = records["Time"].astype(np.float64) / 1000.0
+        values = records[self.column].astype(np.float64)
+
+        with self._lock:
+            if self._start is None or times[0] < self._last_time:
+                # First batch, or the clock went back because the device restarted
+                self._restart(times[0])
+            self._last_time = times[-1]
+            times -= self._start
+            self._arrival = arrival
+            self._version += 1
+
+            self._times = np.concatenate((self._times, times))[-self.history:]
+            self._values = np.concatenate((self._values, values))[-self.history:]
+
+            # Smooth the new samples together with the tail of the previous ones
+            tail_times = np.concatenate((self._tail_times, times))
+            tail = np.concatenate((self._tail, values))
+            size = len(self.kernel)
+            centre = size // 2
+            if len(tail) >= size:
+                smoothed = np.convolve(tail, self.kernel, mode="valid")
+                self._smoothed = np.concatenate((self._smoothed, smoothed))[-self.history:]
+                self._smoothed_times = np.concatenate(
+                    (self._smoothed_times, tail_times[centre:centre + len(smoothed)]))[-self.history:]
+            self._tail_times = tail_times[-(size - 1):]
+            self._tail = tail[-(size - 1):]
+
+            # Provisional values for the newest half kernel. With twice the
+            # kernel of raw samples they equal the notebook's end values
+            if len(self._values) >= 2 * size:
+                recent = self._end_matrix @ self._values[-self._end_matrix.shape[1]:]
+                self._curve = np.concatenate((self._smoothed, recent))[-self.history:]
+                self._curve_times = np.concatenate(
+                    (self._smoothed_times, self._times[-centre:]))[-self.history:]
+                self._provisional = centre
+            elif len(self._values) > max(SMOOTHING_WINDOWS):
+                # Only a few seconds so far, smooth all of it like the notebook
+                self._curve = smooth(self._values)
+                self._curve_times = self._times
+                self._provisional = len(self._curve) - len(self._smoothed)
+            else:
+                return
+            self._detect_peaks()
+
+    def _restart(self, start):
+        empty = np.zeros(0)
+        self._start = start
+        self._last_time = start
+        self._times = self._values = empty
+        self._smoothed_times = self._smoothed = empty
+        self._curve_times = self._curve = empty
+        self._provisional = 0
+        self._tail_times = self._tail = empty
+        self._peak_times = self._peak_values = empty
+        self._last_stroke = -np.inf
+        self._strokes = 0
+
+    def _detect_peaks(self):
+        # The notebook's thresholds, computed over the trailing window
+        curve = self._curve
+        if len(curve) <= self.peak_distance:
+            return
+        height, prominence = peak_thresholds(curve)
+        peaks, _ = find_peaks(curve, height=height, distance=self.peak_distance, prominence=prominence)
+        self._peak_times = self._curve_times[peaks]
+        self._peak_values = curve[peaks]
+
+        # A peak is counted once it is settled and no higher sample can
+        # follow within peak_distance
+        settled = self._peak_times[peaks < len(curve) - max(self._provisional, self.peak_distance)]
+        new = settled[settled > self._last_stroke]
+        if len(new):
+            self._strokes += len(new)
+            self._last_stroke = new[-1]
+
+    def snapshot(self):
+        """Return a LiveSnapshot of the current state"""
+        with self._lock:
+            peak_times = self._peak_times[-RATE_STROKES:]
+            stroke_rate = None
+            if len(peak_times) >= 2 and peak_times[-1] > peak_times[0]:
+                stroke_rate = 60.0 * (len(peak_times) - 1) / (peak_times[-1] - peak_times[0])
+            sample_rate = 0.0
+            if len(self._times) >= 2 and self._times[-1] > self._times[0]:
+                sample_rate = (len(self._times) - 1) / (self._times[-1] - self._times[0])
+            delay = time.monotonic() - self._arrival if self._version else 0.0
+            return LiveSnapshot(self._version, self._times, self._values, self._curve_times,
+                                self._curve, self._peak_times, self._peak_values, stroke_rate,
+                                self._strokes, sample_rate, delay)
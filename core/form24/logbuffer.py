@@ -0,0 +1,88 @@
+"""Bounded message buffers for log panes
+
+A LogBuffer collects messages from any thread and hands them to the display
+in batches: the display drains it once per UI tick and inserts everything
+that arrived since the last tick in one go. The buffer keeps at most
+capacity lines waiting to be displayed, so a long session costs the same
+as a short one. Messages that overflow before they are displayed are
+counted, not kept. The display itself trims its text to its capacity.
+
+The full history can go to a rotating log file (open_log_file), through
+the standard logging module.
+"""
+
+import collections
+import logging
+import logging.handlers
+import threading
+from datetime import datetime
+
+# Lines kept per pane
+LOG_CAPACITY = 2000
+
+# Rotating log file: size of one file and number of old files kept
+LOG_FILE_MAX_BYTES = 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+LOGGER_NAME = "form24"
+
+
+class LogBuffer:
+    """Thread-safe bounded queue of timestamped log lines"""
+
+    def __init__(self, capacity=LOG_CAPACITY, sink=None):
+        self.capacity = capacity
+        self.sink = sink                  # a logging.Logger, or None
+        self.dropped = 0                  # lines that overflowed before they were drained
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+
+    def append(self, message):
+        """Add a message, callable from any thread"""
+        line = f"[{datetime.now().strftime('%H:%M:%S')}] {message}"
+        with self._lock:
+            self._pending.append(line)
+            if len(self._pending) > self.capacity:
+                self._pending.popleft()
+                self.dropped += 1
+        if self.sink is not None:
+            self.sink.info(message)
+
+    def drain(self):
+        """Return the lines added since the last drain as one string, "" if none
+
+        If lines overflowed in between, a note saying how many comes first.
+        """
+        with self._lock:
+            if not self._pending:
+                return ""
+            lines = list(self._pending)
+            self._pending.clear()
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            lines.insert(0, f"... {dropped} earlier messages not shown")
+        return "\n".join(lines) + "\n"
+
+
+def open_log_file(path, max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_FILE_BACKUPS):
+    """Send every message logged under LOGGER_NAME to a rotating file
+
+    Returns the handler, pass it to close_log_file() to stop.
+    """
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                   encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s: %(message)s"))
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return handler
+
+
+def close_log_file(handler):
+    logging.getLogger(LOGGER_NAME).removeHandler(handler)
+    handler.close()
+
+
+def sink(name):
+    """Return the logger a LogBuffer named name writes its history to"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
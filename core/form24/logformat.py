@@ -0,0 +1,221 @@
+"""Binary IMU log format and its NumPy decoder
+
+A binary log is a 32-byte header followed by fixed-width records, all
+little-endian:
+
+    header  offset  size  field
+            0       4     magic, b"F24L"
+            4       2     format version (FORMAT_VERSION)
+            6       2     header size in bytes
+            8       2     record size in bytes
+            10      2     reserved, 0
+            12      4     nominal sample rate in Hz, float32 (0 if unknown)
+            16      4     millis() when logging started
+            20      12    reserved, 0
+
+    record  offset  size  field
+            0       4     Time, millis() of the sample, uint32
+            4       12    AccelX, AccelY, AccelZ, GyroX, GyroY, GyroZ, int16
+
+A record holds exactly the columns of the CSV logs, in 16 bytes instead of
+about 40, so CSV logs convert to binary and back without any change. The
+decoder maps records straight onto a structured dtype with np.frombuffer,
+without a Python loop or a copy.
+"""
+
+import os
+import re
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+MAGIC = b"F24L"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHHHfI12x")
+HEADER_SIZE = HEADER.size
+
+COLUMNS = ("Time", "AccelX", "AccelY", "AccelZ", "GyroX", "GyroY", "GyroZ")
+SENSOR_COLUMNS = COLUMNS[1:]
+CSV_HEADER = ",".join(COLUMNS)
+
+RECORD_DTYPE = np.dtype([("Time", "<u4")] + [(name, "<i2") for name in SENSOR_COLUMNS])
+RECORD = struct.Struct("<I6h")
+RECORD_SIZE = RECORD.size
+
+LOG_SUFFIX = ".bin"
+CSV_SUFFIX = ".csv"
+
+LogHeader = namedtuple("LogHeader", "version sample_rate start_time")
+
+# Carriage returns at the end of a line
+_CR = re.compile(rb"\r+(?=\n|$)")
+
+_NEWLINE, _COMMA, _MINUS, _ZERO = b"\n,-0"
+
+
+class LogFormatError(ValueError):
+    """Raised for data that is not a binary log"""
+
+
+def is_binary_log(data):
+    """Return True if data (or its first bytes) is a binary log"""
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def encode_header(header):
+    return HEADER.pack(MAGIC, header.version, HEADER_SIZE, RECORD_SIZE, 0,
+                       header.sample_rate, header.start_time)
+
+
+def decode_header(data):
+    """Return the LogHeader at the start of data"""
+    if len(data) < HEADER_SIZE or not is_binary_log(data):
+        raise LogFormatError("Not a binary IMU log")
+    magic, version, header_size, record_size, _, sample_rate, start_time = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION or header_size != HEADER_SIZE or record_size != RECORD_SIZE:
+        raise LogFormatError(f"Unsupported log format version {version}")
+    return LogHeader(version, sample_rate, start_time)
+
+
+def decode(data):
+    """Return (LogHeader, records) for a binary log held in memory
+
+    records is a read-only structured array viewing data, with one field
+    per CSV column. A record cut short at the end, as left by a logger
+    that lost power, is ignored.
+    """
+    header = decode_header(data)
+    count = (len(data) - HEADER_SIZE) // RECORD_SIZE
+    records = np.frombuffer(data, dtype=RECORD_DTYPE, count=count, offset=HEADER_SIZE)
+    return header, records
+
+
+def decode_records(data):
+    """Return the records in data, which holds records only, as in a stream frame"""
+    return np.frombuffer(data, dtype=RECORD_DTYPE, count=len(data) // RECORD_SIZE)
+
+
+def encode(header, records):
+    """Return the bytes of a binary log"""
+    return encode_header(header) + np.asarray(records, dtype=RECORD_DTYPE).tobytes()
+
+
+def read_log(path):
+    """Return (LogHeader, records) for a binary log file"""
+    with open(path, "rb") as f:
+        header = decode_header(f.read(HEADER_SIZE))
+        count = (os.fstat(f.fileno()).st_size - HEADER_SIZE) // RECORD_SIZE
+        records = np.fromfile(f, dtype=RECORD_DTYPE, count=count)
+    return header, records
+
+
+def write_log(path, header, records):
+    with open(path, "wb") as f:
+        f.write(encode_header(header))
+        np.asarray(records, dtype=RECORD_DTYPE).tofile(f)
+
+
+def sensor_matrix(records):
+    """Return the six sensor columns as an (N, 6) int16 view of records"""
+    records = np.ascontiguousarray(records, dtype=RECORD_DTYPE)
+    return np.ndarray((len(records), len(SENSOR_COLUMNS)), dtype="<i2", buffer=records,
+                      offset=RECORD_DTYPE.fields["AccelX"][1],
+                      strides=(RECORD_SIZE, RECORD_DTYPE["AccelX"].itemsize))
+
+
+def estimate_sample_rate(times):
+    """Sample rate in Hz from the median interval of millisecond timestamps"""
+    if len(times) < 2:
+        return 0.0
+    interval = np.median(np.diff(np.asarray(times, dtype=np.int64)))
+    return 1000.0 / interval if interval > 0 else 0.0
+
+
+def parse_csv(data):
+    """Parse a CSV log and return (records, bad_lines)
+
+    bad_lines lists (line number, text) for every row that is not seven
+    integers in range, which the firmware leaves behind when a write to
+    the SD card is cut short.
+
+    The rows are checked and converted with array operations over the
+    whole text, so only the bad lines are looked at one by one.
+    """
+    data = bytes(data)
+    if b"\r" in data:
+        data = _CR.sub(b"", data)
+    text = np.frombuffer(data, dtype=np.uint8)
+    newline = text == _NEWLINE
+    ends = np.append(np.flatnonzero(newline), len(text))
+    starts = np.insert(ends[:-1] + 1, 0, 0)
+    if starts[-1] == len(text):
+        # The text ends with a newline
+        starts, ends = starts[:-1], ends[:-1]
+
+    # Characters that cannot be part of an intact row. The firmware writes
+    # seven integers without leading zeros, the first one unsigned,
+    #     (0|[1-9][0-9]*)(,(0|-?[1-9][0-9]*)){6}
+    # so that writing the decoded values back gives the same text
+    before = np.insert(text[:-1], 0, _NEWLINE)
+    after = np.append(text[1:], _NEWLINE)
+    digit = (text >= _ZERO) & (text <= _ZERO + 9)
+    comma = text == _COMMA
+    minus = text == _MINUS
+    digit_after = np.append(digit[1:], False)
+    wrong = ~(digit | comma | minus | newline)
+    wrong |= comma & ~(np.insert(digit[:-1], 0, False) & (digit_after | (after == _MINUS)))
+    wrong |= minus & ~((before == _COMMA) & digit_after & (after != _ZERO))
+    wrong |= (text == _ZERO) & ((before == _COMMA) | (before == _NEWLINE)) & digit_after
+
+    commas = np.flatnonzero(comma)
+    good = np.searchsorted(commas, ends) - np.searchsorted(commas, starts) == len(COLUMNS) - 1
+    good[np.searchsorted(ends, np.flatnonzero(wrong))] = False
+    good[:1] = False
+
+    # The good rows joined by commas, converted in one pass. Values in
+    # float64 are exact within range, and too large ones stay too large
+    keep = np.repeat(good, ends - starts + 1)[:len(text)]
+    joined = np.where(newline, _COMMA, text)[keep].tobytes().rstrip(b",")
+    values = np.fromstring(joined, dtype=np.float64, sep=",").reshape(-1, len(COLUMNS))
+    in_range = ((values[:, 0] <= 0xFFFFFFFF)
+                & np.all((values[:, 1:] >= -0x8000) & (values[:, 1:] < 0x8000), axis=1))
+    good[np.flatnonzero(good)[~in_range]] = False
+
+    records = np.empty(int(in_range.sum()), dtype=RECORD_DTYPE)
+    for index, name in enumerate(COLUMNS):
+        records[name] = values[in_range, index]
+    bad_lines = [(int(number) + 1, data[starts[number]:ends[number]].decode("utf-8", errors="replace"))
+                 for number in np.flatnonzero(~good[1:]) + 1]
+    return records, bad_lines
+
+
+def format_csv(records):
+    """Return the CSV text the firmware would have written for records"""
+    lines = [CSV_HEADER]
+    for row in np.asarray(records, dtype=RECORD_DTYPE).tolist():
+        lines.append(",".join(map(str, row)))
+    return "\n".join(lines) + "\n"
+
+
+def csv_to_log(csv_path, log_path=None):
+    """Convert a CSV log to a binary log and return (log_path, records, bad_lines)"""
+    if log_path is None:
+        log_path = os.path.splitext(csv_path)[0] + LOG_SUFFIX
+    with open(csv_path, "rb") as f:
+        records, bad_lines = parse_csv(f.read())
+    start_time = int(records["Time"][0]) if len(records) else 0
+    header = LogHeader(FORMAT_VERSION, estimate_sample_rate(records["Time"]), start_time)
+    write_log(log_path, header, records)
+    return log_path, records, bad_lines
+
+
+def log_to_csv(log_path, csv_path=None):
+    """Convert a binary log to a CSV log and return (csv_path, records)"""
+    if csv_path is None:
+        csv_path = os.path.splitext(log_path)[0] + CSV_SUFFIX
+    _, records = read_log(log_path)
+    with open(csv_path, "w", newline="\n") as f:
+        f.write(format_csv(records))
+    return csv_path, records
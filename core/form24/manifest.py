@@ -0,0 +1,246 @@
+"""Index of downloaded files
+
+The manifest is a small SQLite database at the top of the download
+directory with one row per downloaded file: its path relative to the
+download directory, the name it has on the SD card, the address of the
+device it came from, size, modification time, SHA-256 of its content,
+when it was downloaded, how far it has been processed (STATUS_*), and the
+time the device last wrote the file if its listing said.
+
+The transfer engine adds a row whenever it saves a file, so the GUI, the
+sync logic and the analysis read the manifest instead of listing and
+stat'ing the download directory. Finding a file by device and name is an
+index lookup, however many sessions have been downloaded.
+
+When the manifest is opened it is reconciled with the directory once:
+files saved before the manifest existed, or copied in by hand, are
+added, and rows of files that have been deleted are dropped.
+
+A Manifest can be shared between threads, every call takes its lock.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from .protocol import clean_filename
+from .storage import PART_SUFFIX
+
+MANIFEST_NAME = "manifest.sqlite3"
+
+# Processing status of a file, in order
+STATUS_DOWNLOADED = "downloaded"
+STATUS_DECODED = "decoded"
+STATUS_ANALYZED = "analyzed"
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+ManifestEntry = namedtuple("ManifestEntry", [
+    "path",             # relative to the download directory, with "/" separators
+    "filename",         # name on the SD card
+    "device",           # address of the device, "" if unknown
+    "size",
+    "mtime",
+    "sha256",
+    "downloaded_at",    # seconds since the epoch
+    "status",
+    "card_mtime",       # last write on the device, from its listing, or None
+])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    device TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    downloaded_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    card_mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_by_device ON files (device, filename);
+"""
+
+# Columns added since the first version of the table
+_ADDED_COLUMNS = {"card_mtime": "INTEGER"}
+
+# Addresses of devices on macOS, where bleak gives CoreBluetooth UUIDs
+# instead of MAC addresses
+_UUID = re.compile(r"^[0-9A-Fa-f]{8}(-[0-9A-Fa-f]{4}){3}-[0-9A-Fa-f]{12}$")
+
+_COLUMNS = ", ".join(ManifestEntry._fields)
+_PLACEHOLDERS = ", ".join("?" * len(ManifestEntry._fields))
+
+
+def file_hash(path):
+    """Return the SHA-256 of a file as a hex string"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def device_from_dir(name):
+    """Return the device address of a per-device directory name (see fleet.device_dir)
+
+    Only used for directories that have no files in the manifest yet; the
+    address of a saved file is the one the transfer engine recorded.
+    """
+    # A UUID keeps its dashes, the colons of a MAC address became dashes
+    return name if _UUID.match(name) else name.replace("-", ":")
+
+
+def is_download(name):
+    """Whether a file in a download directory is a download, not the manifest or a part file"""
+    return not (name.startswith(MANIFEST_NAME) or name.endswith(PART_SUFFIX) or name.startswith("."))
+
+
+class Manifest:
+    """SQLite index of the files in a download directory"""
+
+    def __init__(self, download_dir, reconcile=True):
+        self.download_dir = download_dir
+        os.makedirs(download_dir, exist_ok=True)
+        self.path = os.path.join(download_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(files)")}
+            for name, kind in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    self._db.execute(f"ALTER TABLE files ADD COLUMN {name} {kind}")
+        if reconcile:
+            self.reconcile()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def relative(self, path):
+        """Return the key of a file in the download directory"""
+        return os.path.relpath(path, self.download_dir).replace(os.sep, "/")
+
+    def absolute(self, entry):
+        """Return the local path of an entry"""
+        return os.path.join(self.download_dir, *entry.path.split("/"))
+
+    def record(self, path, device="", filename=None, status=STATUS_DOWNLOADED, card_mtime=None):
+        """Add or replace the row of a saved file and return its ManifestEntry"""
+        stat = os.stat(path)
+        entry = ManifestEntry(self.relative(path), clean_filename(filename or os.path.basename(path)),
+                              device, stat.st_size, stat.st_mtime, file_hash(path), time.time(),
+                              status, card_mtime)
+        with self._lock, self._db:
+            self._db.execute(f"INSERT OR REPLACE INTO files ({_COLUMNS}) VALUES ({_PLACEHOLDERS})",
+                             entry)
+        return entry
+
+    def get(self, path):
+        """Return the ManifestEntry of a local path, or None"""
+        return self._one(f"SELECT {_COLUMNS} FROM files WHERE path = ?", (self.relative(path),))
+
+    def lookup(self, device, filename):
+        """Return the ManifestEntry of a file downloaded from device, or None"""
+        return self._one(f"SELECT {_COLUMNS} FROM files WHERE device = ? AND filename = ?",
+                         (device, clean_filename(filename)))
+
+    def have(self, device, filename, size, card_mtime=None):
+        """Return True if this version of a file from device is already downloaded
+
+        The size must match, and the time the device last wrote the file
+        too when both the listing and the manifest know it.
+        """
+        entry = self.lookup(device, filename)
+        if entry is None or entry.size != size:
+            return False
+        return card_mtime is None or entry.card_mtime is None or entry.card_mtime == card_mtime
+
+    def files(self, device=None, status=None):
+        """Return the ManifestEntries, ordered by path, optionally only for one device or status"""
+        query = f"SELECT {_COLUMNS} FROM files"
+        conditions = []
+        params = []
+        if device is not None:
+            conditions.append("device = ?")
+            params.append(device)
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY path", params).fetchall()
+        return [ManifestEntry(*row) for row in rows]
+
+    def set_status(self, path, status):
+        with self._lock, self._db:
+            self._db.execute("UPDATE files SET status = ? WHERE path = ?", (status, self.relative(path)))
+
+    def remove(self, path):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM files WHERE path = ?", (self.relative(path),))
+
+    def reconcile(self):
+        """Bring the manifest in line with the download directory, return (added, removed)
+
+        Files without a row, or whose size or modification time changed,
+        are (re)hashed and recorded. Files in a per-device directory are
+        attributed to the device recorded for the other files there, or
+        else to the address in its name. Hidden directories, such as the
+        analysis cache, are not scanned.
+        """
+        known = {entry.path: entry for entry in self.files()}
+        devices = {entry.path.split("/")[0]: entry.device for entry in known.values()
+                   if "/" in entry.path and entry.device}
+        found = set()
+        added = 0
+        for path, device in self._scan(devices):
+            key = self.relative(path)
+            found.add(key)
+            entry = known.get(key)
+            try:
+                stat = os.stat(path)
+                if entry is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+                    continue
+                self.record(path, device=entry.device if entry else device,
+                            filename=entry.filename if entry else None,
+                            status=STATUS_DOWNLOADED,
+                            card_mtime=entry.card_mtime if entry else None)
+            except OSError:
+                continue
+            added += 1
+        removed = [key for key in known if key not in found]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM files WHERE path = ?", [(key,) for key in removed])
+        return added, len(removed)
+
+    def _scan(self, devices):
+        # Files of the download directory and of its per-device directories,
+        # devices holds the recorded address of each directory
+        for entry in os.scandir(self.download_dir):
+            if entry.is_file():
+                if is_download(entry.name):
+                    yield entry.path, ""
+            elif entry.is_dir() and not entry.name.startswith("."):
+                device = devices.get(entry.name) or device_from_dir(entry.name)
+                for child in os.scandir(entry.path):
+                    if child.is_file() and is_download(child.name):
+                        yield child.path, device
+
+    def _one(self, query, params):
+        with self._lock:
+            row = self._db.execute(query, params).fetchone()
+        return ManifestEntry(*row) if row else None
@@ -0,0 +1,209 @@
+"""Per-transfer metrics
+
+The transfer engine keeps a TransferMetrics for every download() call,
+across all of its resumed attempts, and publishes it as a plain dict with
+EVENT_METRICS: at the progress rate while data arrives and once more, with
+final=True, when the download succeeds or fails. MetricsLog appends the
+final ones to a JSON-lines file.
+
+What the numbers say about a slow download:
+
+  * Slow SD reads on the device: long gaps between notifications, but no
+    lost frames, and the link keeps its pacing.
+  * BLE congestion: lost or corrupted frames, retries and stalls, and the
+    link tuner backing off to a longer chunk interval.
+  * Host-side backlog: notifications arrive at the pace the device sends
+    them, but events wait long in the GUI's Tk queue (gui_queue, added by
+    the GUI, which measures it).
+"""
+
+import json
+import threading
+import time
+
+# Published by the TransferEngine with {"metrics": dict, "final"}
+EVENT_METRICS = "metrics"
+
+# Upper edges of the histogram bins, in ms. The last bin is open
+HISTOGRAM_EDGES_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# A pause between notifications of a transfer this long counts as a gap
+GAP_SECONDS = 0.5
+
+
+class Histogram:
+    """Counts of durations in logarithmic bins, with exact count, total and maximum"""
+
+    def __init__(self, edges_ms=HISTOGRAM_EDGES_MS):
+        self.edges_ms = edges_ms
+        self.counts = [0] * (len(edges_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        index = 0
+        while index < len(self.edges_ms) and ms > self.edges_ms[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Upper edge of the bin holding the given fraction of the values, in ms, at most the maximum"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                break
+        if index < len(self.edges_ms):
+            return min(float(self.edges_ms[index]), self.max * 1000)
+        return self.max * 1000
+
+    def as_dict(self):
+        bins = {f"<={edge}ms": count for edge, count in zip(self.edges_ms, self.counts)}
+        bins[f">{self.edges_ms[-1]}ms"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean_ms": self.total * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max * 1000,
+            "bins": bins,
+        }
+
+
+class TransferMetrics:
+    """Measurements of one download, updated by the engine on the BLE loop thread"""
+
+    def __init__(self, filename, device=""):
+        self.filename = filename
+        self.device = device
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None
+        self.first_response = None  # seconds from the first request to "Transfer starting"
+        self.size = 0
+        self.offset = 0
+        self.encoding = None
+        self.file_bytes = 0         # file data written, over all attempts
+        self.wire_bytes = 0         # notification bytes during transfers, headers included
+        self.notifications = 0
+        self.inter_arrival = Histogram()
+        self.gaps = 0               # pauses of GAP_SECONDS or more
+        self.longest_gap = 0.0
+        self.lost_frames = 0
+        self.corrupt_frames = 0
+        self.stalls = 0             # attempts given up because nothing arrived
+        self.retries = 0
+        self.link_settings = None   # (frame size, chunk interval) confirmed by the device
+        self._last_arrival = None
+
+    def on_start(self, size, offset, encoding, now=None):
+        """An attempt started sending data"""
+        now = time.monotonic() if now is None else now
+        if self.first_response is None:
+            self.first_response = now - self.started
+            self.offset = offset
+        self.size = size
+        self.encoding = encoding
+        # The pause before a resumed attempt is not a gap between notifications
+        self._last_arrival = None
+
+    def on_notification(self, size, now):
+        """A notification of a transfer arrived"""
+        self.notifications += 1
+        self.wire_bytes += size
+        if self._last_arrival is not None:
+            interval = now - self._last_arrival
+            self.inter_arrival.add(interval)
+            if interval >= GAP_SECONDS:
+                self.gaps += 1
+                self.longest_gap = max(self.longest_gap, interval)
+        self._last_arrival = now
+
+    def finish(self, error=None, link_settings=None):
+        self.finished = time.monotonic()
+        self.error = error
+        self.link_settings = link_settings
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def as_dict(self):
+        elapsed = self.elapsed
+        frame_size, interval = self.link_settings or (None, None)
+        return {
+            "filename": self.filename,
+            "device": self.device,
+            "started_at": self.started_at,
+            "outcome": "in progress" if self.finished is None else ("failed" if self.error else "complete"),
+            "error": self.error,
+            "elapsed_s": elapsed,
+            "first_response_s": self.first_response,
+            "size": self.size,
+            "offset": self.offset,
+            "encoding": self.encoding,
+            "file_bytes": self.file_bytes,
+            "wire_bytes": self.wire_bytes,
+            "bytes_per_s": self.file_bytes / elapsed if elapsed > 0 else 0.0,
+            "notifications": self.notifications,
+            "inter_arrival": self.inter_arrival.as_dict(),
+            "gaps": self.gaps,
+            "longest_gap_s": self.longest_gap,
+            "lost_frames": self.lost_frames,
+            "corrupt_frames": self.corrupt_frames,
+            "stalls": self.stalls,
+            "retries": self.retries,
+            "frame_size": frame_size,
+            "chunk_interval_ms": interval * 1000 if interval is not None else None,
+        }
+
+
+def format_metrics(record):
+    """One-line summary of a metrics dict"""
+    arrival = record["inter_arrival"]
+    line = (f"{record['filename']}: {record['bytes_per_s'] / 1024:.1f} KB/s, "
+            f"{record['notifications']} notifications, "
+            f"every {arrival['p50_ms']:.0f} ms (p95 {arrival['p95_ms']:.0f}, max {arrival['max_ms']:.0f}), "
+            f"{record['gaps']} gaps, {record['lost_frames']} lost, {record['corrupt_frames']} corrupt, "
+            f"{record['stalls']} stalls, {record['retries']} retries")
+    queue = record.get("gui_queue")
+    if queue:
+        line += f", GUI queue {queue['mean_ms']:.1f} ms mean, {queue['max_ms']:.0f} ms max"
+    return line
+
+
+class MetricsLog:
+    """Appends metrics dicts to a JSON-lines file, one line per download
+
+    on_event() can be subscribed to a TransferEngine directly. write() may
+    be called from any thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def on_event(self, event, payload):
+        if event == EVENT_METRICS and payload["final"]:
+            self.write(payload["metrics"])
+
+
+def read_metrics(path):
+    """Return the metrics dicts of a JSON-lines file"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
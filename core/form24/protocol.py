@@ -0,0 +1,144 @@
+"""BLE protocol constants shared with imuLoggerAndTransfer.ino"""
+
+from collections import namedtuple
+
+# BLE UUIDs - Match these with your Arduino code
+SERVICE_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
+COMMAND_CHAR_UUID = "6E400002-B5A3-F393-E0A9-E50E24DCCA9E"  # For sending commands
+DATA_CHAR_UUID = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"  # For receiving data
+
+# Name the firmware advertises with
+DEVICE_NAME = "ESP32_IMU_Logger"
+
+# Commands - Match these with your Arduino code
+CMD_START_LOGGING = 'S'
+CMD_STOP_LOGGING = 'E'
+CMD_LIST_FILES = 'L'
+CMD_GET_FILE = 'G'
+CMD_DELETE_FILE = 'D'
+CMD_GET_FILE_RANGE = 'R'  # R<offset>:<filename>
+CMD_GET_FILE_COMPRESSED = 'Z'  # Z<offset>:<filename>, sent as raw deflate if the device can
+CMD_STREAM = 'W'  # W1 streams samples while logging, W0 stops
+CMD_LIST_PAGED = 'F'  # F<tag>[:<first entry>], listing in "File list:" pages ended by "File list end:"
+CMD_LINK = 'C'  # C<frame size>:<interval ms>, size of the frames the device sends and pacing of chunks
+
+# Encoding named at the end of "Transfer starting:" for a compressed transfer
+ENCODING_DEFLATE = "deflate"
+
+# Prefixes of the text messages sent by the firmware
+MSG_LOGGING_STARTED = "Logging started:"
+MSG_LOGGING_STOPPED = "Logging stopped:"
+MSG_FILE_LIST = "Files on SD card:"
+MSG_TRANSFER_STARTING = "Transfer starting:"
+MSG_TRANSFER_COMPLETE = "Transfer complete"
+MSG_FILE_DELETED = "File deleted:"
+MSG_ERROR = "Error:"
+MSG_STREAMING_STARTED = "Streaming started"
+MSG_STREAMING_STOPPED = "Streaming stopped"
+MSG_FILE_PAGE = "File list:"
+MSG_FILE_LIST_END = "File list end:"
+MSG_LINK_SETTINGS = "Link settings:"
+
+# Every message the firmware sends outside of file data starts with one of these
+CONTROL_PREFIXES = (
+    MSG_LOGGING_STARTED,
+    MSG_LOGGING_STOPPED,
+    MSG_FILE_LIST,
+    MSG_TRANSFER_STARTING,
+    MSG_TRANSFER_COMPLETE,
+    MSG_FILE_DELETED,
+    MSG_ERROR,
+    MSG_STREAMING_STARTED,
+    MSG_STREAMING_STOPPED,
+    MSG_FILE_PAGE,
+    MSG_FILE_LIST_END,
+    MSG_LINK_SETTINGS,
+)
+
+# One file on the SD card. mtime is the time the device last wrote it, in
+# seconds of its clock, or None if the listing did not say
+FileEntry = namedtuple("FileEntry", "name size mtime")
+
+
+def parse_transfer_start(message):
+    """Return (filename, size, offset, encoding) from a "Transfer starting:" message"""
+    # Format: "Transfer starting: /IMU_0_00-00-23.csv (12345 bytes)"
+    # A resumed transfer adds " from <offset>", a compressed one " deflate".
+    # size and offset always count uncompressed bytes
+    head, _, tail = message.partition(" (")
+    filename = head.split(":", 1)[1].strip()
+    words = tail.split(" ")
+    try:
+        size = int(words[0])
+    except ValueError:
+        size = 0
+    offset = 0
+    if "from" in words:
+        try:
+            offset = int(words[words.index("from") + 1])
+        except (ValueError, IndexError):
+            offset = 0
+    encoding = ENCODING_DEFLATE if ENCODING_DEFLATE in words else None
+    return filename, size, offset, encoding
+
+
+def range_command(filename, offset, compressed=False):
+    """Build the command that downloads filename starting at offset"""
+    if compressed:
+        return f"{CMD_GET_FILE_COMPRESSED}{offset}:{clean_filename(filename)}"
+    if offset > 0:
+        return f"{CMD_GET_FILE_RANGE}{offset}:{clean_filename(filename)}"
+    return f"{CMD_GET_FILE}{clean_filename(filename)}"
+
+
+def link_command(frame_size, interval):
+    """Build the command that sets the frame size in bytes and the chunk interval in seconds"""
+    return f"{CMD_LINK}{frame_size}:{round(interval * 1000)}"
+
+
+def parse_link_settings(message):
+    """Return (frame size, interval in seconds) from a "Link settings:" message"""
+    # Format: "Link settings: 244 15", the interval in milliseconds
+    frame_size, interval = message.split(":", 1)[1].split()
+    return int(frame_size), int(interval) / 1000.0
+
+
+def parse_file_list(message):
+    """Return a list of FileEntry from a "Files on SD card:" message"""
+    files = []
+    for line in message.split("\n")[1:]:  # Skip the header
+        line = line.strip()
+        if not line:
+            continue
+        name, _, tail = line.partition(" (")
+        try:
+            size = int(tail.split(" ")[0])
+        except ValueError:
+            size = 0
+        files.append(FileEntry(name, size, None))
+    return files
+
+
+def parse_file_page(message):
+    """Return (tag, index of the first entry, [FileEntry, ...]) from a "File list:" page"""
+    # Format: "File list: <tag> 32" then one "name<TAB>size<TAB>mtime" line per file
+    lines = message.split("\n")
+    tag, index = lines[0].split(":", 1)[1].split()
+    files = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, size, mtime = line.rsplit("\t", 2)
+        files.append(FileEntry(name, int(size), int(mtime)))
+    return tag, int(index), files
+
+
+def parse_file_list_end(message):
+    """Return (tag, number of files) from a "File list end:" message"""
+    tag, count = message.split(":", 1)[1].split()
+    return tag, int(count)
+
+
+def clean_filename(filename):
+    """Strip the leading slash the SD card library puts on file names"""
+    return filename.lstrip('/')
@@ -0,0 +1,528 @@
+"""Pure-Python stand-in for the imuLoggerAndTransfer.ino peripheral
+
+SimulatedLogger reproduces the firmware's command handling
+(S/E/L/F/G/R/Z/W/C/D), its framed notifications (see framing.py), its text
+messages and its chunked file transfer. With framed=False it behaves like
+older firmware that sent bare text and data. SimulatedClient exposes the
+part of the BleakClient interface the host code uses, and delivers the
+logger's notifications over a simulated link with configurable latency,
+jitter, MTU and packet loss. The link can also model the radio's airtime:
+each notification occupies it for a fixed time plus a time per byte, and
+notifications wait in the device's transmit buffers until it is free. When
+those buffers are full, further notifications are dropped, as on the
+ESP32. Together they let the transfer code be tested and benchmarked
+without an ESP32 or a radio.
+"""
+
+import asyncio
+import collections
+import math
+import os
+import random
+import time
+import zlib
+
+from .protocol import (
+    COMMAND_CHAR_UUID, DATA_CHAR_UUID, DEVICE_NAME,
+    CMD_START_LOGGING, CMD_STOP_LOGGING, CMD_LIST_FILES, CMD_LIST_PAGED, CMD_GET_FILE,
+    CMD_DELETE_FILE, CMD_GET_FILE_RANGE, CMD_GET_FILE_COMPRESSED, CMD_STREAM, CMD_LINK,
+    ENCODING_DEFLATE,
+)
+from .framing import (
+    FRAME_CONTROL, FRAME_CONTROL_PART, FRAME_DATA, FRAME_SAMPLES, HEADER_SIZE, build_frame,
+)
+from .logformat import (
+    CSV_HEADER, CSV_SUFFIX, FORMAT_VERSION, LOG_SUFFIX, RECORD, LogHeader, encode_header,
+)
+from .manifest import is_download
+
+# Firmware timing: continueFileTransfer() sends one chunk every 60 ms until
+# the client sends link settings. CHUNK_SIZE is the size of one
+# notification, frame header included, until then too
+CHUNK_SIZE = 512
+CHUNK_INTERVAL = 0.06
+TRANSFER_START_DELAY = 0.5
+
+# The firmware compresses with the ROM's tdefl using greedy parsing, which
+# compresses about as well as zlib's fastest level
+DEFLATE_LEVEL = 1
+
+# Frame sizes and chunk intervals (ms) the firmware accepts in a link
+# settings command
+MIN_FRAME_SIZE = 20
+MAX_FRAME_SIZE = 512
+MIN_CHUNK_INTERVAL_MS = 1
+MAX_CHUNK_INTERVAL_MS = 1000
+
+# With link settings, chunks are paced by a timer checked once per loop()
+# pass, which takes about a millisecond while a transfer runs
+LOOP_PASS = 0.001
+
+# continueFileList() sends one page per loop() pass, which ends with delay(10)
+LIST_PAGE_INTERVAL = 0.01
+
+# Rate at which a logging session appends samples (about 80 Hz on the device)
+SAMPLE_INTERVAL = 0.012
+
+# Samples per sample frame while streaming (STREAM_BATCH in the firmware)
+STREAM_BATCH = 4
+
+
+class LinkConditions:
+    """Properties of the simulated radio link"""
+
+    def __init__(self, latency=0.0, jitter=0.0, mtu=517, loss=0.0, seed=None,
+                 packet_time=0.0, byte_time=0.0, tx_buffers=None):
+        self.latency = latency   # seconds added to every notification
+        self.jitter = jitter     # up to this many extra seconds, uniformly random
+        self.mtu = mtu           # ATT MTU, notifications carry at most mtu - 3 bytes
+        self.loss = loss         # probability that a notification is dropped
+        self.random = random.Random(seed)
+        self.packet_time = packet_time   # airtime of one notification, seconds
+        self.byte_time = byte_time       # airtime of one byte, seconds
+        self.tx_buffers = tx_buffers     # notifications the device can queue, None for no limit
+
+    @property
+    def radio(self):
+        """True if the airtime of notifications is modelled"""
+        return bool(self.packet_time or self.byte_time)
+
+    @property
+    def max_payload(self):
+        return self.mtu - 3
+
+
+class SimulatedLogger:
+    """The firmware state machine, driven by commands from a SimulatedClient"""
+
+    def __init__(self, files=None, name=DEVICE_NAME, address="SIM:00:00:00:00:01",
+                 chunk_size=CHUNK_SIZE, chunk_interval=CHUNK_INTERVAL,
+                 start_delay=TRANSFER_START_DELAY, sd_card=True, framed=True, compression=True,
+                 binary_logs=True, mtimes=None, page_interval=LIST_PAGE_INTERVAL):
+        self.name = name
+        self.address = address
+        self.files = dict(files or {})   # SD card contents, name -> bytes
+        now = int(time.time())
+        self.mtimes = {name: now for name in self.files}   # name -> last write, seconds
+        self.mtimes.update(mtimes or {})
+        self.page_interval = page_interval
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+        self._default_link = (chunk_size, chunk_interval)
+        self.start_delay = start_delay
+        self.sd_card = sd_card
+        self.framed = framed
+        self.compression = compression   # False: like a device that cannot allocate the compressor
+        self.binary_logs = binary_logs   # False: log CSV text like older firmware
+        self.sequence = 0
+
+        self.started = time.monotonic()
+        self.is_logging = False
+        self.streaming = False
+        self.current_file = ""
+        self._notify = None
+        self._transfer_task = None
+        self._logging_task = None
+        self._list_task = None
+
+    @classmethod
+    def from_directory(cls, directory, **kwargs):
+        """Create a logger whose SD card holds the files of a local directory
+
+        The directory can be a download directory, its manifest and part
+        files are not put on the card.
+        """
+        files = {}
+        mtimes = {}
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and is_download(name):
+                with open(path, "rb") as f:
+                    files[name] = f.read()
+                mtimes[name] = int(os.path.getmtime(path))
+        return cls(files, mtimes=mtimes, **kwargs)
+
+    # ------------------------------------------------------------------
+    # Connection, called by SimulatedClient
+
+    def connect(self, notify):
+        self._notify = notify
+        self.sequence = 0
+        self.chunk_size, self.chunk_interval = self._default_link
+
+    def disconnect(self):
+        # Same as ServerCallbacks::onDisconnect
+        if self.is_logging:
+            self.stop_logging()
+        self._cancel_transfer()
+        self._cancel_listing()
+        self.streaming = False
+        self._notify = None
+
+    def send(self, data):
+        """pDataCharacteristic->setValue() followed by notify()"""
+        if self._notify is not None:
+            self._notify(data)
+        self.sequence += 1
+
+    def send_message(self, message):
+        """sendMessage(): a text message in a control frame"""
+        payload = message.encode()
+        if not self.framed:
+            self.send(payload)
+            return
+        # A message longer than one frame is sent in parts
+        size = self.chunk_size - HEADER_SIZE
+        while len(payload) > size:
+            self.send(build_frame(FRAME_CONTROL_PART, self.sequence, payload[:size]))
+            payload = payload[size:]
+        self.send(build_frame(FRAME_CONTROL, self.sequence, payload))
+
+    def send_data(self, chunk, crc):
+        """A chunk of file data, crc is the running CRC32 of the transfer"""
+        self.send(build_frame(FRAME_DATA, self.sequence, chunk, crc) if self.framed else chunk)
+
+    def send_error(self, message):
+        self.send_message(f"Error: {message}")
+
+    # ------------------------------------------------------------------
+    # Commands
+
+    def handle_command(self, data):
+        """CommandCallbacks::onWrite"""
+        command = data.decode("utf-8", errors="replace")
+        if not command:
+            return
+        code, argument = command[0], command[1:]
+
+        needs_sd_card = (CMD_START_LOGGING, CMD_LIST_FILES, CMD_LIST_PAGED, CMD_GET_FILE,
+                         CMD_GET_FILE_RANGE, CMD_GET_FILE_COMPRESSED, CMD_DELETE_FILE)
+        if code in needs_sd_card and not self.sd_card:
+            self.send_error("SD card not available")
+            return
+
+        if code == CMD_START_LOGGING:
+            if not self.is_logging:
+                self.start_logging()
+        elif code == CMD_STOP_LOGGING:
+            if self.is_logging:
+                self.stop_logging()
+        elif code == CMD_LIST_FILES:
+            self.list_files()
+        elif code == CMD_LIST_PAGED and self.framed:
+            # Older firmware has no paged listing and ignores the command
+            tag, _, start = argument.partition(":")
+            self.start_listing(tag, int(start) if start.isdigit() else 0)
+        elif code == CMD_GET_FILE and argument:
+            self.start_transfer("/" + argument)
+        elif code in (CMD_GET_FILE_RANGE, CMD_GET_FILE_COMPRESSED):
+            offset, separator, name = argument.partition(":")
+            if separator and offset.isdigit() and name:
+                self.start_transfer("/" + name, int(offset),
+                                    compressed=code == CMD_GET_FILE_COMPRESSED and self.compression)
+        elif code == CMD_STREAM and self.framed:
+            # Older firmware has no streaming and ignores the command
+            self.streaming = argument == "1"
+            self.send_message("Streaming started" if self.streaming else "Streaming stopped")
+        elif code == CMD_DELETE_FILE and argument:
+            self.delete_file("/" + argument)
+        elif code == CMD_LINK and self.framed:
+            # Older firmware sends fixed frames and ignores the command
+            frame_size, separator, interval = argument.partition(":")
+            if separator and frame_size.isdigit() and interval.isdigit():
+                self.set_link(int(frame_size), int(interval))
+
+    def set_link(self, frame_size, interval_ms):
+        """setLinkSettings(): frame size and chunk interval, clamped to what the firmware supports"""
+        self.chunk_size = max(MIN_FRAME_SIZE, min(MAX_FRAME_SIZE, frame_size))
+        interval_ms = max(MIN_CHUNK_INTERVAL_MS, min(MAX_CHUNK_INTERVAL_MS, interval_ms))
+        self.chunk_interval = max(interval_ms / 1000.0, LOOP_PASS)
+        # The reply holds what was applied, not what was asked for
+        self.send_message(f"Link settings: {self.chunk_size} {round(self.chunk_interval * 1000)}")
+
+    def _timestamp(self):
+        # Same format as getTimestampString(): D_HH-MM-SS of uptime
+        seconds = int(time.monotonic() - self.started)
+        days, seconds = divmod(seconds, 86400)
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        return f"{days}_{hours:02d}-{minutes:02d}-{seconds:02d}"
+
+    def start_logging(self):
+        suffix = LOG_SUFFIX if self.binary_logs else CSV_SUFFIX
+        self.current_file = f"/IMU_{self._timestamp()}{suffix}"
+        start_time = int((time.monotonic() - self.started) * 1000)
+        if self.binary_logs:
+            header = encode_header(LogHeader(FORMAT_VERSION, 1 / SAMPLE_INTERVAL, start_time))
+        else:
+            header = (CSV_HEADER + "\n").encode()
+        self.files[self.current_file.lstrip("/")] = header
+        self.mtimes[self.current_file.lstrip("/")] = int(time.time())
+        self.is_logging = True
+        self._logging_task = asyncio.get_running_loop().create_task(self._log_samples())
+        self.send_message(f"Logging started: {self.current_file}")
+
+    def stop_logging(self):
+        self.is_logging = False
+        if self._logging_task is not None:
+            self._logging_task.cancel()
+            self._logging_task = None
+        self.send_message(f"Logging stopped: {self.current_file}")
+
+    async def _log_samples(self):
+        # Synthetic IMU rows, appended and streamed in batches of STREAM_BATCH
+        name = self.current_file.lstrip("/")
+        t0 = int((time.monotonic() - self.started) * 1000)
+        n = 0
+        while self.is_logging:
+            await asyncio.sleep(SAMPLE_INTERVAL * STREAM_BATCH)
+            rows = []
+            records = []
+            for _ in range(STREAM_BATCH):
+                t = t0 + int(n * SAMPLE_INTERVAL * 1000)
+                phase = 2 * math.pi * 0.5 * n * SAMPLE_INTERVAL
+                row = (t, int(4000 * math.sin(phase)), int(2000 * math.cos(phase)),
+                       int(-12000 + 3000 * math.sin(phase)), int(800 * math.cos(phase)),
+                       int(-5000 * math.sin(phase)), int(6000 * math.cos(phase)))
+                records.append(RECORD.pack(*row))
+                if self.binary_logs:
+                    rows.append(records[-1])
+                else:
+                    rows.append((",".join(map(str, row)) + "\n").encode())
+                n += 1
+            self.files[name] = self.files[name] + b"".join(rows)
+            self.mtimes[name] = int(time.time())
+            if self.streaming:
+                payload = b"".join(records)
+                self.send(build_frame(FRAME_SAMPLES, self.sequence, payload))
+
+    def list_files(self):
+        listing = "Files on SD card:\n"
+        for name, data in self.files.items():
+            listing += f"{name} ({len(data)} bytes)\n"
+        self.send_message(listing)
+
+    def start_listing(self, tag, start=0):
+        self._cancel_listing()
+        self._list_task = asyncio.get_running_loop().create_task(self._list_pages(tag, start))
+
+    def _cancel_listing(self):
+        if self._list_task is not None:
+            self._list_task.cancel()
+            self._list_task = None
+
+    async def _list_pages(self, tag, start):
+        # startFileList() followed by repeated continueFileList()
+        max_payload = self.chunk_size - HEADER_SIZE
+        count = start
+        page = f"File list: {tag} {count}\n"
+        entries = 0
+        for name, data in list(self.files.items())[start:]:
+            line = f"{name}\t{len(data)}\t{self.mtimes.get(name, 0)}\n"
+            if len(page) + len(line) > max_payload and entries:
+                self.send_message(page)
+                count += entries
+                await asyncio.sleep(self.page_interval)
+                page = f"File list: {tag} {count}\n"
+                entries = 0
+            page += line
+            entries += 1
+        if entries:
+            self.send_message(page)
+            count += entries
+        self.send_message(f"File list end: {tag} {count}")
+        self._list_task = None
+
+    def delete_file(self, filename):
+        name = filename.lstrip("/")
+        if name not in self.files:
+            self.send_error(f"File {filename} not found")
+            return
+        del self.files[name]
+        self.mtimes.pop(name, None)
+        self.send_message(f"File deleted: {filename}")
+
+    def start_transfer(self, filename, offset=0, compressed=False):
+        self._cancel_transfer()
+        name = filename.lstrip("/")
+        if name not in self.files:
+            self.send_error(f"File {filename} not found")
+            return
+        self._transfer_task = asyncio.get_running_loop().create_task(
+            self._transfer(filename, self.files[name], offset, compressed))
+
+    def _cancel_transfer(self):
+        if self._transfer_task is not None:
+            self._transfer_task.cancel()
+            self._transfer_task = None
+
+    async def _transfer(self, filename, data, offset, compressed=False):
+        # startFileTransfer() followed by repeated continueFileTransfer()
+        size = len(data)
+        if offset > size:
+            offset = 0
+        message = f"Transfer starting: {filename} ({size} bytes)"
+        if offset > 0:
+            message += f" from {offset}"
+        if compressed:
+            message += f" {ENCODING_DEFLATE}"
+        self.send_message(message)
+        await asyncio.sleep(self.start_delay)
+
+        chunks = self._compressed_chunks if compressed else self._plain_chunks
+        crc = 0
+        for chunk in chunks(data, offset):
+            crc = zlib.crc32(chunk, crc)
+            self.send_data(chunk, crc)
+            await asyncio.sleep(self.chunk_interval)
+
+        self.send_message("Transfer complete")
+        self._transfer_task = None
+
+    def _payload_size(self):
+        # Read for every chunk, link settings apply from the next chunk on
+        return self.chunk_size - HEADER_SIZE if self.framed else self.chunk_size
+
+    def _plain_chunks(self, data, offset):
+        position = offset
+        while position < len(data):
+            size = self._payload_size()
+            yield data[position:position + size]
+            position += size
+
+    def _compressed_chunks(self, data, offset):
+        # continueCompressedTransfer(): read CHUNK_SIZE bytes at a time and
+        # send a frame whenever a full payload of deflate output is ready
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        pending = bytearray()
+        for position in range(offset, len(data), CHUNK_SIZE):
+            pending += compressor.compress(data[position:position + CHUNK_SIZE])
+            while len(pending) >= self._payload_size():
+                size = self._payload_size()
+                yield bytes(pending[:size])
+                del pending[:size]
+        pending += compressor.flush()
+        while pending:
+            size = self._payload_size()
+            yield bytes(pending[:size])
+            del pending[:size]
+
+
+class SimulatedClient:
+    """BleakClient lookalike connected to a SimulatedLogger over a simulated link"""
+
+    def __init__(self, logger, link=None):
+        self.logger = logger
+        self.link = link or LinkConditions()
+        self.address = logger.address
+        self.is_connected = False
+        self._callback = None
+        self._in_flight = collections.deque()   # (delivery time, data), in send order
+        self._timer = None
+        self._queued = collections.deque()      # times queued notifications leave the radio
+        self._radio_free = 0.0
+
+        # Counters, useful for benchmarks and tests
+        self.notifications_sent = 0
+        self.notifications_dropped = 0
+        self.bytes_delivered = 0
+
+    @property
+    def mtu_size(self):
+        return self.link.mtu
+
+    async def connect(self, **kwargs):
+        self.is_connected = True
+        self.logger.connect(self._on_notify)
+        return True
+
+    async def disconnect(self):
+        if self.is_connected:
+            self.is_connected = False
+            self.logger.disconnect()
+        return True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.disconnect()
+
+    async def start_notify(self, char_uuid, callback, **kwargs):
+        if char_uuid.upper() != DATA_CHAR_UUID:
+            raise ValueError(f"Characteristic {char_uuid} does not notify")
+        self._callback = callback
+
+    async def stop_notify(self, char_uuid):
+        self._callback = None
+
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        if not self.is_connected:
+            raise ConnectionError("Not connected")
+        if char_uuid.upper() != COMMAND_CHAR_UUID:
+            raise ValueError(f"Characteristic {char_uuid} is not writable")
+        if self.link.latency or self.link.jitter:
+            await asyncio.sleep(self._delay())
+        self.logger.handle_command(bytes(data))
+
+    def _delay(self):
+        return self.link.latency + self.link.random.uniform(0, self.link.jitter)
+
+    def _on_notify(self, data):
+        # Called by the logger for every notify()
+        self.notifications_sent += 1
+        if self.link.loss and self.link.random.random() < self.link.loss:
+            self.notifications_dropped += 1
+            return
+        # A value longer than the MTU allows is cut off, as on a real link
+        data = bytearray(data[:self.link.max_payload])
+
+        if not (self.link.latency or self.link.jitter or self.link.radio):
+            self._deliver(data)
+            return
+
+        # Notifications are delivered in order, so never before the previous one
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        delivery = now
+        if self.link.radio:
+            while self._queued and self._queued[0] <= now:
+                self._queued.popleft()
+            if self.link.tx_buffers is not None and len(self._queued) >= self.link.tx_buffers:
+                self.notifications_dropped += 1
+                return
+            self._radio_free = max(now, self._radio_free) + self.link.packet_time + len(data) * self.link.byte_time
+            self._queued.append(self._radio_free)
+            delivery = self._radio_free
+        delivery += self._delay()
+        if self._in_flight:
+            delivery = max(delivery, self._in_flight[-1][0])
+        self._in_flight.append((delivery, data))
+        if self._timer is None:
+            self._timer = loop.call_at(delivery, self._deliver_due)
+
+    def _deliver_due(self):
+        loop = asyncio.get_running_loop()
+        self._timer = None
+        while self._in_flight and self._in_flight[0][0] <= loop.time():
+            self._deliver(self._in_flight.popleft()[1])
+        if self._in_flight:
+            self._timer = loop.call_at(self._in_flight[0][0], self._deliver_due)
+
+    def _deliver(self, data):
+        if self._callback is not None and self.is_connected:
+            self.bytes_delivered += len(data)
+            self._callback(DATA_CHAR_UUID, data)
+
+
+class SimulatedDevice:
+    """What a scan returns for a simulated logger, like bleak's BLEDevice"""
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.address = logger.address
+        self.name = logger.name
+
+    def __repr__(self):
+        return f"SimulatedDevice({self.address}, {self.name})"
@@ -0,0 +1,140 @@
+"""Crash-safe file writing for downloads
+
+Chunks are written to "<name>.part" through a buffered writer as they
+arrive, so memory use does not grow with the file size. When the transfer
+completes the part file is fsynced and atomically renamed to its final
+name. If the transfer or the process dies, the part file keeps everything
+that was received so far, and its size is the offset to resume from.
+
+A compressed transfer is inflated chunk by chunk on its way into the part
+file (InflatingWriter), so the part file always holds plain file data and
+resuming works the same way for both kinds of transfer.
+"""
+
+import os
+import zlib
+
+PART_SUFFIX = ".part"
+
+# Size of the write buffer in front of the part file
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+def part_path(path):
+    """Return the path of the part file used while downloading path"""
+    return path + PART_SUFFIX
+
+
+def resume_offset(path):
+    """Return how many bytes of path are already in its part file"""
+    try:
+        return os.path.getsize(part_path(path))
+    except OSError:
+        return 0
+
+
+class PartFileWriter:
+    """Writes a download to a part file and renames it when complete"""
+
+    def __init__(self, path, offset=0, buffer_size=WRITE_BUFFER_SIZE):
+        self.path = path
+        self.part_path = part_path(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        if offset > 0:
+            # Keep the first offset bytes of an existing part file
+            if resume_offset(path) < offset:
+                raise ValueError(f"{self.part_path} has fewer than {offset} bytes to resume from")
+            self._file = open(self.part_path, "r+b", buffering=buffer_size)
+            self._file.truncate(offset)
+            self._file.seek(offset)
+        else:
+            self._file = open(self.part_path, "wb", buffering=buffer_size)
+        self.offset = offset
+        self.bytes_written = 0
+
+    def write(self, data):
+        """Write data and return the number of file bytes written"""
+        self._file.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        """Hand buffered data to the OS so a crash of this process loses nothing"""
+        if not self._file.closed:
+            self._file.flush()
+
+    def commit(self):
+        """Fsync the part file and atomically move it to its final name"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.part_path, self.path)
+        _fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+        return self.path
+
+    def close(self):
+        """Close the part file, keeping what has been written so far"""
+        if not self._file.closed:
+            self._file.flush()
+            self._file.close()
+
+    def discard(self):
+        """Close and delete the part file"""
+        self.close()
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+
+
+class InflatingWriter:
+    """Inflates a raw deflate stream into a PartFileWriter as it arrives
+
+    Only the decompressor's window is held in memory, never the payload.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.path = writer.path
+        self.compressed_bytes = 0
+        self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def write(self, data):
+        """Inflate a chunk and return the number of file bytes written
+
+        Raises zlib.error if the stream is not valid deflate data.
+        """
+        self.compressed_bytes += len(data)
+        return self.writer.write(self._inflater.decompress(data))
+
+    @property
+    def complete(self):
+        """True once the end of the deflate stream has been received"""
+        return self._inflater.eof
+
+    def flush(self):
+        self.writer.flush()
+
+    def commit(self):
+        return self.writer.commit()
+
+    def close(self):
+        self.writer.close()
+
+    def discard(self):
+        self.writer.discard()
+
+
+def _fsync_dir(directory):
+    # Make the rename itself durable. Not supported on Windows
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,74 @@
+"""Unattended sync of loggers as they come into range
+
+For a laptop or Raspberry Pi next to the pool: DockWatcher scans every few
+seconds and syncs each logger (see FleetSync) once when it appears, for
+example when it is put back in its dock after a session. A logger is synced
+again only after it has been out of range for a scan, or if its last sync
+failed. No GUI is involved, so it runs headless.
+"""
+
+import asyncio
+import time
+
+from .fleet import FleetReport
+from .transport import discover_loggers, select_devices
+
+# Seconds between scans
+WATCH_INTERVAL = 10.0
+
+
+async def find_devices(transport, target=None, scan_timeout=5.0):
+    """Scan once and return the loggers matching target (a name or address), all if None"""
+    return select_devices(await discover_loggers(transport, scan_timeout), target)
+
+
+async def sync_once(fleet, target=None, scan_timeout=5.0):
+    """Sync the loggers matching target once and return the FleetReport"""
+    started = time.monotonic()
+    fleet.log("Scanning for loggers...")
+    devices = await find_devices(fleet.transport, target, scan_timeout)
+    if not devices:
+        fleet.log(f"No logger {target} in range" if target else "No loggers in range")
+        return FleetReport([], time.monotonic() - started)
+    fleet.log(f"Found {len(devices)} loggers")
+    return await fleet.run(devices)
+
+
+class DockWatcher:
+    """Keeps scanning and syncs each logger when it comes into range"""
+
+    def __init__(self, fleet, target=None, interval=WATCH_INTERVAL, scan_timeout=5.0,
+                 on_report=None):
+        self.fleet = fleet
+        self.target = target
+        self.interval = interval
+        self.scan_timeout = scan_timeout
+        self.on_report = on_report or (lambda report: None)
+        self.synced = set()         # addresses synced since they came into range
+
+    async def run(self, scans=None):
+        """Scan and sync until cancelled, or for the given number of scans"""
+        while scans is None or scans > 0:
+            await self.scan()
+            if scans is not None:
+                scans -= 1
+                if scans == 0:
+                    break
+            await asyncio.sleep(self.interval)
+
+    async def scan(self):
+        """Scan once and sync the loggers that arrived since the previous scan"""
+        devices = await find_devices(self.fleet.transport, self.target, self.scan_timeout)
+        in_range = {device.address for device in devices}
+        # A logger that left is synced again when it comes back
+        self.synced &= in_range
+        arrived = [device for device in devices if device.address not in self.synced]
+        if not arrived:
+            return None
+        self.fleet.log(f"{len(arrived)} loggers arrived: "
+                       + ", ".join(device.name or device.address for device in arrived))
+        report = await self.fleet.run(arrived)
+        self.synced |= {device.address for device in report.devices
+                        if not device.error and not device.failed}
+        self.on_report(report)
+        return report
@@ -0,0 +1,127 @@
+"""Following a file while it is being logged
+
+During a long set the current log on the SD card keeps growing. A
+TailFollower fetches it every few seconds with TransferEngine.fetch_tail(),
+which transfers only the bytes appended since the previous fetch and
+appends them to the local copy, so the data on the host is never more than
+one interval behind and logging never has to stop. When the device reports
+that logging stopped, the follower fetches the rest once more and ends.
+
+The firmware flushes the log every 10 records, and only flushed data is
+visible to a transfer, so every fetch ends on a whole record.
+"""
+
+import asyncio
+
+from .fleet import device_dir
+from .manifest import Manifest
+from .protocol import clean_filename
+from .sync import find_devices
+from .transfer import (
+    TransferEngine, TransferError, EVENT_LOG, EVENT_LOGGING_STARTED, EVENT_LOGGING_STOPPED,
+)
+
+# Seconds between fetches
+TAIL_INTERVAL = 10.0
+
+
+class TailFollower:
+    """Fetches the new part of one file every interval until logging stops
+
+    Subscribe on_event() to the engine so that the end of logging is seen.
+    """
+
+    def __init__(self, engine, filename, interval=TAIL_INTERVAL, compress=False, on_fetch=None):
+        self.engine = engine
+        self.filename = clean_filename(filename)
+        self.interval = interval
+        self.compress = compress
+        self.on_fetch = on_fetch or (lambda path, received: None)
+        self.fetches = 0
+        self.bytes_fetched = 0      # file bytes transferred, without the prefixes already saved
+        self._stopped = asyncio.Event()
+
+    def on_event(self, event, payload):
+        if event == EVENT_LOGGING_STOPPED and clean_filename(payload["filename"]) == self.filename:
+            self._stopped.set()
+
+    def stop(self):
+        """End after the next fetch, as if logging had stopped"""
+        self._stopped.set()
+
+    async def run(self):
+        """Fetch every interval until logging stops, then once more, and return the local path
+
+        A failed fetch is tried again at the next interval, unless it was the last one.
+        """
+        while True:
+            stopped = self._stopped.is_set()
+            try:
+                path = await self.fetch()
+            except TransferError:
+                if stopped or self.engine.client is None:
+                    raise
+            else:
+                if stopped:
+                    return path
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def fetch(self):
+        """Fetch what was appended since the last fetch, return the local path"""
+        path = await self.engine.fetch_tail(self.filename, compress=self.compress)
+        # The engine measures each download, prefixes already saved are not counted
+        received = self.engine.metrics.file_bytes
+        self.fetches += 1
+        self.bytes_fetched += received
+        self.on_fetch(path, received)
+        return path
+
+
+async def follow(transport, filename=None, target=None, dest="downloaded_files", interval=TAIL_INTERVAL,
+                 compress=False, start=False, scan_timeout=5.0, log=print):
+    """Connect to a logger and follow a file until its logging stops, return the local path
+
+    filename defaults to the file the device wrote last. With start, logging
+    is started first and the new file is followed.
+    """
+    devices = await find_devices(transport, target, scan_timeout)
+    if not devices:
+        raise RuntimeError(f"No logger {target} in range" if target else "No loggers in range")
+    device = devices[0]
+    manifest = Manifest(dest)
+    engine = TransferEngine(device_dir(dest, device.address), manifest=manifest, device=device.address)
+    engine.subscribe(lambda event, payload: event == EVENT_LOG
+                     and not payload["message"].startswith("Received:") and log(payload["message"]))
+    client = transport.client(device)
+    log(f"Connecting to {device.name} ({device.address})...")
+    await client.connect()
+    try:
+        await engine.attach(client)
+        if start:
+            started = asyncio.get_running_loop().create_future()
+            engine.subscribe(lambda event, payload: event == EVENT_LOGGING_STARTED
+                             and not started.done() and started.set_result(payload["filename"]))
+            await engine.start_logging()
+            filename = await asyncio.wait_for(started, 10.0)
+        elif filename is None:
+            files = await engine.list_files()
+            if not files:
+                raise RuntimeError("No files on the SD card")
+            # Listings without times are in directory order, newest last
+            filename = max(enumerate(files), key=lambda item: (item[1].mtime or 0, item[0]))[1].name
+        log(f"Following {filename}, fetching every {interval:g} s")
+
+        follower = TailFollower(engine, filename, interval, compress,
+                                on_fetch=lambda path, received: log(f"{received} new bytes in {path}"))
+        engine.subscribe(follower.on_event)
+        return await follower.run()
+    finally:
+        await engine.detach()
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+        manifest.close()
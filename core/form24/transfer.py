@@ -0,0 +1,769 @@
+"""Transfer engine for the ESP32 IMU logger
+
+The TransferEngine runs on the asyncio loop that owns the BLE connection.
+It receives every notification directly, keeps the file transfer state and
+publishes events to subscribers. Progress events are throttled so that a
+display subscribed to the engine only has to render a few updates per
+second, however fast the chunks arrive.
+
+File data is streamed to a part file as it arrives (see storage.py), so
+memory use stays flat for any file size. If a download is interrupted, the
+next request for the same file asks the device for the missing range only,
+starting at the size of the local part file.
+
+Notifications are frames (see framing.py). Sequence numbers and the running
+CRC of data frames are checked as each frame arrives; a lost or corrupted
+chunk stops the transfer at once, before it reaches the part file, and the
+download resumes from the last good byte. Unframed text from older firmware
+is still understood.
+
+A download can ask for a compressed transfer. The device then sends the
+file as a raw deflate stream, or plain data if it cannot compress, and says
+which in "Transfer starting:". Compressed data is inflated into the part
+file as it arrives; offsets, progress and sizes always count file bytes.
+
+While streaming is on, the device also sends the samples it logs in sample
+frames. They are decoded here, on the BLE loop thread, and published as
+NumPy record arrays (see logformat.py) for live processing.
+
+The SD card listing is requested in pages, which are parsed as they
+arrive, so it works for any number of files. Each entry carries the size
+and the time the device last wrote the file. If pages are lost, the
+listing is requested again from the first missing entry. Firmware without
+paged listings is recognised by its silence and asked for the
+single-message listing instead, which a long listing overflows.
+
+On attach the engine finds out the MTU of the link and asks the device for
+frames that fit in one notification. While data arrives, it adapts the
+frame size and the pacing of chunks to the loss and arrival rate it
+observes (see linkcontrol.py). Each request waits for the device to
+confirm it, so that its reply and the next response are not sent in one
+burst. Firmware without link settings never confirms and keeps its fixed
+frames.
+
+Given a manifest (see manifest.py), every saved file is recorded in it with
+the address of the device it came from. It is hashed in a worker thread,
+and the download returns once it is recorded.
+
+A file that is still being logged can be fetched again and again
+(fetch_tail): each time only the bytes appended since the last fetch are
+transferred and appended to the local copy.
+
+The engine keeps the state of one request of each kind, so listings,
+downloads and deletes take turns: each waits until the one before it has
+finished, whichever task started it.
+
+Every download is measured (see metrics.py): throughput, the time between
+notifications, gaps, lost frames, stalls and retries.
+"""
+
+import asyncio
+import functools
+import os
+import shutil
+import sqlite3
+import time
+import zlib
+
+from .protocol import (
+    COMMAND_CHAR_UUID, DATA_CHAR_UUID,
+    CMD_START_LOGGING, CMD_STOP_LOGGING, CMD_LIST_FILES, CMD_LIST_PAGED, CMD_DELETE_FILE, CMD_STREAM,
+    MSG_LOGGING_STARTED, MSG_LOGGING_STOPPED, MSG_FILE_LIST, MSG_FILE_PAGE, MSG_FILE_LIST_END,
+    MSG_TRANSFER_STARTING, MSG_TRANSFER_COMPLETE, MSG_FILE_DELETED, MSG_ERROR,
+    MSG_STREAMING_STARTED, MSG_STREAMING_STOPPED, MSG_LINK_SETTINGS, CONTROL_PREFIXES, ENCODING_DEFLATE,
+    parse_transfer_start, parse_file_list, parse_file_page, parse_file_list_end, parse_link_settings,
+    range_command, link_command, clean_filename,
+)
+from .framing import (
+    FRAME_CONTROL, FRAME_CONTROL_PART, FRAME_DATA, FRAME_SAMPLES, FrameError, SequenceTracker,
+    is_frame, parse_frame, check_payload,
+)
+from .linkcontrol import LinkTuner, negotiate_mtu
+from .logformat import decode_records
+from .metrics import EVENT_METRICS, TransferMetrics
+from .storage import InflatingWriter, PartFileWriter, part_path, resume_offset
+
+# Events published by the engine. Subscribers are called as callback(event, payload)
+EVENT_LOG = "log"                              # {"message"}
+EVENT_LOGGING_STARTED = "logging_started"      # {"filename"}
+EVENT_LOGGING_STOPPED = "logging_stopped"      # {"filename"}
+EVENT_FILE_LIST = "file_list"                  # {"files": [FileEntry, ...]}
+EVENT_TRANSFER_STARTED = "transfer_started"    # {"filename", "size", "offset", "encoding"}
+EVENT_PROGRESS = "progress"                    # {"filename", "received", "size", "percent"}
+EVENT_TRANSFER_COMPLETE = "transfer_complete"  # {"filename", "path", "received", "wire_bytes", "verified"}
+EVENT_FILE_DELETED = "file_deleted"            # {"filename"}
+EVENT_STREAMING = "streaming"                  # {"enabled"}
+EVENT_SAMPLES = "samples"                      # {"records"}, published on the BLE loop thread
+EVENT_ERROR = "error"                          # {"message"}
+# EVENT_METRICS                                # {"metrics", "final"}, see metrics.py
+
+# Maximum rate of progress events (per second)
+PROGRESS_RATE_HZ = 10
+
+# Seconds to wait for the first page of a paged listing before asking for
+# the single-message listing of older firmware
+LIST_PROBE_TIMEOUT = 2.0
+
+# Seconds to wait for the device to confirm link settings
+LINK_REPLY_TIMEOUT = 1.0
+
+_CONTROL_PREFIXES = tuple(prefix.encode() for prefix in CONTROL_PREFIXES)
+
+
+class TransferError(Exception):
+    """Raised when the device reports an error or a transfer fails"""
+
+
+class TransferStalled(TransferError):
+    """Raised when no notification arrives for longer than the idle timeout"""
+
+
+class TransferCorrupt(TransferError):
+    """Raised when a chunk is lost, reordered or fails its CRC check"""
+
+
+class TransferEngine:
+    """Owns the protocol and receive state for one connected logger"""
+
+    def __init__(self, download_dir, progress_rate=PROGRESS_RATE_HZ, manifest=None, device="",
+                 adaptive=True):
+        self.download_dir = download_dir
+        self.adaptive = adaptive   # negotiate the frame size and adapt the pacing
+        self.manifest = manifest
+        self.device = device       # address recorded in the manifest
+        self.progress_interval = 1.0 / progress_rate if progress_rate else 0
+        self.client = None
+        self._subscribers = []
+
+        # Transfer state
+        self.transfer_in_progress = False
+        self.filename = ""
+        self.file_size = 0
+        self.bytes_received = 0
+        self.encoding = None       # ENCODING_DEFLATE while receiving a compressed transfer
+        self.wire_bytes = 0        # payload bytes received over the link
+        self.verified = False      # True while every chunk so far passed the CRC check
+        self._writer = None
+        self._record_task = None   # adds a saved file to the manifest
+        self._crc = 0
+        self._transfers_started = 0
+        self._last_progress = 0.0
+        self._last_activity = 0.0
+        self._sequence = SequenceTracker()
+        self._message_parts = bytearray()
+        self.metrics = None        # TransferMetrics of the current or last download
+
+        # Link state. link_settings is what the device confirmed, None if
+        # it has not (yet), in which case it sends its default frames
+        self.mtu = None
+        self.tuner = None
+        self.link_settings = None
+        self._link_requested = None
+        self._link_task = None
+        self._link_future = None
+
+        # Listing state. paged_listing is None until the device has shown
+        # whether it sends paged listings
+        self.paged_listing = None
+        self.card_files = {}        # name -> FileEntry, from the last listing
+        self._listing = []
+        self._list_tag = 0          # pages of other listings are ignored
+
+        # Futures waiting for a reply from the device
+        self._list_future = None
+        self._transfer_future = None
+        self._delete_future = None
+        # Held by a listing, download or delete while it runs
+        self._busy = asyncio.Lock()
+
+    # ------------------------------------------------------------------
+    # Subscriptions
+
+    def subscribe(self, callback):
+        """Register callback(event, payload) for engine events"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove a previously registered callback"""
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _publish(self, event, **payload):
+        for callback in list(self._subscribers):
+            try:
+                callback(event, payload)
+            except Exception:
+                # A broken subscriber must never stop the transfer
+                pass
+
+    def _log(self, message):
+        self._publish(EVENT_LOG, message=message)
+
+    # ------------------------------------------------------------------
+    # Connection
+
+    async def attach(self, client):
+        """Start receiving notifications from a connected client"""
+        self.client = client
+        self._sequence.reset()
+        self._message_parts.clear()
+        self.link_settings = None
+        self._link_requested = None
+        await client.start_notify(DATA_CHAR_UUID, self.handle_notification)
+        if self.adaptive:
+            self.mtu = await negotiate_mtu(client)
+            self.tuner = LinkTuner(self.mtu)
+            self._log(f"Link MTU is {self.mtu}, asking for frames of {self.tuner.frame_size} bytes")
+            await self._update_link()
+
+    async def detach(self):
+        """Stop receiving notifications and fail any pending request"""
+        client = self.client
+        self.client = None
+        if client is not None:
+            try:
+                await client.stop_notify(DATA_CHAR_UUID)
+            except Exception:
+                pass
+        self._fail_pending(TransferError("Disconnected"))
+        self._reset_transfer()
+
+    async def _update_link(self):
+        # Send the tuner's settings if the device has not been asked for them
+        # yet, and wait for it to confirm them
+        if self.tuner is None or self.client is None or self.tuner.settings == self._link_requested:
+            return
+        self._link_requested = self.tuner.settings
+        self._link_future = asyncio.get_running_loop().create_future()
+        await self.send_command(link_command(*self._link_requested))
+        try:
+            await asyncio.wait_for(self._link_future, LINK_REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            if self.link_settings is None:
+                self._log("Device does not support link settings, keeping its frames")
+                self.tuner = None
+        finally:
+            self._link_future = None
+
+    def _link_loss(self):
+        if self.tuner is not None and self.link_settings is not None:
+            self.tuner.on_loss()
+
+    async def send_command(self, command):
+        """Write a command string to the command characteristic"""
+        if self.client is None:
+            raise TransferError("Not connected")
+        await self.client.write_gatt_char(COMMAND_CHAR_UUID, command.encode())
+
+    # ------------------------------------------------------------------
+    # Commands
+
+    async def start_logging(self):
+        await self.send_command(CMD_START_LOGGING)
+
+    async def stop_logging(self):
+        await self.send_command(CMD_STOP_LOGGING)
+
+    async def start_streaming(self):
+        """Ask the device to stream the samples it logs"""
+        await self.send_command(f"{CMD_STREAM}1")
+
+    async def stop_streaming(self):
+        await self.send_command(f"{CMD_STREAM}0")
+
+    async def list_files(self, timeout=10.0, retries=3):
+        """Request the SD card listing and return it as [FileEntry, ...]
+
+        timeout is how long the device may stay silent, a long listing
+        takes as long as it needs. A paged listing that loses pages is
+        resumed from the first missing entry, giving up after retries
+        attempts in a row that bring no new entries.
+        """
+        async with self._busy:
+            return await self._list_files(timeout, retries)
+
+    async def _list_files(self, timeout, retries):
+        self._listing = []
+        attempt = 0
+        while True:
+            start = len(self._listing)
+            try:
+                if self.paged_listing is False:
+                    files = await self._request_listing(CMD_LIST_FILES, timeout)
+                else:
+                    files = await self._request_listing(CMD_LIST_PAGED, timeout, start)
+                self.card_files = {clean_filename(entry.name): entry for entry in files}
+                return files
+            except asyncio.TimeoutError:
+                if self.paged_listing is None:
+                    # Older firmware does not know the command and never answers
+                    self.paged_listing = False
+                    self._log("Device does not support paged listings, asking for the whole list")
+                    continue
+                if self.paged_listing is False:
+                    raise
+                error = TransferStalled("File list stalled")
+            except TransferCorrupt as e:
+                error = e
+            attempt = 0 if len(self._listing) > start else attempt + 1
+            if attempt > retries:
+                raise error
+            self._log(f"{str(error)}, listing again from file {len(self._listing)}")
+
+    async def _request_listing(self, command, timeout, start=0):
+        if command == CMD_LIST_PAGED:
+            if self.paged_listing is None:
+                timeout = min(timeout, LIST_PROBE_TIMEOUT)
+            self._list_tag += 1
+            command += f"{self._list_tag}:{start}" if start else str(self._list_tag)
+        self._list_future = asyncio.get_running_loop().create_future()
+        self._last_activity = time.monotonic()
+        await self.send_command(command)
+        # Wait as long as notifications keep arriving
+        while True:
+            try:
+                return await asyncio.wait_for(asyncio.shield(self._list_future), timeout)
+            except asyncio.TimeoutError:
+                if time.monotonic() - self._last_activity >= timeout:
+                    self._list_future = None
+                    raise
+
+    async def download(self, filename, resume=True, retries=3, idle_timeout=10.0, compress=False):
+        """Download a file and return the local path once it is saved
+
+        With resume, an existing part file is kept and only the rest of the
+        file is requested. A stalled or corrupted transfer is resumed until
+        retries attempts in a row have saved nothing. With compress, the device is asked for a compressed
+        transfer; firmware that ignores the request is asked again without.
+        The download is measured in self.metrics, which is published with
+        EVENT_METRICS when it ends.
+        """
+        async with self._busy:
+            return await self._measured_download(filename, resume, retries, idle_timeout, compress)
+
+    async def _measured_download(self, filename, resume, retries, idle_timeout, compress):
+        self.metrics = TransferMetrics(clean_filename(filename), self.device)
+        error = None
+        try:
+            return await self._download(filename, resume, retries, idle_timeout, compress)
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            self.metrics.finish(error, self.link_settings)
+            self._publish(EVENT_METRICS, metrics=self.metrics.as_dict(), final=True)
+
+    async def _download(self, filename, resume, retries, idle_timeout, compress):
+        attempt = 0
+        while True:
+            offset = resume_offset(self._local_path(filename)) if resume else 0
+            self._reset_transfer()
+            self._transfer_future = asyncio.get_running_loop().create_future()
+            self._last_activity = time.monotonic()
+            started = self._transfers_started
+            if self._link_task is not None and not self._link_task.done():
+                # Let a pending update finish, they share _link_future
+                await self._link_task
+            await self._update_link()
+            await self.send_command(range_command(filename, offset, compress))
+            try:
+                return await self._wait_active(self._transfer_future, idle_timeout)
+            except (TransferStalled, TransferCorrupt) as e:
+                if isinstance(e, TransferStalled):
+                    self.metrics.stalls += 1
+                    self._link_loss()
+                if (isinstance(e, TransferStalled) and compress and self.client is not None
+                        and self._transfers_started == started):
+                    # Older firmware does not know the command and never answers
+                    compress = False
+                    self._log("Device does not support compressed transfers, downloading uncompressed")
+                    continue
+                # Only failures in a row that saved nothing count against retries
+                progressed = resume and resume_offset(self._local_path(filename)) > offset
+                attempt = 0 if progressed else attempt + 1
+                if not resume or attempt > retries or self.client is None:
+                    raise
+                self.metrics.retries += 1
+                if progressed:
+                    self._log(f"{str(e)}, resuming {filename}")
+                else:
+                    self._log(f"{str(e)}, resuming {filename} (attempt {attempt} of {retries})")
+
+    async def fetch_tail(self, filename, compress=False, idle_timeout=10.0):
+        """Fetch what was appended to filename since the local copy was saved, return its path
+
+        A copy of the saved file becomes the part file, so the download
+        resumes at its end, and the saved file stays as it was until the
+        fetch completes. Without a local copy the whole file is downloaded.
+        """
+        path = self._local_path(filename)
+        async with self._busy:
+            if os.path.exists(path) and not os.path.exists(part_path(path)):
+                temporary = part_path(path) + ".tmp"
+                shutil.copyfile(path, temporary)
+                os.replace(temporary, part_path(path))
+            return await self._measured_download(filename, True, 3, idle_timeout, compress)
+
+    async def delete_file(self, filename, timeout=10.0):
+        """Delete a file on the SD card"""
+        async with self._busy:
+            self._delete_future = asyncio.get_running_loop().create_future()
+            await self.send_command(f"{CMD_DELETE_FILE}{clean_filename(filename)}")
+            return await asyncio.wait_for(self._delete_future, timeout)
+
+    async def _wait_active(self, future, idle_timeout):
+        # Wait for the future as long as notifications keep arriving
+        while True:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), idle_timeout)
+            except asyncio.CancelledError:
+                # The shield keeps the future, which nobody waits for any more
+                future.cancel()
+                raise
+            except asyncio.TimeoutError:
+                if self._record_task is not None and not self._record_task.done():
+                    # The file is saved, the manifest is still hashing it
+                    continue
+                if time.monotonic() - self._last_activity >= idle_timeout:
+                    self._reset_transfer()
+                    raise TransferStalled("Transfer stalled")
+
+    # ------------------------------------------------------------------
+    # Notifications
+
+    def handle_notification(self, sender, data):
+        """Notification callback, called on the BLE loop thread"""
+        self._last_activity = time.monotonic()
+        data = bytes(data)
+        if self.transfer_in_progress and self.metrics is not None:
+            self.metrics.on_notification(len(data), self._last_activity)
+
+        if is_frame(data):
+            self._handle_frame(data)
+
+        # Older firmware: control messages are plain ASCII starting with a
+        # known prefix. Anything else received during a transfer is file data
+        elif data.startswith(_CONTROL_PREFIXES):
+            self._handle_message(data.decode('utf-8', errors='replace'))
+        elif self.transfer_in_progress:
+            # Unframed data carries no CRC
+            self.verified = False
+            self._handle_data(data)
+        else:
+            self._log(f"Ignoring {len(data)} bytes outside of a transfer")
+
+    def _handle_frame(self, data):
+        try:
+            frame = parse_frame(data)
+        except FrameError as e:
+            if self.transfer_in_progress and self.metrics is not None:
+                self.metrics.corrupt_frames += 1
+            self._abort_transfer(TransferCorrupt(str(e)))
+            return
+
+        gap = self._sequence.check(frame.seq)
+        if gap != 0:
+            # A message split over several frames lost a part
+            self._message_parts.clear()
+        if gap != 0 and self.transfer_in_progress:
+            if self.metrics is not None:
+                self.metrics.lost_frames += max(gap, 0)
+            what = f"{gap} frames lost" if gap > 0 else "frames out of order"
+            self._abort_transfer(TransferCorrupt(f"{what} before frame {frame.seq}"))
+            return
+
+        if frame.type == FRAME_DATA:
+            if not self.transfer_in_progress:
+                # Leftovers of a transfer that was already abandoned
+                return
+            self._crc = zlib.crc32(frame.payload, self._crc)
+            if self._crc != frame.crc:
+                if self.metrics is not None:
+                    self.metrics.corrupt_frames += 1
+                self._abort_transfer(TransferCorrupt(f"CRC mismatch in frame {frame.seq}"))
+                return
+            self._handle_data(frame.payload)
+            if (self.tuner is not None and self.link_settings is not None and self.tuner.on_frame()
+                    and (self._link_task is None or self._link_task.done())):
+                # One update at a time, a later one is sent by the next
+                self._link_task = asyncio.get_running_loop().create_task(self._update_link())
+
+        elif frame.type in (FRAME_CONTROL, FRAME_CONTROL_PART):
+            try:
+                payload = check_payload(frame)
+            except FrameError as e:
+                self._message_parts.clear()
+                self._abort_transfer(TransferCorrupt(str(e)))
+                return
+            self._message_parts += payload
+            if frame.type == FRAME_CONTROL:
+                message = self._message_parts.decode("utf-8", errors="replace")
+                self._message_parts.clear()
+                self._handle_message(message)
+
+        elif frame.type == FRAME_SAMPLES:
+            try:
+                records = decode_records(check_payload(frame))
+            except FrameError as e:
+                # Live samples are only displayed, losing a batch is harmless
+                self._log(f"Dropping samples: {str(e)}")
+                return
+            self._publish(EVENT_SAMPLES, records=records)
+
+        else:
+            self._log(f"Ignoring frame of unknown type {frame.type}")
+
+    def _abort_transfer(self, error):
+        # Stop writing at the last verified byte, download() decides whether to resume
+        self._link_loss()
+        self._publish(EVENT_ERROR, message=f"Transfer aborted: {str(error)}")
+        if self.transfer_in_progress or self._transfer_future is not None:
+            self._reset_transfer()
+            self._fail(self._transfer_future, error)
+            self._transfer_future = None
+
+    def _handle_message(self, message):
+        self._log(f"Received: {message[:50]}{'...' if len(message) > 50 else ''}")
+
+        if message.startswith(MSG_LOGGING_STARTED):
+            self._publish(EVENT_LOGGING_STARTED, filename=message.split(":", 1)[1].strip())
+
+        elif message.startswith(MSG_LOGGING_STOPPED):
+            self._publish(EVENT_LOGGING_STOPPED, filename=message.split(":", 1)[1].strip())
+
+        elif message.startswith(MSG_FILE_LIST):
+            files = parse_file_list(message)
+            self._publish(EVENT_FILE_LIST, files=files)
+            self._resolve(self._list_future, files)
+
+        elif message.startswith(MSG_FILE_PAGE):
+            self.paged_listing = True
+            try:
+                tag, index, files = parse_file_page(message)
+            except ValueError:
+                self._fail_listing("Malformed file list page")
+                return
+            if tag != str(self._list_tag) or self._list_future is None:
+                # A page of an abandoned listing
+                return
+            if index != len(self._listing):
+                self._fail_listing(f"File list page {index} arrived after {len(self._listing)} files")
+                return
+            self._listing.extend(files)
+
+        elif message.startswith(MSG_FILE_LIST_END):
+            self.paged_listing = True
+            try:
+                tag, count = parse_file_list_end(message)
+            except ValueError:
+                self._fail_listing("Malformed end of file list")
+                return
+            if tag != str(self._list_tag) or self._list_future is None:
+                return
+            files, self._listing = self._listing, []
+            if count != len(files):
+                self._fail_listing(f"File list ended after {len(files)} of {count} files")
+                return
+            self._publish(EVENT_FILE_LIST, files=files)
+            self._resolve(self._list_future, files)
+
+        elif message.startswith(MSG_TRANSFER_STARTING):
+            self._close_writer()
+            self.filename, self.file_size, offset, self.encoding = parse_transfer_start(message)
+            self.bytes_received = offset
+            self.wire_bytes = 0
+            self.verified = True
+            self._crc = 0
+            self._transfers_started += 1
+            try:
+                self._writer = PartFileWriter(self._local_path(self.filename), offset=offset)
+                if self.encoding == ENCODING_DEFLATE:
+                    self._writer = InflatingWriter(self._writer)
+            except (OSError, ValueError) as e:
+                self._publish(EVENT_ERROR, message=f"Error opening file: {str(e)}")
+                self._reset_transfer()
+                self._fail(self._transfer_future, TransferError(str(e)))
+                self._transfer_future = None
+                return
+            self.transfer_in_progress = True
+            self._last_progress = time.monotonic()
+            if self.tuner is not None:
+                self.tuner.pause()
+            if self.metrics is not None:
+                self.metrics.on_start(self.file_size, offset, self.encoding, self._last_progress)
+            self._publish(EVENT_TRANSFER_STARTED, filename=self.filename, size=self.file_size,
+                          offset=offset, encoding=self.encoding)
+
+        elif message.startswith(MSG_TRANSFER_COMPLETE):
+            if not self.transfer_in_progress:
+                # End of a transfer that was abandoned and has been requested again
+                self._log("Ignoring end of an abandoned transfer")
+            elif self.encoding == ENCODING_DEFLATE and not self._writer.complete:
+                self._abort_transfer(TransferCorrupt("Compressed stream ended early"))
+            elif 0 < self.file_size != self.bytes_received:
+                self._abort_transfer(TransferCorrupt(
+                    f"Received {self.bytes_received} of {self.file_size} bytes"))
+            else:
+                self._finish_transfer()
+
+        elif message.startswith(MSG_LINK_SETTINGS):
+            try:
+                self.link_settings = parse_link_settings(message)
+            except ValueError:
+                return
+            if self.tuner is not None:
+                # The device may have clamped what was asked for
+                self.tuner.frame_size, self.tuner.interval = self.link_settings
+                self._link_requested = self.link_settings
+            self._resolve(self._link_future, self.link_settings)
+
+        elif message.startswith(MSG_STREAMING_STARTED):
+            self._publish(EVENT_STREAMING, enabled=True)
+
+        elif message.startswith(MSG_STREAMING_STOPPED):
+            self._publish(EVENT_STREAMING, enabled=False)
+
+        elif message.startswith(MSG_FILE_DELETED):
+            filename = message.split(":", 1)[1].strip()
+            self._publish(EVENT_FILE_DELETED, filename=filename)
+            self._resolve(self._delete_future, filename)
+
+        elif message.startswith(MSG_ERROR):
+            self._publish(EVENT_ERROR, message=message)
+            error = TransferError(message)
+            if self.transfer_in_progress or self._transfer_future is not None:
+                self._reset_transfer()
+            self._fail_pending(error)
+
+    def _handle_data(self, data):
+        try:
+            written = self._writer.write(data)
+        except zlib.error as e:
+            self._abort_transfer(TransferCorrupt(f"Invalid compressed data: {str(e)}"))
+            return
+        except OSError as e:
+            self._publish(EVENT_ERROR, message=f"Error writing file: {str(e)}")
+            self._reset_transfer()
+            self._fail(self._transfer_future, TransferError(str(e)))
+            self._transfer_future = None
+            return
+        self.bytes_received += written
+        self.wire_bytes += len(data)
+        if self.metrics is not None:
+            self.metrics.file_bytes += written
+
+        # Throttle progress events, and flush the part file at the same rate
+        now = time.monotonic()
+        if now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            self._writer.flush()
+            self._publish_progress()
+
+    def _publish_progress(self):
+        percent = (self.bytes_received * 100) / self.file_size if self.file_size > 0 else 0
+        self._publish(EVENT_PROGRESS, filename=self.filename, received=self.bytes_received,
+                      size=self.file_size, percent=percent)
+        if self.metrics is not None:
+            self.metrics.link_settings = self.link_settings
+            self._publish(EVENT_METRICS, metrics=self.metrics.as_dict(), final=False)
+
+    def _finish_transfer(self):
+        if not self.filename or self.bytes_received == 0:
+            self._log("Transfer complete, but no data received")
+            if self._writer is not None:
+                self._writer.discard()
+                self._writer = None
+            self._reset_transfer()
+            self._fail(self._transfer_future, TransferError("No data received"))
+            self._transfer_future = None
+            return
+
+        self._publish_progress()
+        try:
+            path = self._writer.commit()
+            self._writer = None
+        except OSError as e:
+            self._publish(EVENT_ERROR, message=f"Error saving file: {str(e)}")
+            self._reset_transfer()
+            self._fail(self._transfer_future, TransferError(str(e)))
+            self._transfer_future = None
+            return
+
+        received = self.bytes_received
+        wire_bytes = self.wire_bytes
+        verified = self.verified
+        filename = self.filename
+        future = self._transfer_future
+        self._reset_transfer()
+        if self.manifest is None:
+            self._complete(future, filename, path, received, wire_bytes, verified)
+        else:
+            # Hashing the file would hold up notifications, other devices' too
+            self._record_task = asyncio.get_running_loop().create_task(
+                self._record(future, filename, path, received, wire_bytes, verified))
+
+    async def _record(self, future, filename, path, received, wire_bytes, verified):
+        listed = self.card_files.get(clean_filename(filename))
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(self.manifest.record, path, device=self.device, filename=filename,
+                                        card_mtime=listed.mtime if listed else None))
+        except (OSError, sqlite3.Error) as e:
+            self._publish(EVENT_ERROR, message=f"Error updating the manifest: {str(e)}")
+        self._complete(future, filename, path, received, wire_bytes, verified)
+
+    def _complete(self, future, filename, path, received, wire_bytes, verified):
+        self._log(f"Transfer complete, received {received} bytes")
+        self._publish(EVENT_TRANSFER_COMPLETE, filename=filename, path=path, received=received,
+                      wire_bytes=wire_bytes, verified=verified)
+        self._resolve(future, path)
+        if self._transfer_future is future:
+            self._transfer_future = None
+
+    def _local_path(self, filename):
+        return os.path.join(self.download_dir, clean_filename(filename))
+
+    def _close_writer(self):
+        # Keep the part file so the data received so far survives
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except OSError:
+                pass
+            self._writer = None
+
+    def _reset_transfer(self):
+        self._close_writer()
+        self.transfer_in_progress = False
+        self.filename = ""
+        self.file_size = 0
+        self.bytes_received = 0
+        self.encoding = None
+        self.wire_bytes = 0
+        self.verified = False
+
+    # ------------------------------------------------------------------
+    # Futures
+
+    @staticmethod
+    def _resolve(future, result):
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(future, error):
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    def _fail_listing(self, message):
+        # Pages of a listing were lost, list_files() asks for the rest
+        self._fail(self._list_future, TransferCorrupt(message))
+
+    def _fail_pending(self, error):
+        for future in (self._list_future, self._transfer_future, self._delete_future):
+            self._fail(future, error)
+        # Nothing more to wait for, the link settings are reset on the next attach
+        self._resolve(self._link_future, None)
+        self._list_future = None
+        self._transfer_future = None
+        self._delete_future = None
@@ -0,0 +1,79 @@
+"""Pluggable transports: real BLE through bleak, or the Python simulator
+
+A transport finds loggers and creates clients for them. Clients from either
+transport have the same interface (connect, disconnect, start_notify,
+write_gatt_char), so the TransferEngine, the fleet sync and the GUI work
+with both.
+"""
+
+from bleak import BleakClient, BleakScanner
+
+from .protocol import DEVICE_NAME
+from .simulator import SimulatedClient, SimulatedDevice, SimulatedLogger, LinkConditions
+
+
+class BleTransport:
+    """Talks to real loggers through bleak"""
+
+    async def discover(self, timeout=5.0, name=None):
+        """Return the devices found by one scan, optionally filtered by name"""
+        devices = await BleakScanner.discover(timeout=timeout)
+        return [device for device in devices if device.name and (name is None or device.name == name)]
+
+    def client(self, device, timeout=20.0):
+        """Return an unconnected client for a device or address"""
+        return BleakClient(device, timeout=timeout)
+
+
+class SimulatedTransport:
+    """Talks to SimulatedLogger instances over simulated links"""
+
+    def __init__(self, loggers, link=None):
+        self.loggers = list(loggers)
+        self.link = link
+
+    @classmethod
+    def from_directory(cls, directory, count=1, link=None, **kwargs):
+        """Simulate count loggers whose SD cards hold the files of directory"""
+        loggers = [SimulatedLogger.from_directory(directory, address=f"SIM:00:00:00:00:{i + 1:02X}", **kwargs)
+                   for i in range(count)]
+        return cls(loggers, link)
+
+    async def discover(self, timeout=5.0, name=None):
+        return [SimulatedDevice(logger) for logger in self.loggers
+                if name is None or logger.name == name]
+
+    def client(self, device, timeout=20.0):
+        if isinstance(device, SimulatedDevice):
+            logger = device.logger
+        else:
+            logger = next((logger for logger in self.loggers if logger.address == device), None)
+            if logger is None:
+                raise ValueError(f"No simulated logger with address {device}")
+        # Each client gets its own link so loss and jitter are independent per device
+        link = self.link
+        if link is not None:
+            link = LinkConditions(link.latency, link.jitter, link.mtu, link.loss,
+                                  link.random.randrange(2 ** 32))
+        return SimulatedClient(logger, link)
+
+
+def create_transport(simulate_dir=None, **kwargs):
+    """Return the simulated transport for simulate_dir, or the BLE transport"""
+    if simulate_dir:
+        return SimulatedTransport.from_directory(simulate_dir, **kwargs)
+    return BleTransport()
+
+
+async def discover_loggers(transport, timeout=5.0):
+    """Scan once and return the devices advertising as loggers"""
+    return await transport.discover(timeout=timeout, name=DEVICE_NAME)
+
+
+def select_devices(devices, target=None):
+    """Return the devices whose name or address is target, all of them if target is None"""
+    if target is None:
+        return list(devices)
+    target = target.upper()
+    return [device for device in devices
+            if device.address.upper() == target or (device.name or "").upper() == target]
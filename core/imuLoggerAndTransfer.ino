@@ -7,6 +7,8 @@
 #include <BLEServer.h>
 #include <BLE2902.h>
 #include <Adafruit_NeoPixel.h> // For controlling the onboard LED
+#include "rom/crc.h" // crc32_le() for frame checksums
+#include "rom/miniz.h" // tdefl deflate compressor in ROM, for compressed transfers
 
 // Define pins
 #define SD_CS 33  // SD card chip select pin
@@ -33,10 +35,21 @@ void startLogging();
 void stopLogging();
 void logIMUData();
 void listFiles();
-void startFileTransfer(String filename);
+void startFileList(String tag, uint32_t start);
+void continueFileList();
+void startFileTransfer(String filename, size_t offset = 0, bool compressed = false);
 void continueFileTransfer();
+void continueCompressedTransfer();
+bool beginCompression();
+void endFileTransfer();
+void streamSample(const struct LogRecord& record);
+void flushStream();
 void deleteFile(String filename);
 void updateLED(uint32_t color);
+void sendFrame(uint8_t type, const uint8_t* payload, size_t length, uint32_t crc);
+void sendMessage(const String& message);
+void setLink(size_t size, uint32_t intervalMs);
+bool chunkDue();
 
 // BLE objects
 BLEServer *pServer = nullptr;
@@ -57,7 +70,61 @@ bool sdCardAvailable = false;
 bool isLogging = false;
 File dataFile;
 String currentFileName = "";
-const int CHUNK_SIZE = 512; // Size of data chunks for file transfer
+const int CHUNK_SIZE = 512; // Default size of one notification during file transfer, frame header included
+
+// Notification frames: version, type, sequence (4), payload length (2), CRC32 (4), payload.
+// Data frames carry the running CRC32 of the transfer, other frames the CRC32 of their payload
+const uint8_t FRAME_VERSION = 1;
+const uint8_t FRAME_CONTROL = 0x01; // Text message
+const uint8_t FRAME_DATA = 0x02;    // File data
+const uint8_t FRAME_SAMPLES = 0x03; // Live samples, LogRecords back to back
+const uint8_t FRAME_CONTROL_PART = 0x04; // Leading part of a message longer than one frame
+const size_t FRAME_HEADER_SIZE = 12;
+const size_t MAX_FRAME_SIZE = 512;  // Largest attribute value BLE allows
+const size_t MIN_FRAME_SIZE = 20;   // Fits the smallest MTU (23)
+uint32_t frameSequence = 0;         // Counts every frame since the client connected
+
+// Link settings: the client asks for frames that fit its MTU and for the
+// interval between chunks that its link keeps up with (C<frame size>:<interval ms>).
+// Without a request the defaults of older firmware apply
+const uint16_t BLE_MTU = 517;                 // Asked for on every connection
+const uint32_t DEFAULT_CHUNK_INTERVAL_MS = 60;
+size_t frameSize = CHUNK_SIZE;
+uint32_t chunkIntervalMs = DEFAULT_CHUNK_INTERVAL_MS;
+unsigned long nextChunkTime = 0;
+const unsigned long TRANSFER_START_DELAY_MS = 500; // Gives the client time to get ready
+
+// Binary log format, decoded on the host by form24/logformat.py. All fields
+// little-endian, which is the ESP32's native byte order
+const bool LOG_BINARY = true;           // false: write CSV text like older firmware
+const uint16_t LOG_FORMAT_VERSION = 1;
+const float LOG_SAMPLE_RATE_HZ = 83.3;  // Nominal, one sample per loop() pass
+
+struct __attribute__((packed)) LogHeader {
+    char magic[4];          // "F24L"
+    uint16_t version;
+    uint16_t headerSize;
+    uint16_t recordSize;
+    uint16_t reserved;
+    float sampleRate;       // Hz
+    uint32_t startTime;     // millis() when logging started
+    uint8_t padding[12];
+};
+
+struct __attribute__((packed)) LogRecord {
+    uint32_t time;          // millis()
+    int16_t ax, ay, az;
+    int16_t gx, gy, gz;
+};
+
+// Live streaming: samples are sent in small batches so the client sees
+// them within STREAM_MAX_DELAY_MS of being read
+const size_t STREAM_BATCH = 4;
+const unsigned long STREAM_MAX_DELAY_MS = 50;
+bool streamEnabled = false;
+LogRecord streamBuffer[STREAM_BATCH];
+size_t streamCount = 0;
+unsigned long streamBatchStart = 0;
 
 // Time tracking
 unsigned long startupTime = 0;
@@ -68,12 +135,38 @@ const char CMD_STOP_LOGGING = 'E';
 const char CMD_LIST_FILES = 'L';
 const char CMD_GET_FILE = 'G';
 const char CMD_DELETE_FILE = 'D';
+const char CMD_GET_FILE_RANGE = 'R'; // R<offset>:<filename>, resumes a download from offset
+const char CMD_GET_FILE_COMPRESSED = 'Z'; // Z<offset>:<filename>, same as R but sent as raw deflate
+const char CMD_STREAM = 'W';         // W1 streams samples to the client while logging, W0 stops
+const char CMD_LIST_PAGED = 'F';     // F<tag>[:<first entry>] lists the files in pages, see continueFileList()
+const char CMD_LINK = 'C';           // C<frame size>:<interval ms> sets the link settings, see setLink()
 
 // File transfer state
 bool isTransferring = false;
 File transferFile;
 size_t fileSize = 0;
 size_t bytesTransferred = 0;
+uint32_t transferCrc = 0; // Running CRC32 of the data sent in this transfer
+
+// Compressed transfer state. The compressor needs a few hundred KB, so it
+// lives in PSRAM and is allocated on first use. If that fails the file is
+// sent uncompressed and the client is told so in "Transfer starting:"
+bool transferCompressed = false;
+tdefl_compressor *compressor = nullptr;
+uint8_t compressInput[CHUNK_SIZE];                          // File data not yet compressed
+size_t compressInputPos = 0;
+size_t compressInputLength = 0;
+uint8_t compressOutput[MAX_FRAME_SIZE - FRAME_HEADER_SIZE]; // Deflate output for the next frames
+size_t compressOutputLength = 0;
+bool compressDone = false;
+
+// Paged listing state: one page is sent per loop() pass. An entry that did
+// not fit in the previous page starts the next one
+bool isListing = false;
+File listRoot;
+uint32_t listCount = 0;
+String listTag = "";        // Sent back with every page, so the client can tell listings apart
+String listPending = "";
 
 // Logging Button state
 int buttonState = HIGH;    // Default state (not pressed)
@@ -85,12 +178,16 @@ const unsigned long debounceDelay = 50; // Debounce time in milliseconds
 class ServerCallbacks: public BLEServerCallbacks {
     void onConnect(BLEServer* pServer) {
         deviceConnected = true;
+        frameSequence = 0;
         Serial.println("Device connected");
         updateLED(LED_CONNECTED);
     }
 
     void onDisconnect(BLEServer* pServer) {
         deviceConnected = false;
+        streamEnabled = false;
+        streamCount = 0;
+        setLink(CHUNK_SIZE, DEFAULT_CHUNK_INTERVAL_MS);
         Serial.println("Device disconnected");
         
         // If logging was in progress, close the file
@@ -104,6 +201,12 @@ class ServerCallbacks: public BLEServerCallbacks {
             isTransferring = false;
         }
         
+        // Same for a listing
+        if (isListing) {
+            listRoot.close();
+            isListing = false;
+        }
+        
         // Reset LED to idle state
         updateLED(LED_IDLE);
         
@@ -137,8 +240,7 @@ class CommandCallbacks: public BLECharacteristicCallbacks {
                         startLogging();
                     } else if (!sdCardAvailable) {
                         String error = "Error: SD card not available";
-                        pDataCharacteristic->setValue(error.c_str());
-                        pDataCharacteristic->notify();
+                        sendMessage(error);
                         Serial.println(error);
                         updateLED(LED_ERROR);
                     }
@@ -155,13 +257,43 @@ class CommandCallbacks: public BLECharacteristicCallbacks {
                         listFiles();
                     } else {
                         String error = "Error: SD card not available";
-                        pDataCharacteristic->setValue(error.c_str());
-                        pDataCharacteristic->notify();
+                        sendMessage(error);
                         Serial.println(error);
                         updateLED(LED_ERROR);
                     }
                     break;
                     
+                case CMD_LIST_PAGED:
+                    if (sdCardAvailable) {
+                        // F<tag> or F<tag>:<first entry>, the client resumes a listing that lost pages
+                        int separator = rxValue.indexOf(':');
+                        if (separator > 0) {
+                            startFileList(rxValue.substring(1, separator),
+                                          strtoul(rxValue.substring(separator + 1).c_str(), nullptr, 10));
+                        } else {
+                            startFileList(rxValue.substring(1), 0);
+                        }
+                    } else {
+                        String error = "Error: SD card not available";
+                        sendMessage(error);
+                        Serial.println(error);
+                        updateLED(LED_ERROR);
+                    }
+                    break;
+                    
+                case CMD_LINK: {
+                    // C<frame size>:<interval ms>
+                    int separator = rxValue.indexOf(':');
+                    if (separator > 0) {
+                        setLink(strtoul(rxValue.substring(1, separator).c_str(), nullptr, 10),
+                                strtoul(rxValue.substring(separator + 1).c_str(), nullptr, 10));
+                        sendMessage("Link settings: " + String(frameSize) + " " + String(chunkIntervalMs));
+                    } else {
+                        sendMessage("Error: Invalid link settings");
+                    }
+                    break;
+                }
+                    
                 case CMD_GET_FILE:
                     if (sdCardAvailable) {
                         if (rxValue.length() > 1) {
@@ -171,13 +303,52 @@ class CommandCallbacks: public BLECharacteristicCallbacks {
                         }
                     } else {
                         String error = "Error: SD card not available";
-                        pDataCharacteristic->setValue(error.c_str());
-                        pDataCharacteristic->notify();
+                        sendMessage(error);
+                        Serial.println(error);
+                        updateLED(LED_ERROR);
+                    }
+                    break;
+                    
+                case CMD_GET_FILE_RANGE:
+                    if (sdCardAvailable) {
+                        int separator = rxValue.indexOf(':');
+                        if (separator > 1 && rxValue.length() > separator + 1) {
+                            // Extract offset and filename from command
+                            size_t offset = strtoul(rxValue.substring(1, separator).c_str(), nullptr, 10);
+                            String filename = "/" + rxValue.substring(separator + 1);
+                            startFileTransfer(filename, offset);
+                        }
+                    } else {
+                        String error = "Error: SD card not available";
+                        sendMessage(error);
+                        Serial.println(error);
+                        updateLED(LED_ERROR);
+                    }
+                    break;
+                    
+                case CMD_GET_FILE_COMPRESSED:
+                    if (sdCardAvailable) {
+                        int separator = rxValue.indexOf(':');
+                        if (separator > 1 && rxValue.length() > separator + 1) {
+                            // Extract offset and filename from command
+                            size_t offset = strtoul(rxValue.substring(1, separator).c_str(), nullptr, 10);
+                            String filename = "/" + rxValue.substring(separator + 1);
+                            startFileTransfer(filename, offset, true);
+                        }
+                    } else {
+                        String error = "Error: SD card not available";
+                        sendMessage(error);
                         Serial.println(error);
                         updateLED(LED_ERROR);
                     }
                     break;
                     
+                case CMD_STREAM:
+                    streamEnabled = rxValue.length() > 1 && rxValue.charAt(1) == '1';
+                    streamCount = 0;
+                    sendMessage(streamEnabled ? "Streaming started" : "Streaming stopped");
+                    break;
+                    
                 case CMD_DELETE_FILE:
                     if (sdCardAvailable) {
                         if (rxValue.length() > 1) {
@@ -187,8 +358,7 @@ class CommandCallbacks: public BLECharacteristicCallbacks {
                         }
                     } else {
                         String error = "Error: SD card not available";
-                        pDataCharacteristic->setValue(error.c_str());
-                        pDataCharacteristic->notify();
+                        sendMessage(error);
                         Serial.println(error);
                         updateLED(LED_ERROR);
                     }
@@ -254,6 +424,7 @@ void setup() {
     // Initialize BLE
     Serial.println("Initializing BLE...");
     BLEDevice::init("ESP32_IMU_Logger");
+    BLEDevice::setMTU(BLE_MTU);
     
     // Print the MAC address
     String macAddress = BLEDevice::getAddress().toString().c_str();
@@ -316,10 +487,15 @@ void loop() {
         logIMUData();
     }
     
-    // If transferring a file, continue the transfer process
-    if (isTransferring && deviceConnected && sdCardAvailable) {
+    // If transferring a file, send the next chunk once the chunk interval has passed
+    if (isTransferring && deviceConnected && sdCardAvailable && chunkDue()) {
         continueFileTransfer();
     }
+    
+    // Same for a paged listing
+    if (isListing && deviceConnected && sdCardAvailable) {
+        continueFileList();
+    }
 
     // Button state checking
     int reading = digitalRead(LOGGING_PIN); // Read the button state
@@ -336,8 +512,7 @@ void loop() {
                 startLogging();
             } else if (!sdCardAvailable) {
                 String error = "Error: SD card not available";
-                pDataCharacteristic->setValue(error.c_str());
-                pDataCharacteristic->notify();
+                sendMessage(error);
                 Serial.println(error);
                 updateLED(LED_ERROR);
             } else if (isLogging) {
@@ -360,8 +535,10 @@ void loop() {
         }
     }
     
-    // Small delay to prevent overloading the CPU
-    delay(10);
+    // Small delay to prevent overloading the CPU. While logging it sets the
+    // sample rate, so it stays at 10 ms; otherwise it is short while sending
+    // so that chunk intervals below 10 ms are kept
+    delay(!isLogging && (isTransferring || isListing) ? 1 : 10);
 }
 
 // Updates the onboard NeoPixel LED color
@@ -370,6 +547,67 @@ void updateLED(uint32_t color) {
     pixels.show();
 }
 
+// Sends one notification frame on the data characteristic
+void sendFrame(uint8_t type, const uint8_t* payload, size_t length, uint32_t crc) {
+    static uint8_t frame[MAX_FRAME_SIZE];
+    
+    // A payload longer than the largest frame is cut off, as a bare notify() would be.
+    // sendMessage() splits long messages, so this only guards the buffer
+    if (length > MAX_FRAME_SIZE - FRAME_HEADER_SIZE) {
+        length = MAX_FRAME_SIZE - FRAME_HEADER_SIZE;
+        crc = crc32_le(0, payload, length);
+    }
+    
+    frame[0] = FRAME_VERSION;
+    frame[1] = type;
+    frame[2] = frameSequence & 0xFF;
+    frame[3] = (frameSequence >> 8) & 0xFF;
+    frame[4] = (frameSequence >> 16) & 0xFF;
+    frame[5] = (frameSequence >> 24) & 0xFF;
+    frame[6] = length & 0xFF;
+    frame[7] = (length >> 8) & 0xFF;
+    frame[8] = crc & 0xFF;
+    frame[9] = (crc >> 8) & 0xFF;
+    frame[10] = (crc >> 16) & 0xFF;
+    frame[11] = (crc >> 24) & 0xFF;
+    memcpy(frame + FRAME_HEADER_SIZE, payload, length);
+    
+    pDataCharacteristic->setValue(frame, FRAME_HEADER_SIZE + length);
+    pDataCharacteristic->notify();
+    frameSequence++;
+}
+
+// Sends a text message to the client in a control frame. A message longer
+// than one frame is sent in parts, the last one in a control frame
+void sendMessage(const String& message) {
+    const uint8_t* payload = (const uint8_t*)message.c_str();
+    size_t remaining = message.length();
+    const size_t partSize = frameSize - FRAME_HEADER_SIZE;
+    while (remaining > partSize) {
+        sendFrame(FRAME_CONTROL_PART, payload, partSize, crc32_le(0, payload, partSize));
+        payload += partSize;
+        remaining -= partSize;
+    }
+    sendFrame(FRAME_CONTROL, payload, remaining, crc32_le(0, payload, remaining));
+}
+
+// Applies link settings asked for by the client, within what BLE allows.
+// They take effect from the next frame
+void setLink(size_t size, uint32_t intervalMs) {
+    frameSize = constrain(size, MIN_FRAME_SIZE, MAX_FRAME_SIZE);
+    chunkIntervalMs = constrain(intervalMs, 1, 1000);
+}
+
+// True once the chunk interval has passed since the previous chunk
+bool chunkDue() {
+    unsigned long now = millis();
+    if ((long)(now - nextChunkTime) < 0) {
+        return false;
+    }
+    nextChunkTime = now + chunkIntervalMs;
+    return true;
+}
+
 // Gets a timestamp string for the current system uptime
 String getTimestampString() {
     // Get current uptime in milliseconds
@@ -404,14 +642,26 @@ String getTimestampString() {
 void startLogging() {
     // Create a new filename with timestamp
     String timestamp = getTimestampString();
-    currentFileName = "/IMU_" + timestamp + ".csv";
+    currentFileName = "/IMU_" + timestamp + (LOG_BINARY ? ".bin" : ".csv");
     
     // Open the file for writing
     dataFile = SD.open(currentFileName, FILE_WRITE);
     
     if (dataFile) {
-        // Write CSV header
-        dataFile.println("Time,AccelX,AccelY,AccelZ,GyroX,GyroY,GyroZ");
+        if (LOG_BINARY) {
+            // Write binary log header
+            LogHeader header = {};
+            memcpy(header.magic, "F24L", 4);
+            header.version = LOG_FORMAT_VERSION;
+            header.headerSize = sizeof(LogHeader);
+            header.recordSize = sizeof(LogRecord);
+            header.sampleRate = LOG_SAMPLE_RATE_HZ;
+            header.startTime = millis();
+            dataFile.write((const uint8_t*)&header, sizeof(header));
+        } else {
+            // Write CSV header
+            dataFile.println("Time,AccelX,AccelY,AccelZ,GyroX,GyroY,GyroZ");
+        }
         isLogging = true;
         
         // Update LED to indicate logging
@@ -419,15 +669,13 @@ void startLogging() {
         
         // Notify client that logging has started
         String message = "Logging started: " + currentFileName;
-        pDataCharacteristic->setValue(message.c_str());
-        pDataCharacteristic->notify();
+        sendMessage(message);
         
         Serial.println(message);
     } else {
         // Failed to open file
         String error = "Error: Couldn't create file " + currentFileName;
-        pDataCharacteristic->setValue(error.c_str());
-        pDataCharacteristic->notify();
+        sendMessage(error);
         
         Serial.println(error);
         
@@ -440,6 +688,9 @@ void startLogging() {
 
 void stopLogging() {
     if (isLogging) {
+        // Send the samples still waiting for a stream frame
+        flushStream();
+        
         // Close the file
         dataFile.close();
         isLogging = false;
@@ -449,8 +700,7 @@ void stopLogging() {
         
         // Notify client that logging has stopped
         String message = "Logging stopped: " + currentFileName;
-        pDataCharacteristic->setValue(message.c_str());
-        pDataCharacteristic->notify();
+        sendMessage(message);
         
         Serial.println(message);
     }
@@ -464,17 +714,27 @@ void logIMUData() {
     // Get current time in milliseconds
     unsigned long timestamp = millis();
     
-    // Create data string in CSV format
-    String dataString = String(timestamp) + "," + 
-                        String(ax) + "," + 
-                        String(ay) + "," + 
-                        String(az) + "," + 
-                        String(gx) + "," + 
-                        String(gy) + "," + 
-                        String(gz);
+    LogRecord record = {(uint32_t)timestamp, ax, ay, az, gx, gy, gz};
+    if (streamEnabled) {
+        streamSample(record);
+    }
     
-    // Write to file
-    dataFile.println(dataString);
+    if (LOG_BINARY) {
+        // One fixed-width record, 16 bytes instead of about 40 characters
+        dataFile.write((const uint8_t*)&record, sizeof(record));
+    } else {
+        // Create data string in CSV format
+        String dataString = String(timestamp) + "," + 
+                            String(ax) + "," + 
+                            String(ay) + "," + 
+                            String(az) + "," + 
+                            String(gx) + "," + 
+                            String(gy) + "," + 
+                            String(gz);
+        
+        // Write to file
+        dataFile.println(dataString);
+    }
     
     // Flush every 10 records to ensure data is written to SD card
     static int counter = 0;
@@ -485,6 +745,27 @@ void logIMUData() {
     }
 }
 
+void streamSample(const LogRecord& record) {
+    if (streamCount == 0) {
+        streamBatchStart = millis();
+    }
+    streamBuffer[streamCount++] = record;
+    if (streamCount >= STREAM_BATCH || millis() - streamBatchStart >= STREAM_MAX_DELAY_MS) {
+        flushStream();
+    }
+}
+
+void flushStream() {
+    if (streamCount == 0 || !deviceConnected) {
+        streamCount = 0;
+        return;
+    }
+    const uint8_t* payload = (const uint8_t*)streamBuffer;
+    size_t length = streamCount * sizeof(LogRecord);
+    sendFrame(FRAME_SAMPLES, payload, length, crc32_le(0, payload, length));
+    streamCount = 0;
+}
+
 void listFiles() {
     // Open the root directory
     File root = SD.open("/");
@@ -513,13 +794,85 @@ void listFiles() {
     root.close();
     
     // Send the file list to the client
-    pDataCharacteristic->setValue(fileList.c_str());
-    pDataCharacteristic->notify();
+    sendMessage(fileList);
     
     Serial.println("File list sent");
 }
 
-void startFileTransfer(String filename) {
+// Starts a paged listing at entry start, sent by continueFileList(). Unlike
+// listFiles() it works for any number of files, and every entry carries the
+// time the file was last written
+void startFileList(String tag, uint32_t start) {
+    if (isListing) {
+        listRoot.close();
+    }
+    listRoot = SD.open("/");
+    if (!listRoot) {
+        sendMessage("Error: Failed to open root directory");
+        return;
+    }
+    listCount = 0;
+    listTag = tag;
+    listPending = "";
+    
+    // Skip the entries the client already has
+    while (listCount < start) {
+        File entry = listRoot.openNextFile();
+        if (!entry) {
+            break;
+        }
+        if (!entry.isDirectory()) {
+            listCount++;
+        }
+        entry.close();
+    }
+    isListing = true;
+}
+
+// Sends the next page: "File list: <tag> <index of its first entry>"
+// followed by one "name\tsize\tmtime" line per file, as many as fit in one
+// frame. The last page is followed by "File list end: <tag> <count>"
+void continueFileList() {
+    const size_t maxPayload = frameSize - FRAME_HEADER_SIZE;
+    String page = "File list: " + listTag + " " + String(listCount) + "\n";
+    uint32_t pageEntries = 0;
+    bool done = false;
+    
+    while (true) {
+        if (listPending.length() == 0) {
+            File entry = listRoot.openNextFile();
+            if (!entry) {
+                done = true;
+                break;
+            }
+            if (!entry.isDirectory()) {
+                listPending = String(entry.name()) + "\t" + String(entry.size()) + "\t" +
+                              String((unsigned long)entry.getLastWrite()) + "\n";
+            }
+            entry.close();
+            continue;
+        }
+        if (page.length() + listPending.length() > maxPayload && pageEntries > 0) {
+            break;
+        }
+        page += listPending;
+        listPending = "";
+        pageEntries++;
+    }
+    
+    if (pageEntries > 0) {
+        sendMessage(page);
+        listCount += pageEntries;
+    }
+    if (done) {
+        listRoot.close();
+        isListing = false;
+        sendMessage("File list end: " + listTag + " " + String(listCount));
+        Serial.println("File list sent in pages");
+    }
+}
+
+void startFileTransfer(String filename, size_t offset, bool compressed) {
     // Check if a transfer is already in progress
     if (isTransferring) {
         transferFile.close();
@@ -529,8 +882,7 @@ void startFileTransfer(String filename) {
     // Check if the file exists
     if (!SD.exists(filename)) {
         String error = "Error: File " + filename + " not found";
-        pDataCharacteristic->setValue(error.c_str());
-        pDataCharacteristic->notify();
+        sendMessage(error);
         
         Serial.println(error);
         
@@ -546,8 +898,7 @@ void startFileTransfer(String filename) {
     
     if (!transferFile) {
         String error = "Error: Couldn't open file " + filename;
-        pDataCharacteristic->setValue(error.c_str());
-        pDataCharacteristic->notify();
+        sendMessage(error);
         
         Serial.println(error);
         
@@ -560,52 +911,60 @@ void startFileTransfer(String filename) {
     
     // Get file size
     fileSize = transferFile.size();
-    bytesTransferred = 0;
+    
+    // Resume from the requested offset. If the file is now shorter than the
+    // client's copy it has changed, so start again from the beginning
+    if (offset > fileSize) {
+        offset = 0;
+    }
+    if (offset > 0 && !transferFile.seek(offset)) {
+        offset = 0;
+        transferFile.seek(0);
+    }
+    bytesTransferred = offset;
+    transferCrc = 0;
+    transferCompressed = compressed && beginCompression();
     
     // Update LED to indicate transfer
     updateLED(LED_TRANSFER);
     
     // Notify client that transfer is starting
     String message = "Transfer starting: " + filename + " (" + String(fileSize) + " bytes)";
-    pDataCharacteristic->setValue(message.c_str());
-    pDataCharacteristic->notify();
+    if (offset > 0) {
+        message += " from " + String(offset);
+    }
+    if (transferCompressed) {
+        message += " deflate";
+    }
+    sendMessage(message);
     
     Serial.println(message);
     Serial.print("File size: ");
     Serial.print(fileSize);
     Serial.println(" bytes");
     
-    // Set the transfer flag
+    // Set the transfer flag. loop() sends the first chunk once the client
+    // had time to get ready, without blocking: the file being transferred
+    // may be the one being logged, and logging must not miss samples
     isTransferring = true;
-    
-    // Add a small delay to make sure the client is ready
-    delay(500);
-    
-    // Start the transfer process
-    continueFileTransfer();
+    nextChunkTime = millis() + TRANSFER_START_DELAY_MS;
 }
 
 void continueFileTransfer() {
     if (!isTransferring) return;
     
-    // Read a chunk of data from the file
-    uint8_t buffer[CHUNK_SIZE];
-    size_t bytesToRead = min((size_t)CHUNK_SIZE, fileSize - bytesTransferred);
+    if (transferCompressed) {
+        continueCompressedTransfer();
+        return;
+    }
+    
+    // Read a chunk of data from the file, leaving room for the frame header
+    uint8_t buffer[MAX_FRAME_SIZE - FRAME_HEADER_SIZE];
+    size_t bytesToRead = min(frameSize - FRAME_HEADER_SIZE, fileSize - bytesTransferred);
     
     // If no more bytes to read, close the file and end transfer
     if (bytesToRead == 0) {
-        transferFile.close();
-        isTransferring = false;
-        
-        // Return LED to connected state
-        updateLED(LED_CONNECTED);
-        
-        // Notify client that transfer is complete
-        String message = "Transfer complete";
-        pDataCharacteristic->setValue(message.c_str());
-        pDataCharacteristic->notify();
-        
-        Serial.println(message);
+        endFileTransfer();
         return;
     }
     
@@ -614,8 +973,8 @@ void continueFileTransfer() {
     
     if (bytesRead > 0) {
         // Send the chunk to the client
-        pDataCharacteristic->setValue(buffer, bytesRead);
-        pDataCharacteristic->notify();
+        transferCrc = crc32_le(transferCrc, buffer, bytesRead);
+        sendFrame(FRAME_DATA, buffer, bytesRead, transferCrc);
         
         // Update the counter
         bytesTransferred += bytesRead;
@@ -632,17 +991,98 @@ void continueFileTransfer() {
     } else {
         Serial.println("Error reading file");
     }
+}
+
+bool beginCompression() {
+    if (compressor == nullptr) {
+        compressor = (tdefl_compressor *) ps_malloc(sizeof(tdefl_compressor));
+        if (compressor == nullptr) {
+            Serial.println("Not enough PSRAM for the compressor, sending uncompressed");
+            return false;
+        }
+    }
+    // Raw deflate (no zlib header) with greedy parsing, which is fast and
+    // still halves the size of the CSV logs
+    if (tdefl_init(compressor, NULL, NULL, 128 | TDEFL_GREEDY_PARSING_FLAG) != TDEFL_STATUS_OKAY) {
+        return false;
+    }
+    compressInputPos = 0;
+    compressInputLength = 0;
+    compressOutputLength = 0;
+    compressDone = false;
+    return true;
+}
+
+void continueCompressedTransfer() {
+    // Compress file data until a frame's worth of output is ready or the stream ends
+    const size_t payloadSize = frameSize - FRAME_HEADER_SIZE;
+    while (compressOutputLength < payloadSize && !compressDone) {
+        if (compressInputPos == compressInputLength && bytesTransferred < fileSize) {
+            compressInputLength = transferFile.read(compressInput, min(sizeof(compressInput), fileSize - bytesTransferred));
+            compressInputPos = 0;
+            if (compressInputLength == 0) {
+                Serial.println("Error reading file");
+                break;
+            }
+            bytesTransferred += compressInputLength;
+        }
+        
+        size_t inputSize = compressInputLength - compressInputPos;
+        size_t outputSize = payloadSize - compressOutputLength;
+        bool lastInput = bytesTransferred >= fileSize;
+        tdefl_status status = tdefl_compress(compressor, compressInput + compressInputPos, &inputSize,
+                                             compressOutput + compressOutputLength, &outputSize,
+                                             lastInput ? TDEFL_FINISH : TDEFL_NO_FLUSH);
+        compressInputPos += inputSize;
+        compressOutputLength += outputSize;
+        
+        if (status == TDEFL_STATUS_DONE) {
+            compressDone = true;
+        } else if (status != TDEFL_STATUS_OKAY) {
+            Serial.println("Compression failed");
+            break;
+        }
+    }
+    
+    if (compressOutputLength > 0) {
+        // Output left over from larger frames waits for the next chunk
+        size_t length = min(compressOutputLength, payloadSize);
+        transferCrc = crc32_le(transferCrc, compressOutput, length);
+        sendFrame(FRAME_DATA, compressOutput, length, transferCrc);
+        compressOutputLength -= length;
+        memmove(compressOutput, compressOutput + length, compressOutputLength);
+        
+        Serial.print("Bytes compressed: ");
+        Serial.print(bytesTransferred);
+        Serial.print(" of ");
+        Serial.println(fileSize);
+    }
     
-    // Add a small delay to allow BLE stack to process
-    delay(50);
+    if (compressDone && compressOutputLength == 0) {
+        endFileTransfer();
+    }
+}
+
+void endFileTransfer() {
+    transferFile.close();
+    isTransferring = false;
+    transferCompressed = false;
+    
+    // Return LED to connected state, or logging if the transfer was a tail of the current log
+    updateLED(isLogging ? LED_LOGGING : LED_CONNECTED);
+    
+    // Notify client that transfer is complete
+    String message = "Transfer complete";
+    sendMessage(message);
+    
+    Serial.println(message);
 }
 
 void deleteFile(String filename) {
     // Check if the file exists
     if (!SD.exists(filename)) {
         String error = "Error: File " + filename + " not found";
-        pDataCharacteristic->setValue(error.c_str());
-        pDataCharacteristic->notify();
+        sendMessage(error);
         
         Serial.println(error);
         
@@ -656,14 +1096,12 @@ void deleteFile(String filename) {
     // Delete the file
     if (SD.remove(filename)) {
         String message = "File deleted: " + filename;
-        pDataCharacteristic->setValue(message.c_str());
-        pDataCharacteristic->notify();
+        sendMessage(message);
         
         Serial.println(message);
     } else {
         String error = "Error: Couldn't delete file " + filename;
-        pDataCharacteristic->setValue(error.c_str());
-        pDataCharacteristic->notify();
+        sendMessage(error);
         
         Serial.println(error);
         
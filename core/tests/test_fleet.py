@@ -0,0 +1,47 @@
+"""Fleet sync against the simulated logger"""
+
+import asyncio
+import os
+
+from form24.fleet import FleetSync
+from form24.manifest import Manifest
+from form24.simulator import SimulatedLogger
+from form24.transport import SimulatedTransport
+
+BROKEN = "IMU_1_00-01-00.csv"
+
+
+def break_file(logger, filename):
+    """Make every transfer of filename fail its CRC check from the first frame"""
+    start_transfer, send_data = logger.start_transfer, logger.send_data
+    current = [None]
+
+    def tracking_start_transfer(name, *args, **kwargs):
+        current[0] = name.lstrip("/")
+        start_transfer(name, *args, **kwargs)
+
+    def corrupting_send_data(chunk, crc):
+        send_data(chunk, crc ^ 1 if current[0] == filename else crc)
+
+    logger.start_transfer = tracking_start_transfer
+    logger.send_data = corrupting_send_data
+
+
+def test_failed_download_does_not_stop_the_device(tmp_path):
+    files = {f"IMU_{i}_00-01-00.csv": os.urandom(5_000) for i in range(4)}
+    logger = SimulatedLogger(files, start_delay=0, chunk_interval=0, page_interval=0)
+    break_file(logger, BROKEN)
+
+    with Manifest(str(tmp_path)) as manifest:
+        fleet = FleetSync(str(tmp_path), transport=SimulatedTransport([logger]), delete=True,
+                          manifest=manifest)
+        report = asyncio.run(fleet.run())
+
+    device, = report.devices
+    assert device.error is None
+    assert list(device.failed) == [BROKEN]
+    assert len(device.downloaded) == 3
+    # The files that did verify are still deleted, the broken one stays on the card
+    assert sorted(device.deleted) == sorted(name for name in files if name != BROKEN)
+    assert list(logger.files) == [BROKEN]
+    assert "1 failed" in report.summary()
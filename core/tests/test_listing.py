@@ -0,0 +1,94 @@
+"""Paged listings of a large card, against the simulated logger"""
+
+import asyncio
+
+from form24.protocol import CMD_LIST_PAGED, MSG_FILE_LIST_END, MSG_FILE_PAGE, clean_filename
+from form24.simulator import SimulatedClient, SimulatedLogger
+from form24.transfer import TransferEngine
+
+FILE_COUNT = 10_000
+
+
+def card():
+    files = {f"IMU_{i}_00-01-00.csv": bytes(i % 997) for i in range(FILE_COUNT)}
+    mtimes = {name: 1_700_000_000 + i for i, name in enumerate(files)}
+    return files, mtimes
+
+
+def drop_page(logger, number):
+    """Make the logger lose its number-th "File list:" page, once"""
+    send_message = logger.send_message
+    seen = [0]
+
+    def lossy_send_message(message):
+        if message.startswith(MSG_FILE_PAGE):
+            seen[0] += 1
+            if seen[0] == number:
+                return
+        send_message(message)
+
+    logger.send_message = lossy_send_message
+
+
+def record(logger):
+    commands, ends = [], []
+    handle, send_message = logger.handle_command, logger.send_message
+
+    def recording(data):
+        commands.append(bytes(data).decode())
+        handle(data)
+
+    def recording_message(message):
+        if message.startswith(MSG_FILE_LIST_END):
+            ends.append(int(message.split()[-1]))
+        send_message(message)
+
+    logger.handle_command = recording
+    logger.send_message = recording_message
+    return commands, ends
+
+
+async def list_card(logger):
+    client = SimulatedClient(logger)
+    await client.connect()
+    engine = TransferEngine(".")
+    await engine.attach(client)
+    try:
+        return await engine.list_files()
+    finally:
+        await engine.detach()
+        await client.disconnect()
+
+
+def check_listing(entries, files, mtimes):
+    assert len(entries) == FILE_COUNT
+    listed = {clean_filename(entry.name): (entry.size, entry.mtime) for entry in entries}
+    assert listed == {name: (len(content), mtimes[name]) for name, content in files.items()}
+
+
+def test_listing_10000_files():
+    files, mtimes = card()
+    logger = SimulatedLogger(files, mtimes=mtimes, page_interval=0, start_delay=0)
+    commands, ends = record(logger)
+
+    entries = asyncio.run(list_card(logger))
+
+    check_listing(entries, files, mtimes)
+    assert ends == [FILE_COUNT]
+    assert [command for command in commands if command[0] == CMD_LIST_PAGED] == [f"{CMD_LIST_PAGED}1"]
+
+
+def test_listing_resumes_after_lost_page():
+    files, mtimes = card()
+    logger = SimulatedLogger(files, mtimes=mtimes, page_interval=0, start_delay=0)
+    drop_page(logger, 50)
+    commands, ends = record(logger)
+
+    entries = asyncio.run(list_card(logger))
+
+    check_listing(entries, files, mtimes)
+    listings = [command for command in commands if command[0] == CMD_LIST_PAGED]
+    assert len(listings) == 2
+    tag, _, start = listings[1][1:].partition(":")
+    assert tag != listings[0][1:] and 0 < int(start) < FILE_COUNT
+    assert ends[-1] == FILE_COUNT
@@ -0,0 +1,112 @@
+"""A dropped download resumes from the part file, against the simulated logger"""
+
+import asyncio
+import os
+
+from form24.framing import FRAME_DATA, parse_frame
+from form24.protocol import CMD_GET_FILE, CMD_GET_FILE_RANGE
+from form24.simulator import LinkConditions, SimulatedClient, SimulatedLogger
+from form24.transfer import TransferEngine
+
+FILENAME = "IMU_0_00-01-00.csv"
+
+
+def drop_data_frame(logger, number):
+    """Make the logger lose its number-th data frame, once, as a lossy link would"""
+    send = logger.send
+    seen = [0]
+
+    def lossy_send(data):
+        if logger.framed and parse_frame(data).type == FRAME_DATA:
+            seen[0] += 1
+            if seen[0] == number:
+                logger.sequence += 1
+                return
+        send(data)
+
+    logger.send = lossy_send
+
+
+def record_commands(logger):
+    commands = []
+    handle = logger.handle_command
+
+    def recording(data):
+        commands.append(bytes(data).decode())
+        handle(data)
+
+    logger.handle_command = recording
+    return commands
+
+
+async def download(logger, directory, link=None, adaptive=True):
+    client = SimulatedClient(logger, link)
+    await client.connect()
+    engine = TransferEngine(directory, adaptive=adaptive)
+    await engine.attach(client)
+    try:
+        return engine, await engine.download(FILENAME)
+    finally:
+        await engine.detach()
+        await client.disconnect()
+
+
+def test_dropped_transfer_resumes_from_offset(tmp_path):
+    content = os.urandom(50_000)
+    logger = SimulatedLogger({FILENAME: content}, start_delay=0, chunk_interval=0)
+    drop_data_frame(logger, 20)
+    commands = record_commands(logger)
+
+    engine, path = asyncio.run(download(logger, str(tmp_path)))
+
+    with open(path, "rb") as f:
+        assert f.read() == content
+    assert not os.path.exists(path + ".part")
+    requests = [command for command in commands if command[0] in (CMD_GET_FILE, CMD_GET_FILE_RANGE)]
+    assert requests[0] == f"{CMD_GET_FILE}{FILENAME}"
+    assert len(requests) == 2 and requests[1].startswith(CMD_GET_FILE_RANGE)
+    offset, _, name = requests[1][1:].partition(":")
+    assert name == FILENAME and 0 < int(offset) < len(content)
+    assert engine.metrics.retries == 1
+
+
+def test_resume_after_disconnect(tmp_path):
+    # The part file of a download cut off by a disconnect is picked up by the next one
+    content = os.urandom(50_000)
+    logger = SimulatedLogger({FILENAME: content}, start_delay=0, chunk_interval=0.001)
+    commands = record_commands(logger)
+
+    async def interrupted():
+        client = SimulatedClient(logger)
+        await client.connect()
+        engine = TransferEngine(str(tmp_path))
+        await engine.attach(client)
+        task = asyncio.create_task(engine.download(FILENAME))
+        while engine.bytes_received < len(content) // 3:
+            await asyncio.sleep(0.001)
+        await engine.detach()
+        await client.disconnect()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(interrupted())
+    part = os.path.join(str(tmp_path), FILENAME + ".part")
+    saved = os.path.getsize(part)
+    assert 0 < saved < len(content)
+
+    _, path = asyncio.run(download(logger, str(tmp_path)))
+    with open(path, "rb") as f:
+        assert f.read() == content
+    assert f"{CMD_GET_FILE_RANGE}{saved}:{FILENAME}" in commands
+
+
+def test_lossy_link_keeps_resuming_while_it_makes_progress(tmp_path):
+    # Far more losses than retries, but every resume saves more of the file
+    content = os.urandom(400_000)
+    logger = SimulatedLogger({FILENAME: content}, start_delay=0, chunk_interval=0)
+    link = LinkConditions(loss=0.02, seed=1)
+
+    engine, path = asyncio.run(download(logger, str(tmp_path), link, adaptive=False))
+
+    with open(path, "rb") as f:
+        assert f.read() == content
+    assert engine.metrics.retries > 3